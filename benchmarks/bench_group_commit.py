@@ -0,0 +1,73 @@
+"""
+Order write throughput with one commit per write against group commit.
+
+Each of N writer threads creates orders (add_order followed by add_txid) as fast as it
+can for a fixed time, first with every write in its own transaction and then with
+writes sent through db.enable_group_commit().
+
+Usage: python benchmarks/bench_group_commit.py [threads] [seconds]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from sub_ln.database import archive, db
+from sub_ln.database.storage import open_storage
+
+
+def writer(deadline, counts, index):
+    done = 0
+    while time.perf_counter() < deadline:
+        uuid = str(uuid4())
+        try:
+            db.add_order(uuid=uuid, message="", network="testnet")
+            db.add_txid(uuid=uuid, txid=uuid)
+        except OperationalError:
+            # "database is locked" once the busy timeout expires
+            continue
+        done += 1
+    counts[index] = done
+
+
+def run(threads, seconds, group_commit):
+    with tempfile.TemporaryDirectory() as tmp:
+        archive.engine = create_engine(f"sqlite:///{os.path.join(tmp, 'archive.db')}")
+        db.storage = open_storage(os.path.join(tmp, "bench.db"))
+        db.init()
+        if group_commit:
+            db.enable_group_commit(max_batch=64, max_delay=0.002)
+        counts = [0] * threads
+        deadline = time.perf_counter() + seconds
+        workers = [
+            threading.Thread(target=writer, args=(deadline, counts, i))
+            for i in range(threads)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        stats = db.group_commit_stats()
+        db.disable_group_commit()
+        mean_batch = stats[0]["mean_batch"] if stats else 1
+        return sum(counts) / seconds, mean_batch
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{threads} writer threads, {seconds}s per run")
+    print(f"{'mode':>14} {'orders/s':>10} {'writes/commit':>14}")
+    for name, group_commit in (("per-statement", False), ("group commit", True)):
+        rate, mean_batch = run(threads, seconds, group_commit)
+        print(f"{name:>14} {rate:>10.1f} {mean_batch:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Page-fetch latency of db.list_orders() at increasing depths of a large orders table.
+
+Populates a temporary database with N orders (default 2,000,000) spread across both
+networks and all states, then times fetching one page at several depths using the
+keyset cursor, with OFFSET pagination shown alongside for comparison.
+
+Usage: python benchmarks/bench_order_pagination.py [n_orders]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import and_, func, select
+
+from sub_ln.database import archive, db
+from sub_ln.database.storage import SQLiteStorage
+
+PAGE_SIZE = 50
+REPEATS = 20
+BATCH = 50_000
+
+
+def populate(n_orders):
+    start = int(time.time()) - n_orders
+    conn = db.storage.engines[0].connect()
+    for offset in range(0, n_orders, BATCH):
+        rows = [
+            {
+                "uuid": str(uuid4()),
+                "message": "",
+                "network": "mainnet" if i % 3 else "testnet",
+                "state": db.ORDER_STATES[i % len(db.ORDER_STATES)],
+                "created_at": start + i,
+                "updated_at": start + i,
+                "txid": f"{i:064x}",
+            }
+            for i in range(offset, min(offset + BATCH, n_orders))
+        ]
+        with conn.begin():
+            conn.execute(db.orders.insert(), rows)
+
+
+def cursor_at(depth, **filters):
+    s = select([db.orders.c.created_at, db.orders.c.uuid])
+    for name, value in filters.items():
+        s = s.where(db.orders.c[name] == value)
+    s = s.order_by(db.orders.c.created_at.desc(), db.orders.c.uuid.desc())
+    row = db.storage.engines[0].execute(s.offset(depth).limit(1)).fetchone()
+    return db.make_cursor(*row)
+
+
+def timed(func):
+    samples = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def offset_page(depth, **filters):
+    s = select([db.orders])
+    for name, value in filters.items():
+        s = s.where(db.orders.c[name] == value)
+    s = s.order_by(db.orders.c.created_at.desc(), db.orders.c.uuid.desc())
+    db.storage.engines[0].execute(s.offset(depth).limit(PAGE_SIZE)).fetchall()
+
+
+def main():
+    n_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        archive.engine = create_engine(f"sqlite:///{os.path.join(tmp, 'archive.db')}")
+        db.storage = SQLiteStorage(os.path.join(tmp, "bench.db"))
+        db.init()
+        t0 = time.perf_counter()
+        populate(n_orders)
+        print(f"populated {n_orders} orders in {time.perf_counter() - t0:.1f}s\n")
+
+        for filters in ({}, {"network": "mainnet"}, {"state": db.STATE_SWAP_FUNDED}):
+            label = ", ".join(f"{k}={v}" for k, v in filters.items()) or "no filter"
+            total = (
+                db.storage.engines[0]
+                .execute(
+                    select([func.count()])
+                    .select_from(db.orders)
+                    .where(and_(*(db.orders.c[k] == v for k, v in filters.items())))
+                )
+                .scalar()
+            )
+            depths = sorted({0, min(1_000, total // 2), total // 10, total - PAGE_SIZE})
+            print(f"{label}\n{'depth':>12} {'keyset ms':>10} {'offset ms':>10}")
+            for depth in depths:
+                after = cursor_at(depth - 1, **filters) if depth else None
+                keyset = timed(
+                    lambda: db.list_orders(after=after, limit=PAGE_SIZE, **filters)
+                )
+                offset = timed(lambda: offset_page(depth, **filters))
+                print(f"{depth:>12} {keyset:>10.3f} {offset:>10.3f}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
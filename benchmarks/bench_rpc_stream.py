@@ -0,0 +1,80 @@
+"""
+Compare peak memory of the buffered and streaming JSON-RPC response decoders.
+
+A synthetic `listunspent` style response is written to a temporary file and parsed both
+ways. The buffered path's peak grows with the response size while the streaming path
+stays flat.
+
+Usage: python benchmarks/bench_rpc_stream.py [max_items]
+"""
+
+import decimal
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sub_ln.bitcoin.streaming import iter_result
+
+
+def make_response(path, n_items):
+    with open(path, "w") as f:
+        f.write('{"result":[')
+        for i in range(n_items):
+            if i:
+                f.write(",")
+            json.dump(
+                {
+                    "txid": f"{i:064x}",
+                    "vout": i % 4,
+                    "address": "2N8hwP1WmJrFF5QWABn38y63uYLhnJYJYTF",
+                    "label": "",
+                    "scriptPubKey": "a914" + "ab" * 20 + "87",
+                    "amount": 0.00012345,
+                    "confirmations": i,
+                    "spendable": True,
+                    "solvable": True,
+                    "safe": True,
+                },
+                f,
+            )
+        f.write('],"error":null,"id":1}')
+
+
+def buffered(path):
+    with open(path, "rb") as f:
+        response = json.loads(f.read().decode("utf8"), parse_float=decimal.Decimal)
+    return sum(1 for _ in response["result"])
+
+
+def streamed(path):
+    with open(path, "rb") as f:
+        return sum(1 for _ in iter_result(f))
+
+
+def measure(func, path):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    count = func(path)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    max_items = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    sizes = [max_items // 100, max_items // 10, max_items]
+    print(f"{'items':>10} {'mode':>10} {'seconds':>10} {'peak MiB':>10}")
+    for n in sizes:
+        with tempfile.NamedTemporaryFile(suffix=".json") as tmp:
+            make_response(tmp.name, n)
+            for name, func in (("buffered", buffered), ("streamed", streamed)):
+                count, elapsed, peak = measure(func, tmp.name)
+                assert count == n
+                print(f"{n:>10} {name:>10} {elapsed:>10.3f} {peak / 2**20:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Order write throughput with the database split across 1, 2, 4 and 8 shards.
+
+Each of N writer threads creates orders (add_order followed by add_txid, two separate
+commits) as fast as it can for a fixed time.
+
+Usage: python benchmarks/bench_sharded_writes.py [threads] [seconds]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from sub_ln.database import archive, db
+from sub_ln.database.storage import open_storage
+
+
+def writer(deadline, counts, index):
+    done = 0
+    while time.perf_counter() < deadline:
+        uuid = str(uuid4())
+        try:
+            db.add_order(uuid=uuid, message="", network="testnet")
+            db.add_txid(uuid=uuid, txid=uuid)
+        except OperationalError:
+            # "database is locked" once the busy timeout expires
+            continue
+        done += 1
+    counts[index] = done
+
+
+def run(shards, threads, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        archive.engine = create_engine(f"sqlite:///{os.path.join(tmp, 'archive.db')}")
+        db.storage = open_storage(os.path.join(tmp, "bench.db"), shards)
+        db.init()
+        counts = [0] * threads
+        deadline = time.perf_counter() + seconds
+        workers = [
+            threading.Thread(target=writer, args=(deadline, counts, i))
+            for i in range(threads)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return sum(counts) / seconds
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{threads} writer threads, {seconds}s per run")
+    print(f"{'shards':>8} {'orders/s':>10}")
+    for shards in (1, 2, 4, 8):
+        print(f"{shards:>8} {run(shards, threads, seconds):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Server start-up time with an import-time breakdown.
+
+Runs a fresh interpreter (so nothing is already imported) under `python -X importtime`
+which builds the app with create_app() and serves one request through the test client.
+Reports the time to import, to build the app, to the first response and the slowest
+imports by cumulative time. Upstream clients are constructed lazily so don't show up
+here. `-X importtime` needs Python 3.7, on 3.6 only the timings are reported.
+
+Usage: python benchmarks/bench_startup.py [runs] [top]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import time
+t0 = time.perf_counter()
+from sub_ln.server.server import create_app
+t1 = time.perf_counter()
+app = create_app(start_background=False)
+t2 = time.perf_counter()
+app.test_client().get("/api/v1/util/random_message")
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+# python 3.6 has no -X importtime
+IMPORTTIME = sys.version_info >= (3, 7)
+
+
+def run_once(tmp):
+    flags = ["-X", "importtime"] if IMPORTTIME else []
+    result = subprocess.run(
+        [sys.executable, *flags, "-c", CHILD],
+        cwd=tmp,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    timings = [float(t) for t in result.stdout.split()[-3:]]
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return timings, imports
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    with tempfile.TemporaryDirectory() as tmp:
+        # DB_PATH is relative to the working directory
+        os.mkdir(os.path.join(tmp, "database"))
+        results = [run_once(tmp) for _ in range(runs)]
+
+    timings = sorted(results, key=lambda r: sum(r[0]))[len(results) // 2]
+    imported, created, first = timings[0]
+    print(f"median of {runs} runs")
+    print(f"  import server    {imported * 1000:8.1f} ms")
+    print(f"  create_app()     {created * 1000:8.1f} ms")
+    print(f"  first response   {first * 1000:8.1f} ms")
+    print(f"  total            {sum(timings[0]) * 1000:8.1f} ms\n")
+
+    if not IMPORTTIME:
+        return
+    print("slowest imports (cumulative ms)")
+    for cumulative, name in sorted(timings[1], reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
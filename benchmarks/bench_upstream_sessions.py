@@ -0,0 +1,105 @@
+"""
+Upstream call latency with a new connection per call against a pooled session.
+
+A local keep-alive HTTP server stands in for the swap service. A client module calling
+requests.get() directly, like the swap service and Blocksat clients do, is timed first
+as-is and then after sessions.inject() has given it a pooled session.
+
+This uses plain HTTP on localhost, so it only shows the TCP connection setup saved per
+call. Against the real HTTPS upstreams each reused connection also skips a TLS handshake
+and the network round trips, so the difference is much larger.
+
+Usage: python benchmarks/bench_upstream_sessions.py [calls] [threads]
+"""
+
+import socketserver
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from sub_ln.api.sessions import PooledSession, inject
+
+
+# http.server.ThreadingHTTPServer is only in python 3.7+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response on a
+    # kept-alive connection waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def client_module(url):
+    module = types.ModuleType("fake_client")
+    module.requests = requests
+
+    def get_status():
+        return module.requests.get(url, timeout=5).json()
+
+    module.get_status = get_status
+    return module
+
+
+def run(module, calls, threads):
+    latencies = []
+
+    def call(_):
+        start = time.perf_counter()
+        module.get_status()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (
+        calls / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[-len(latencies) // 100],
+    )
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    server = _Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/status"
+
+    print(f"{calls} calls from {threads} threads")
+    print(f"{'mode':>16} {'calls/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    module = client_module(url)
+    rate, p50, p99 = run(module, calls, threads)
+    print(f"{'per-call':>16} {rate:>10.1f} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+
+    module = client_module(url)
+    pooled = PooledSession("bench", pool_maxsize=threads)
+    inject(module, pooled)
+    rate, p50, p99 = run(module, calls, threads)
+    print(f"{'pooled session':>16} {rate:>10.1f} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+    print(f"connections opened by pooled session: {pooled.stats()['connections']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Per-client admission control for the API.
+
+Clients are identified by their remote address. A mesh gateway which authenticates
+with its token from EVENTS_GATEWAY_TOKENS can name the node each request is relayed
+for in the X-Client-Id header, and each of its nodes is then a client of its own. The
+header is ignored otherwise, so a client can't get a fresh allowance by changing it.
+Every endpoint belongs to a class with its own token bucket per client, so one node creating orders as fast as it can does not
+use up another node's allowance. Requests within their rate limit then share a fixed
+number of concurrent slots. When every slot is busy they wait in a bounded queue which
+is served round-robin across clients, so a client with many queued requests only gets
+one slot for each slot given to every other waiting client. Requests over the rate limit
+or arriving to a full queue are rejected straight away with 429 and a Retry-After
+header rather than being left to time out. A token is only taken once the request is
+admitted or queued.
+"""
+
+import hmac
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import current_app, g, make_response, request
+
+from sub_ln.server.server_config import EVENTS_GATEWAY_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Endpoints not listed here (readiness and stats) are never limited
+ENDPOINT_CLASSES = {
+    "/api/v1/order/create": "order",
+    "/api/v1/blocksat/bump": "order",
+    "/api/v1/bitcoin/new_address": "swap",
+    "/api/v1/swap/lookup_invoice": "swap",
+    "/api/v1/swap/check_refund_addr": "swap",
+    "/api/v1/swap/quote": "swap",
+    "/api/v1/swap/pay": "swap",
+    "/api/v1/swap/check": "read",
+    "/api/v1/order/estimate": "read",
+    "/api/v1/order/list": "read",
+    "/api/v1/order/lookup": "read",
+    "/api/v1/util/random_message": "read",
+    "/api/v1/events": "read",
+}
+
+# Buckets which have not been used for this long are forgotten
+BUCKET_IDLE_SECONDS = 600
+
+
+def gateway_id(req, warn=True):
+    """
+    The mesh gateway a request was relayed by, None if it doesn't say or doesn't send
+    its token from EVENTS_GATEWAY_TOKENS.
+    """
+    gateway = req.headers.get("X-Gateway-Id")
+    if not gateway:
+        return None
+    scheme, _, token = req.headers.get("Authorization", "").partition(" ")
+    expected = EVENTS_GATEWAY_TOKENS.get(gateway)
+    if (
+        expected is None
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode("utf8"), expected.encode("utf8"))
+    ):
+        if warn:
+            logger.warning(f"Gateway {gateway!r} didn't send its token")
+        return None
+    return gateway
+
+
+def client_id(req):
+    """The client a request counts against, see the module docstring."""
+    gateway = gateway_id(req, warn=False)
+    if gateway is not None:
+        return f"{gateway}/{req.headers.get('X-Client-Id', '')}"
+    return req.remote_addr or "unknown"
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        """Seconds until a token is available, 0 if one is."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Take the token wait() found available."""
+        self.tokens -= 1
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    rates maps an endpoint class to (requests per second, burst) for each client.
+    At most `max_concurrent` admitted requests run at once and up to `queue_size` more
+    wait up to `queue_timeout` seconds for a slot.
+    """
+
+    def __init__(self, rates, max_concurrent=16, queue_size=64, queue_timeout=5.0):
+        self.rates = rates
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self._buckets = {}
+        self._swept = time.monotonic()
+        # client -> deque of waiters, in the order clients are next to be served
+        self._waiting = OrderedDict()
+        self._counts = {
+            cls: {
+                "admitted": 0,
+                "queued": 0,
+                "rate_limited": 0,
+                "queue_full": 0,
+                "timed_out": 0,
+            }
+            for cls in rates
+        }
+        self._lock = threading.Lock()
+
+    def _bucket(self, client, cls, now):
+        bucket = self._buckets.get((client, cls))
+        if bucket is None:
+            rate, burst = self.rates[cls]
+            bucket = self._buckets[(client, cls)] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _sweep(self, now):
+        if now - self._swept < BUCKET_IDLE_SECONDS:
+            return
+        self._swept = now
+        for key, bucket in list(self._buckets.items()):
+            # untouched for this long, the bucket has refilled
+            if now - bucket.updated >= BUCKET_IDLE_SECONDS:
+                del self._buckets[key]
+
+    def admit(self, client, cls):
+        """
+        Block until the request may run, raising Rejected if it may not. Every
+        successful admit() must be followed by release().
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            bucket = self._bucket(client, cls, now)
+            wait = bucket.wait(now)
+            if wait:
+                self._counts[cls]["rate_limited"] += 1
+                raise Rejected("rate limited", wait)
+            if self.in_flight < self.max_concurrent and not self.queued:
+                bucket.take()
+                self.in_flight += 1
+                self._counts[cls]["admitted"] += 1
+                return
+            if self.queued >= self.queue_size:
+                # turned away without using up the client's allowance
+                self._counts[cls]["queue_full"] += 1
+                raise Rejected("server busy", 1)
+            bucket.take()
+            waiter = _Waiter()
+            self._waiting.setdefault(client, deque()).append(waiter)
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            self._counts[cls]["queued"] += 1
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if not waiter.granted:
+                # timed out, withdraw from the queue
+                self._waiting[client].remove(waiter)
+                if not self._waiting[client]:
+                    del self._waiting[client]
+                self.queued -= 1
+                self._counts[cls]["timed_out"] += 1
+                raise Rejected("server busy", 1)
+            self._counts[cls]["admitted"] += 1
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self.in_flight -= 1
+                return
+            # hand the slot straight to the next client in turn, who then moves to the
+            # back of the line
+            client, waiters = next(iter(self._waiting.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            self.queued -= 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "queue_size": self.queue_size,
+                "waiting_clients": len(self._waiting),
+                "tracked_buckets": len(self._buckets),
+                "classes": {cls: dict(counts) for cls, counts in self._counts.items()},
+            }
+
+
+def release_early():
+    """
+    Give up the current request's concurrency slot, for requests about to spend a long
+    time waiting rather than working, like long polls.
+    """
+    if g.pop("admitted", False):
+        current_app.extensions["admission"].release()
+
+
+def install(app, controller):
+    """Apply controller to every request handled by app."""
+
+    @app.before_request
+    def _admit():
+        cls = ENDPOINT_CLASSES.get(request.path)
+        if cls is None:
+            return None
+        client = client_id(request)
+        try:
+            controller.admit(client, cls)
+        except Rejected as e:
+            logger.debug(f"Rejected {request.path} from {client}: {e.reason}")
+            response = make_response({"error": e.reason}, 429)
+            response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+            return response
+        g.admitted = True
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        if g.pop("admitted", False):
+            controller.release()
@@ -1,24 +1,30 @@
+import json
 import logging
+import time
 from json.decoder import JSONDecodeError
 from uuid import uuid4
 
-from blocksat_api import blocksat
-from flask import jsonify, make_response
-from flask_restful import Resource, reqparse
-from submarine_api import submarine
-
-from sub_ln.bitcoin import AuthServiceProxy, JSONRPCException
-from sub_ln.database import db
-from sub_ln.server.server_config import RPC_HOST, RPC_PASSWORD, RPC_PORT, RPC_USER
+from flask import Response, current_app, jsonify, make_response, request
+from flask_restful import Resource, inputs, reqparse
+from sqlalchemy.exc import IntegrityError
+
+from sub_ln.api import admission, upstream
+from sub_ln.api.admission import gateway_id
+from sub_ln.api.dedup import message_digest
+from sub_ln.api.watcher import update_swap
+from sub_ln.bitcoin import JSONRPCException, fees
+from sub_ln.bitcoin.coin_pool import FundingUnknown
+from sub_ln.database import db, events
+from sub_ln.server.server_config import (
+    EVENTS_KEEPALIVE,
+    FUNDING_DEADLINE_MARGIN,
+    FUNDING_MAX_CONF_TARGET,
+    SWAP_CHECK_MAX_WAIT,
+    SWAP_CHECK_POLL_INTERVAL,
+)
 from sub_ln.utilities import create_random_message
 
 logger = logging.getLogger(__name__)
-FORMAT = "[%(asctime)s - %(levelname)s] - %(message)s"
-logging.basicConfig(level=logging.DEBUG, format=FORMAT)
-
-bitcoin_rpc = AuthServiceProxy(
-    f"http://{RPC_USER}:{RPC_PASSWORD}@{RPC_HOST}:{RPC_PORT}"
-)
 
 SAT_PER_BTC = 100_000_000
 
@@ -29,6 +35,67 @@ def prepare_response(result, field):
     return make_response(jsonify({field: result.text}), result.status_code)
 
 
+def conditional(response):
+    """Tag a successful response so clients polling with If-None-Match get a 304."""
+    if response.status_code == 200:
+        response.add_etag()
+        return response.make_conditional(request)
+    return response
+
+
+def swap_outcome_response(swap):
+    """Same shape as the swap server's check_status response, built from the db."""
+    if swap["state"] == db.STATE_SWAP_COMPLETE:
+        outcome = {
+            "payment_secret": swap["payment_secret"],
+            "transaction_id": swap["claim_txid"],
+        }
+    elif swap["state"] == db.STATE_REFUNDED:
+        outcome = {"refunded": True, "refund_txid": swap["refund_txid"]}
+    elif swap["state"] == db.STATE_REFUNDING:
+        outcome = {"refunding": True, "refund_txid": swap["refund_txid"]}
+    else:
+        outcome = {
+            "refundable": True,
+            "timeout_block_height": swap["timeout_block_height"],
+        }
+    return make_response(
+        jsonify({"swap_check": json.dumps(outcome), "state": swap["state"]}), 200
+    )
+
+
+def event_stream(gateway, after):
+    """A gateway's events from events.subscribe() as server-sent events."""
+    # sent straight away, so the client isn't left waiting for the response headers
+    yield ": connected\n\n"
+    for event in events.subscribe(gateway, after, EVENTS_KEEPALIVE):
+        if event is None:
+            yield ": keep-alive\n\n"
+            continue
+        data = dict(event["data"], uuid=event["uuid"], created_at=event["created_at"])
+        yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+def no_rpc_response(network):
+    return make_response(
+        {"error": f"No bitcoind backend configured for network {network!r}"}, 400
+    )
+
+
+def dedup_response(original):
+    """The public details of the Blocksat order a duplicate message was linked to."""
+    return {
+        "uuid": original["blocksat_uuid"],
+        "lightning_invoice": {
+            "id": original["id"],
+            "msatoshi": original["msatoshi"],
+            "status": original["status"],
+            "expires_at": original["expires_at"],
+            "metadata": {"sha256_message_digest": original["sha256_message_digest"]},
+        },
+    }
+
+
 class Rand64ByteMsg(Resource):
     """
     Returns a 64 byte random message for testing.
@@ -62,9 +129,14 @@ class SwapLookupInvoice(Resource):
 
     def get(self):
         args = self.reqparse.parse_args(strict=True)
-        result = submarine.get_invoice_details(
-            invoice=args["invoice"], network=args["network"]
+        # usually already looked up in the background after the order was created
+        result = current_app.extensions["prefetch"].lookup_invoice(
+            args["invoice"], args["network"]
         )
+        if result is None:
+            result = upstream.submarine().get_invoice_details(
+                invoice=args["invoice"], network=args["network"]
+            )
         return prepare_response(result, "invoice")
 
 
@@ -82,7 +154,7 @@ class SwapCheckRefundAddress(Resource):
 
     def get(self):
         args = self.reqparse.parse_args(strict=True)
-        result = submarine.get_address_details(
+        result = upstream.submarine().get_address_details(
             address=args["address"], network=args["network"]
         )
         return prepare_response(result, "address")
@@ -111,28 +183,67 @@ class CreateOrder(Resource):
         # process inputs
         args = self.reqparse.parse_args(strict=True)
         if args["network"].strip().lower() == "testnet":
-            satellite_url = blocksat.TESTNET_SATELLITE_API
+            satellite_url = upstream.blocksat().TESTNET_SATELLITE_API
         elif args["network"].strip().lower() == "mainnet":
-            satellite_url = blocksat.SATELLITE_API
+            satellite_url = upstream.blocksat().SATELLITE_API
         else:
             return make_response(
                 {"error": "Please provide a valid network ('testnet' or 'mainnet'"}, 400
             )
         msg = args["message"]
         uuid = str(uuid4())
-        # add to the "orders" db
-        db.add_order(uuid=uuid, message=msg, network=args["network"])
-        result = blocksat.place(
-            message=args["message"], bid=args["bid"], satellite_url=satellite_url
-        )
-        # add to the database "blocksat" db if order was successful
-        if result.status_code == 200:
-            try:
-                db.add_blocksat(
-                    uuid=uuid, satellite_url=satellite_url, result=result.json()
+        dedup = current_app.extensions["dedup"]
+        digest = message_digest(msg)
+        with dedup.placing(digest):
+            # link to an existing order for the same message instead of paying again
+            original = dedup.find(digest, satellite_url)
+            if original is not None:
+                db.add_order(
+                    uuid=uuid,
+                    message=msg,
+                    network=args["network"],
+                    dedup_of=original["uuid"],
+                    gateway=gateway_id(request),
+                )
+                return make_response(
+                    jsonify(
+                        {
+                            "order": dedup_response(original),
+                            "uuid": uuid,
+                            "dedup_of": original["uuid"],
+                        }
+                    ),
+                    200,
+                )
+            # add to the "orders" db
+            db.add_order(
+                uuid=uuid,
+                message=msg,
+                network=args["network"],
+                gateway=gateway_id(request),
+            )
+            result = upstream.blocksat().place(
+                message=args["message"], bid=args["bid"], satellite_url=satellite_url
+            )
+            # add to the database "blocksat" db if order was successful
+            if result.status_code == 200:
+                try:
+                    db.add_blocksat(
+                        uuid=uuid, satellite_url=satellite_url, result=result.json()
+                    )
+                except Exception as e:
+                    raise jsonify({"exception": e, "result": result})
+                invoice = result.json()["lightning_invoice"]
+                events.publish(
+                    uuid,
+                    "blocksat_placed",
+                    msatoshi=int(invoice["msatoshi"]),
+                    expires_at=invoice["expires_at"],
+                )
+                # start the swap steps the client will ask for next
+                current_app.extensions["prefetch"].start(
+                    uuid, result.json()["lightning_invoice"]["payreq"], args["network"]
                 )
-            except Exception as e:
-                raise jsonify({"exception": e, "result": result})
 
         # create response with two fields, lazy way
         try:
@@ -146,6 +257,42 @@ class CreateOrder(Resource):
         return make_response(jsonify({field: response, "uuid": uuid}), code)
 
 
+class OrderEstimate(Resource):
+    """
+    Estimate the total cost in satoshis of sending a message, without placing an order.
+
+    Pass either the message itself or its size in bytes. The estimate is worked out from
+    recent orders and fee rates cached by the server, so it may differ from the real
+    Blocksat bid and swap quote.
+    """
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        location = ("json", "args")
+        self.reqparse.add_argument("message", type=str, location=location)
+        self.reqparse.add_argument("message_size", type=int, location=location)
+        self.reqparse.add_argument("network", type=str, location=location)
+        super(OrderEstimate, self).__init__()
+
+    def get(self):
+        args = self.reqparse.parse_args(strict=True)
+        if args["message"] is not None:
+            size = len(args["message"].encode("utf8"))
+        elif args["message_size"] is not None and args["message_size"] > 0:
+            size = args["message_size"]
+        else:
+            return make_response(
+                {"error": "Please provide a message or a positive message_size"}, 400
+            )
+        network = (args["network"] or "").strip().lower()
+        estimate = upstream.fee_model().estimate(network, size)
+        if estimate is None:
+            return make_response(
+                {"error": f"No estimate available for network {network!r}"}, 503
+            )
+        return make_response(jsonify({"estimate": estimate}), 200)
+
+
 class BlocksatBump(Resource):
     """
     Bump the fee associated with an existing blocksat order.
@@ -162,7 +309,7 @@ class BlocksatBump(Resource):
         # lookup the order from blocksat table
         blocksat_uuid, auth_token, satellite_url = db.lookup_bump(uuid=args["uuid"])
         # bump the order using the details
-        result = blocksat.bump_order(
+        result = upstream.blocksat().bump_order(
             uuid=blocksat_uuid,
             auth_token=auth_token,
             bid_increase=args["bid_increase"],
@@ -185,8 +332,16 @@ class GetRefundAddress(Resource):
 
     def get(self):
         args = self.reqparse.parse_args(strict=True)
-        # get a new bitcoin address from rpc
-        result = bitcoin_rpc.getnewaddress("", args["type"])
+        network = db.lookup_network(args["uuid"])
+        bitcoin_rpc = upstream.rpc_pool(network)
+        if bitcoin_rpc is None:
+            return no_rpc_response(network)
+        # get a new bitcoin address from rpc, unless one was prefetched
+        result = current_app.extensions["prefetch"].new_address(
+            args["uuid"], args["type"]
+        )
+        if result is None:
+            result = bitcoin_rpc.getnewaddress("", args["type"])
         # add it to the orders table
         try:
             db.add_refund_addr(uuid=args["uuid"], refund_addr=result)
@@ -211,17 +366,56 @@ class SwapQuote(Resource):
 
     def post(self):
         args = self.reqparse.parse_args(strict=True)
+        # a retry after the response to an earlier quote request was lost
+        stored = db.lookup_swap_quote(args["uuid"])
+        if stored is not None:
+            return self.stored_quote(stored, args["invoice"])
         # search the refund addr from the db
         refund_address = db.lookup_refund_addr(args["uuid"])[0]
         logger.debug({"args": args, "refund_address": refund_address})
-        result = submarine.get_quote(
-            network=args["network"], invoice=args["invoice"], refund=refund_address
+        result = current_app.extensions["prefetch"].quote(
+            args["uuid"], args["invoice"], args["network"], refund_address
         )
+        if result is None:
+            result = upstream.submarine().get_quote(
+                network=args["network"], invoice=args["invoice"], refund=refund_address
+            )
         # add the swap to the swap table
-        db.add_swap(uuid=args["uuid"], result=result.json())
-        logger.debug(result.json())
+        swap = result.json()
+        try:
+            db.add_swap(uuid=args["uuid"], result=swap)
+        except IntegrityError:
+            # a concurrent request for the same order got its quote in first
+            return self.stored_quote(
+                db.lookup_swap_quote(args["uuid"]), args["invoice"]
+            )
+        events.publish(
+            args["uuid"],
+            "swap_quoted",
+            swap_amount=swap.get("swap_amount"),
+            timeout_block_height=swap.get("timeout_block_height"),
+        )
+        tracker = upstream.confirmation_tracker(args["network"])
+        if tracker is not None:
+            tracker.watch(
+                args["uuid"],
+                addresses=(
+                    swap.get("swap_p2sh_address"),
+                    swap.get("swap_p2sh_p2wsh_address"),
+                    swap.get("swap_p2wsh_address"),
+                ),
+            )
+        logger.debug(swap)
         return prepare_response(result, "swap")
 
+    @staticmethod
+    def stored_quote(swap, invoice):
+        if swap["invoice"] != invoice:
+            return make_response(
+                {"error": "The order already has a swap for a different invoice"}, 409
+            )
+        return make_response(jsonify({"swap": json.dumps(swap)}), 200)
+
 
 class SwapPay(Resource):
     """
@@ -235,12 +429,62 @@ class SwapPay(Resource):
 
     def post(self):
         args = self.reqparse.parse_args(strict=True)
-        swap_amount, swap_p2sh_address = db.lookup_pay_details(args["uuid"])
+        network = db.lookup_network(args["uuid"])
+        bitcoin_rpc = upstream.rpc_pool(network)
+        if bitcoin_rpc is None:
+            return no_rpc_response(network)
+        swap_amount, swap_p2sh_address, timeout_block_height = db.lookup_pay_details(
+            args["uuid"]
+        )
         swap_amount_bitcoin = swap_amount / SAT_PER_BTC
         logger.debug(f"swap_amount_bitcoin: {swap_amount_bitcoin}")
-        txid = bitcoin_rpc.sendtoaddress(swap_p2sh_address, swap_amount_bitcoin)
+        # aim to confirm with time to spare before the swap times out
+        tracker = upstream.confirmation_tracker(network)
+        height = tracker.height if tracker is not None else None
+        if height is None:
+            height = bitcoin_rpc.getblockcount()
+        blocks_left = fees.blocks_to_deadline(
+            timeout_block_height, height, FUNDING_DEADLINE_MARGIN
+        )
+        if blocks_left < 1:
+            return make_response(
+                {
+                    "error": f"Swap times out at block {timeout_block_height}, too soon "
+                    f"to fund it, please request a new quote"
+                },
+                400,
+            )
+        conf_target = fees.conf_target(blocks_left, FUNDING_MAX_CONF_TARGET)
+        # fund from a pre-split coin where possible, skipping wallet coin selection
+        coin_pool = upstream.coin_pool(network)
+        txid = None
+        if coin_pool is not None:
+            try:
+                txid = coin_pool.fund(
+                    args["uuid"], swap_p2sh_address, swap_amount, conf_target
+                )
+            except FundingUnknown as e:
+                # paying again could pay twice, retrying resends the same transaction
+                logger.error(str(e))
+                return make_response(
+                    {"error": f"{e}, please retry swap/pay later"}, 503
+                )
+        # only when nothing was sent from the pool
+        if txid is None:
+            txid = bitcoin_rpc.sendtoaddress(
+                swap_p2sh_address,
+                swap_amount_bitcoin,
+                "",
+                "",
+                False,
+                # replaceable, so the fee can be bumped if the deadline gets close
+                True,
+                conf_target,
+            )
         try:
             db.add_txid(uuid=args["uuid"], txid=txid)
+            events.publish(args["uuid"], "swap_funded", txid=txid)
+            upstream.confirmation_tracker(network).watch(args["uuid"], txid=txid)
             response = make_response(jsonify({"txid": txid}), 200)
             field = "txid"
         except JSONRPCException as e:
@@ -254,18 +498,290 @@ class SwapCheck(Resource):
     """
     Check the swap. This will also check the funding status of swaps, prompting the server to pay an
     invoice for a newly-funded swap, although this also happens periodically automatically.
+
+    Long poll by passing the ETag of the last response in If-None-Match along with "wait":
+    the request is held for up to that many seconds until the status changes, rather than
+    returning 304 straight away.
+
+    The swap server is only asked once per request. While the request is held only the
+    order's own record is watched, so it doesn't need a concurrency slot. An outcome
+    recorded meanwhile (by the order watcher, a refund or another request) is returned
+    straight away, any other change to the order, like its funding confirming, ends the
+    wait with the 304 so the client asks again.
     """
 
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
         self.reqparse.add_argument("uuid", type=str, location="json")
+        self.reqparse.add_argument("wait", type=float, default=0, location="json")
         super(SwapCheck, self).__init__()
 
     def get(self):
         args = self.reqparse.parse_args(strict=True)
+        wait = min(max(args["wait"] or 0, 0), SWAP_CHECK_MAX_WAIT)
+        response = conditional(self.check(args["uuid"]))
+        if response.status_code != 304 or not wait:
+            return response
+        # nothing past here calls the swap server
+        admission.release_early()
+        swap = self.wait_for_change(args["uuid"], time.monotonic() + wait)
+        if swap is not None and swap["state"] in db.SWAP_RESOLVED_STATES:
+            return conditional(swap_outcome_response(swap))
+        return response
+
+    @staticmethod
+    def wait_for_change(uuid, deadline):
+        """Wait until the order's record changes, returns its swap or None at deadline."""
+
+        def version(swap):
+            return swap["state"], swap["updated_at"], swap["txid"]
+
+        initial = version(db.lookup_swap_check(uuid))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(SWAP_CHECK_POLL_INTERVAL, remaining))
+            swap = db.lookup_swap_check(uuid)
+            if version(swap) != initial:
+                return swap
+
+    @staticmethod
+    def check(uuid):
         # lookup swap details here
-        network, invoice, redeem_script = db.lookup_swap_details(args["uuid"])
-        result = submarine.check_status(
-            network=network, invoice=invoice, redeem_script=redeem_script
-        )
+        swap = db.lookup_swap_check(uuid)
+        if swap is None:
+            return make_response({"error": f"No swap for order {uuid}"}, 404)
+        # once the swap is settled it's served from the db without asking the swap
+        # server again. An expired swap is still asked about, it may yet be claimed.
+        if swap["state"] in db.SWAP_SETTLED_STATES:
+            return swap_outcome_response(swap)
+        result = update_swap(uuid, swap)
+        if swap["state"] in (db.STATE_SWAP_EXPIRED, db.STATE_REFUNDING):
+            return swap_outcome_response(swap)
         return prepare_response(result, "swap_check")
+
+
+class OrderEvents(Resource):
+    """
+    Stream the progress of every order relayed by the gateway in the X-Gateway-Id header
+    as server-sent events, so it doesn't need to poll swap/check. The gateway must send
+    its token as "Authorization: Bearer <token>".
+
+    Each event's data is JSON with the order's uuid. To resume after a disconnect pass
+    the id of the last event received in the Last-Event-ID header (EventSource does
+    this itself) or as last_event_id, 0 replays every event still kept. Without either
+    only new events are sent.
+    """
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument("last_event_id", type=int, location="args")
+        self.reqparse.add_argument(
+            "Last-Event-ID", type=int, location="headers", dest="header_event_id"
+        )
+        super(OrderEvents, self).__init__()
+
+    def get(self):
+        args = self.reqparse.parse_args(strict=True)
+        gateway = gateway_id(request)
+        if gateway is None:
+            response = make_response(
+                {"error": "X-Gateway-Id and the gateway's token are required"}, 401
+            )
+            response.headers["WWW-Authenticate"] = "Bearer"
+            return response
+        after = args["header_event_id"]
+        if after is None:
+            after = args["last_event_id"]
+        if after is None:
+            after = events.last_id()
+        return Response(
+            event_stream(gateway, after),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+class ListOrders(Resource):
+    """
+    List and search orders, newest first.
+
+    Results are paginated by cursor: pass the "next" value from one response as "after"
+    in the following request. Times are unix timestamps, "until" is exclusive.
+    """
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        location = ("json", "args")
+        self.reqparse.add_argument("network", type=str, location=location)
+        self.reqparse.add_argument(
+            "state", type=str, choices=db.ORDER_STATES, location=location
+        )
+        self.reqparse.add_argument("since", type=int, location=location)
+        self.reqparse.add_argument("until", type=int, location=location)
+        self.reqparse.add_argument("txid", type=str, location=location)
+        self.reqparse.add_argument("payment_hash", type=str, location=location)
+        self.reqparse.add_argument("after", type=str, location=location)
+        self.reqparse.add_argument("limit", type=int, default=50, location=location)
+        super(ListOrders, self).__init__()
+
+    def get(self):
+        args = self.reqparse.parse_args(strict=True)
+        try:
+            rows, next_cursor = db.list_orders(**args)
+        except ValueError as e:
+            return make_response({"error": str(e)}, 400)
+        return make_response(jsonify({"orders": rows, "next": next_cursor}), 200)
+
+
+class LookupOrder(Resource):
+    """
+    Return everything stored about an order, including orders which have been archived.
+    """
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument("uuid", type=str, location=("json", "args"))
+        super(LookupOrder, self).__init__()
+
+    def get(self):
+        args = self.reqparse.parse_args(strict=True)
+        record = db.lookup_order(args["uuid"])
+        if record is None:
+            return make_response({"error": f"Order {args['uuid']} not found"}, 404)
+        return make_response(jsonify({"order": record}), 200)
+
+
+class RPCStats(Resource):
+    """
+    Health, load and latency of each bitcoind backend, by network.
+    """
+
+    @staticmethod
+    def get():
+        stats = {
+            network: pool.stats() for network, pool in upstream.rpc_pools().items()
+        }
+        return make_response(jsonify(stats), 200)
+
+
+class UpstreamStats(Resource):
+    """
+    Latency, failures and circuit breaker state of the swap service and Blocksat clients,
+    and how often their HTTP connections are reused.
+    """
+
+    @staticmethod
+    def get():
+        stats = {}
+        for name, client in upstream.clients().items():
+            stats[name] = client.stats()
+            stats[name]["http"] = upstream.http_session(name).stats()
+        return make_response(jsonify(stats), 200)
+
+
+class DedupStats(Resource):
+    """
+    How many new orders were linked to an existing order for the same message.
+    """
+
+    @staticmethod
+    def get():
+        return make_response(jsonify(current_app.extensions["dedup"].stats()), 200)
+
+
+class CoinPoolStats(Resource):
+    """
+    Pre-split coins available for funding swaps, and how many swaps they've funded, by
+    network.
+    """
+
+    @staticmethod
+    def get():
+        stats = {
+            network: pool.stats() for network, pool in upstream.coin_pools().items()
+        }
+        return make_response(jsonify(stats), 200)
+
+
+class EventStats(Resource):
+    """
+    Gateways subscribed to the event stream, and events published.
+    """
+
+    @staticmethod
+    def get():
+        return make_response(jsonify(events.stats()), 200)
+
+
+class PrefetchStats(Resource):
+    """
+    How often the swap steps after creating an order were answered from a prefetch.
+    """
+
+    @staticmethod
+    def get():
+        return make_response(jsonify(current_app.extensions["prefetch"].stats()), 200)
+
+
+class ProfileStats(Resource):
+    """
+    Wall and CPU time of profiled requests by endpoint. With format=collapsed, returns
+    the sampled stacks in collapsed format for flame graph tools instead.
+    """
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        location = ("json", "args")
+        self.reqparse.add_argument(
+            "format",
+            type=str,
+            choices=("json", "collapsed"),
+            default="json",
+            location=location,
+        )
+        self.reqparse.add_argument("endpoint", type=str, location=location)
+        self.reqparse.add_argument(
+            "reset", type=inputs.boolean, default=False, location=location
+        )
+        super(ProfileStats, self).__init__()
+
+    def get(self):
+        args = self.reqparse.parse_args(strict=True)
+        profiler = current_app.extensions["profiler"]
+        if args["format"] == "collapsed":
+            response = make_response(
+                profiler.collapsed(args["endpoint"]),
+                200,
+                {"Content-Type": "text/plain; charset=utf-8"},
+            )
+        else:
+            response = make_response(jsonify(profiler.stats()), 200)
+        if args["reset"]:
+            profiler.reset()
+        return response
+
+
+class AdmissionStats(Resource):
+    """
+    Admission control queue depth, and requests admitted and rejected by endpoint class.
+    """
+
+    @staticmethod
+    def get():
+        return make_response(jsonify(current_app.extensions["admission"].stats()), 200)
+
+
+class Ready(Resource):
+    """
+    Readiness check. Returns 503 until the upstream clients have been constructed and
+    the bitcoind backends have responded.
+    """
+
+    @staticmethod
+    def get():
+        ready, components = upstream.readiness()
+        return make_response(
+            jsonify({"ready": ready, "components": components}), 200 if ready else 503
+        )
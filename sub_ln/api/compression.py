@@ -0,0 +1,40 @@
+"""Gzip responses for clients which accept it.
+
+Most clients reach the gateway over the goTenna mesh, where every byte costs airtime.
+JSON responses at least `min_size` bytes long are gzipped when the request's
+Accept-Encoding allows it. The ETag of a compressed response is made weak, so clients
+can keep sending it in If-None-Match whichever encoding they receive.
+"""
+
+import gzip
+
+from flask import request
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain")
+
+
+def install(app, min_size=200, level=6):
+    """Compress responses from app."""
+
+    @app.after_request
+    def _compress(response):
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or "gzip" not in request.accept_encodings
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers["Content-Encoding"] = "gzip"
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,73 @@
+"""Avoid paying to broadcast the same message twice.
+
+Mesh broadcasts and retransmissions mean the same message often reaches the gateway
+several times. Blocksat records the sha256 digest of each message, so before placing a
+new order we look for an order with the same digest placed within the last `window`
+seconds whose invoice has been paid. If there is one the new order is linked to it
+rather than uploaded again. An order which is only being paid, by a funded swap, is
+not used: the swap may still expire, leaving the message unsent.
+
+Identical messages arriving together are placed one at a time, so the second finds the
+order placed by the first.
+"""
+
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from sub_ln.database import db
+
+
+def message_digest(message):
+    return hashlib.sha256(message.encode("utf8")).hexdigest()
+
+
+class Deduplicator:
+    def __init__(self, window):
+        self.window = window
+        self.lookups = 0
+        self.hits = 0
+        self.msatoshi_saved = 0
+        # digest -> [lock, number of requests using it]
+        self._placing = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def placing(self, digest):
+        """Serialise placing orders for the same message."""
+        with self._lock:
+            entry = self._placing.setdefault(digest, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._placing[digest]
+
+    def find(self, digest, satellite_url):
+        """Return the existing Blocksat order for this message, or None."""
+        if not self.window:
+            return None
+        original = db.lookup_duplicate(
+            digest, satellite_url, since=int(time.time()) - self.window
+        )
+        with self._lock:
+            self.lookups += 1
+            if original is not None:
+                self.hits += 1
+                self.msatoshi_saved += original["msatoshi"] or 0
+        return original
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": self.window,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else None,
+                "msatoshi_saved": self.msatoshi_saved,
+            }
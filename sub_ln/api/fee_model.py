@@ -0,0 +1,136 @@
+"""Cached inputs for estimating the total cost of an order without any upstream calls.
+
+An order costs the Blocksat bid for the message, the swap service's fee for paying that
+invoice, and the on-chain fee for funding the swap. The Blocksat price per byte and the
+swap fee rate are taken from recent orders in the database and the on-chain fee rate
+from estimatesmartfee. A background thread refreshes these every `interval` seconds, so
+estimate() is only arithmetic on the latest snapshot.
+"""
+
+import http.client
+import logging
+import math
+import statistics
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.database import db
+
+logger = logging.getLogger(__name__)
+
+MSAT_PER_SAT = 1000
+SAT_PER_BTC = 100_000_000
+
+
+class FeeModel:
+    """
+    rpc_pools maps network to the RPCPool used for estimatesmartfee. The defaults are
+    used until there are recent orders (or a fee estimate) to base the model on.
+    """
+
+    def __init__(
+        self,
+        rpc_pools,
+        interval=60,
+        conf_target=6,
+        samples=100,
+        funding_vbytes=141,
+        default_msat_per_byte=50,
+        default_swap_fee_rate=0.01,
+        default_sat_per_vbyte=1,
+    ):
+        self.rpc_pools = rpc_pools
+        self.interval = interval
+        self.conf_target = conf_target
+        self.samples = samples
+        self.funding_vbytes = funding_vbytes
+        self.defaults = {
+            "msat_per_byte": default_msat_per_byte,
+            "swap_fee_rate": default_swap_fee_rate,
+            "sat_per_vbyte": default_sat_per_vbyte,
+        }
+        # network -> snapshot dict, replaced wholesale on each refresh so readers never
+        # need a lock
+        self._snapshots = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _sat_per_vbyte(self, network):
+        pool = self.rpc_pools.get(network)
+        if pool is None:
+            return None
+        try:
+            result = pool.estimatesmartfee(self.conf_target)
+        except (JSONRPCException, OSError, http.client.HTTPException) as e:
+            logger.warning(f"estimatesmartfee failed for {network}: {e}")
+            return None
+        if "feerate" not in result:
+            # not enough data in bitcoind yet
+            return None
+        # BTC/kvB to sat/vB
+        return float(result["feerate"]) * SAT_PER_BTC / 1000
+
+    def refresh_network(self, network):
+        bids, quotes = db.lookup_fee_samples(network, self.samples)
+        previous = self._snapshots.get(network, self.defaults)
+        snapshot = dict(previous)
+        per_byte = [msat / size for msat, size in bids if msat and size]
+        if per_byte:
+            snapshot["msat_per_byte"] = statistics.median(per_byte)
+        # swap_amount is the invoice amount plus swap_fee
+        rates = [
+            fee / (amount - fee) for _, fee, amount in quotes if amount and amount > fee
+        ]
+        if rates:
+            snapshot["swap_fee_rate"] = statistics.median(rates)
+        sat_per_vbyte = self._sat_per_vbyte(network)
+        if sat_per_vbyte is not None:
+            snapshot["sat_per_vbyte"] = sat_per_vbyte
+        snapshot["bid_samples"] = len(per_byte)
+        snapshot["swap_samples"] = len(rates)
+        snapshot["updated_at"] = int(time.time())
+        self._snapshots[network] = snapshot
+
+    def refresh(self):
+        for network in self.rpc_pools:
+            try:
+                self.refresh_network(network)
+            except SQLAlchemyError as e:
+                logger.error(f"Failed to refresh {network} fee model: {e}")
+
+    def estimate(self, network, message_bytes):
+        """Return the estimated cost in satoshis of each part of an order, or None."""
+        snapshot = self._snapshots.get(network)
+        if snapshot is None:
+            return None
+        bid_msat = math.ceil(message_bytes * snapshot["msat_per_byte"])
+        invoice = math.ceil(bid_msat / MSAT_PER_SAT)
+        swap_fee = math.ceil(invoice * snapshot["swap_fee_rate"])
+        funding_fee = math.ceil(self.funding_vbytes * snapshot["sat_per_vbyte"])
+        return {
+            "message_bytes": message_bytes,
+            "blocksat_bid_msat": bid_msat,
+            "invoice": invoice,
+            "swap_fee": swap_fee,
+            "funding_fee": funding_fee,
+            "total": invoice + swap_fee + funding_fee,
+            "updated_at": snapshot["updated_at"],
+        }
+
+    def stats(self):
+        return dict(self._snapshots)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fee-model", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
@@ -0,0 +1,219 @@
+"""Speculative prefetch of the swap steps which follow placing an order.
+
+After CreateOrder returns, clients almost always look up the Blocksat invoice with the
+swap server, ask for a refund address and then request a swap quote, each a round trip
+over the mesh. As soon as an order's invoice is known those calls are started in the
+background and their results kept against the order, so the endpoints can answer
+straight away.
+
+A prefetched result is only used if the request asks for exactly what was prefetched,
+and at most once. Steps which haven't started when their result turns out not to be
+wanted, or when the order's prefetch expires after `ttl` seconds, are cancelled. A
+quote which is fetched but never used leaves an unfunded swap with the swap server,
+which it times out like any other abandoned swap.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from sub_ln.api import upstream
+
+logger = logging.getLogger(__name__)
+
+STEPS = ("lookup_invoice", "new_address", "quote")
+
+
+class _Prefetch:
+    __slots__ = (
+        "uuid",
+        "invoice",
+        "network",
+        "address",
+        "created",
+        "futures",
+        "pending",
+    )
+
+    def __init__(self, uuid, invoice, network):
+        self.uuid = uuid
+        self.invoice = invoice
+        self.network = network
+        # the refund address the quote was requested with, once known
+        self.address = None
+        self.created = time.monotonic()
+        self.futures = {step: Future() for step in STEPS}
+        # steps whose result hasn't been used or discarded yet
+        self.pending = set(STEPS)
+
+
+def _run(future, func, *args, **kwargs):
+    """Run func into future unless it was cancelled, returns False if it was."""
+    if not future.set_running_or_notify_cancel():
+        return False
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return True
+
+
+class Prefetcher:
+    def __init__(
+        self, ttl=300, wait=10, address_type="legacy", max_workers=4, max_orders=1000
+    ):
+        self.ttl = ttl
+        # seconds a request waits for a prefetch which is still running
+        self.wait = wait
+        self.address_type = address_type
+        self.max_orders = max_orders
+        self.started = 0
+        self.hits = Counter()
+        self.misses = Counter()
+        self.cancelled = 0
+        self.unused = 0
+        # uuid -> _Prefetch, oldest first
+        self._orders = OrderedDict()
+        self._by_invoice = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self._lock = threading.Lock()
+
+    def start(self, uuid, invoice, network):
+        """Start the steps following the order `uuid` with Blocksat invoice `invoice`."""
+        if not self.ttl:
+            return
+        order = _Prefetch(uuid, invoice, network)
+        with self._lock:
+            self._expire()
+            self._orders[uuid] = order
+            self._by_invoice[invoice] = uuid
+            self.started += 1
+        self._executor.submit(
+            _run,
+            order.futures["lookup_invoice"],
+            lambda: upstream.submarine().get_invoice_details(
+                invoice=invoice, network=network
+            ),
+        )
+        self._executor.submit(self._quote, order)
+
+    def _quote(self, order):
+        rpc = upstream.rpc_pool(order.network)
+        if rpc is None or not _run(
+            order.futures["new_address"], rpc.getnewaddress, "", self.address_type
+        ):
+            order.futures["new_address"].cancel()
+            order.futures["quote"].cancel()
+            return
+        try:
+            order.address = order.futures["new_address"].result(timeout=0)
+        except Exception:
+            order.futures["quote"].cancel()
+            return
+        _run(
+            order.futures["quote"],
+            lambda: upstream.submarine().get_quote(
+                network=order.network, invoice=order.invoice, refund=order.address
+            ),
+        )
+
+    def lookup_invoice(self, invoice, network):
+        """The swap server's invoice details response, or None if not prefetched."""
+        with self._lock:
+            order = self._orders.get(self._by_invoice.get(invoice))
+        return self._take(
+            order, "lookup_invoice", order is not None and order.network == network
+        )
+
+    def new_address(self, uuid, address_type):
+        """A new refund address for order `uuid`, or None if not prefetched."""
+        with self._lock:
+            order = self._orders.get(uuid)
+        return self._take(order, "new_address", address_type == self.address_type)
+
+    def quote(self, uuid, invoice, network, refund_address):
+        """The swap server's quote response, or None if not prefetched."""
+        with self._lock:
+            order = self._orders.get(uuid)
+        try:
+            return self._take(
+                order,
+                "quote",
+                order is not None
+                and (order.invoice, order.network) == (invoice, network)
+                and order.address == refund_address,
+            )
+        finally:
+            # the last step, anything not used by now won't be
+            if order is not None:
+                with self._lock:
+                    self._drop(order)
+
+    def _take(self, order, step, matches):
+        future = None
+        if order is not None:
+            with self._lock:
+                if step in order.pending:
+                    order.pending.discard(step)
+                    future = order.futures[step]
+                if future is not None and not matches:
+                    self._discard(future)
+                    future = None
+        result = None
+        if future is not None:
+            try:
+                result = future.result(timeout=self.wait)
+            except (CancelledError, FutureTimeout):
+                pass
+            except Exception as e:
+                logger.info(f"Prefetched {step} for order {order.uuid} failed: {e}")
+        with self._lock:
+            if result is None:
+                self.misses[step] += 1
+            else:
+                self.hits[step] += 1
+        return result
+
+    def _discard(self, future):
+        if future.cancel():
+            self.cancelled += 1
+        else:
+            self.unused += 1
+
+    def _drop(self, order):
+        if self._orders.pop(order.uuid, None) is None:
+            return
+        if self._by_invoice.get(order.invoice) == order.uuid:
+            del self._by_invoice[order.invoice]
+        for step in order.pending:
+            self._discard(order.futures[step])
+        order.pending.clear()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._orders:
+            order = next(iter(self._orders.values()))
+            if now - order.created < self.ttl and len(self._orders) < self.max_orders:
+                break
+            self._drop(order)
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            hits = sum(self.hits.values())
+            lookups = hits + sum(self.misses.values())
+            return {
+                "ttl": self.ttl,
+                "started": self.started,
+                "pending": len(self._orders),
+                "hits": {step: self.hits[step] for step in STEPS},
+                "misses": {step: self.misses[step] for step in STEPS},
+                "hit_rate": hits / lookups if lookups else None,
+                "cancelled": self.cancelled,
+                "unused": self.unused,
+            }
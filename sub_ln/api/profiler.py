@@ -0,0 +1,175 @@
+"""Opt-in sampling profiler for API requests.
+
+A fraction of requests (`sample_rate`), plus any request sent with the debug header, are
+profiled. For those the wall clock and CPU time of the request are recorded, and while
+they run a background thread samples their stacks every `interval` seconds with
+sys._current_frames(). Results are aggregated per endpoint and can be downloaded as
+collapsed stacks ("frame;frame;frame count" lines) for flame graph tools.
+
+Requests which aren't sampled only pay for a header lookup and a random number, and the
+sampling thread sleeps while no profiled request is running.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+# time.thread_time is python 3.7+, fall back to the CPU time of the whole process
+_thread_time = getattr(time, "thread_time", time.process_time)
+
+# Distinct stacks kept per endpoint, later ones are counted under a single entry
+MAX_STACKS = 5000
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+        names.append(f"{module}.{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _EndpointProfile:
+    __slots__ = ("requests", "wall", "cpu", "wall_max", "samples", "stacks")
+
+    def __init__(self):
+        self.requests = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.wall_max = 0.0
+        self.samples = 0
+        self.stacks = Counter()
+
+
+class RequestProfiler:
+    def __init__(self, sample_rate=0.0, interval=0.005, header="X-Debug-Profile"):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.header = header
+        self._profiles = {}
+        # thread id -> endpoint, for requests currently being profiled
+        self._active = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _profile(self, endpoint):
+        profile = self._profiles.get(endpoint)
+        if profile is None:
+            profile = self._profiles.setdefault(endpoint, _EndpointProfile())
+        return profile
+
+    def sampled(self, req):
+        if self.header in req.headers:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self, endpoint):
+        """Start profiling the current thread's request, returns a token for end()."""
+        with self._lock:
+            self._active[threading.get_ident()] = endpoint
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="request-profiler", daemon=True
+                )
+                self._thread.start()
+        self._wake.set()
+        return endpoint, time.perf_counter(), _thread_time()
+
+    def end(self, token):
+        """Stop profiling the current thread's request, returns (wall, cpu) seconds."""
+        endpoint, wall_start, cpu_start = token
+        wall = time.perf_counter() - wall_start
+        cpu = _thread_time() - cpu_start
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._wake.clear()
+            profile = self._profile(endpoint)
+            profile.requests += 1
+            profile.wall += wall
+            profile.cpu += cpu
+            profile.wall_max = max(profile.wall_max, wall)
+        return wall, cpu
+
+    def sample(self):
+        """Record the current stack of every profiled request."""
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, endpoint in self._active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                profile = self._profile(endpoint)
+                stack = _collapse(frame)
+                if stack not in profile.stacks and len(profile.stacks) >= MAX_STACKS:
+                    stack = "[other]"
+                profile.stacks[stack] += 1
+                profile.samples += 1
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self.sample()
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": p.requests,
+                    "wall_mean": p.wall / p.requests if p.requests else None,
+                    "wall_max": p.wall_max,
+                    "cpu_mean": p.cpu / p.requests if p.requests else None,
+                    "samples": p.samples,
+                }
+                for endpoint, p in self._profiles.items()
+            }
+
+    def collapsed(self, endpoint=None):
+        """Collapsed stacks for every endpoint (or just `endpoint`), one per line."""
+        lines = []
+        with self._lock:
+            for name, profile in self._profiles.items():
+                if endpoint is not None and name != endpoint:
+                    continue
+                for stack, count in profile.stacks.most_common():
+                    lines.append(f"{name};{stack} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+def install(app, profiler):
+    """Profile sampled requests handled by app."""
+
+    @app.before_request
+    def _begin():
+        if profiler.sampled(request):
+            endpoint = request.url_rule.rule if request.url_rule else request.path
+            g.profile = profiler.begin(endpoint)
+
+    @app.after_request
+    def _timing(response):
+        token = g.pop("profile", None)
+        if token is not None:
+            wall, cpu = profiler.end(token)
+            response.headers["X-Profile-Wall-Ms"] = f"{wall * 1000:.3f}"
+            response.headers["X-Profile-CPU-Ms"] = f"{cpu * 1000:.3f}"
+        return response
+
+    @app.teardown_request
+    def _end(exc):
+        # after_request isn't called when the request raised
+        token = g.pop("profile", None)
+        if token is not None:
+            profiler.end(token)
@@ -0,0 +1,207 @@
+"""Deadlines, circuit breaking and hedging for calls to the swap service and Blocksat.
+
+The upstream client modules make blocking HTTP calls with no timeout of their own. Each
+call is run on a worker thread belonging to that upstream, and the request waits at
+most `timeout` seconds for it. After `failure_threshold` consecutive failures (errors,
+timeouts or 5xx responses) the breaker opens and calls fail straight away with a 503
+for `reset_timeout` seconds, after which a single trial call is let through to see
+whether the upstream has recovered.
+
+Idempotent reads listed in HEDGED_METHODS can be hedged: if the first attempt has not
+returned after `hedge_after` seconds a second identical call is started and whichever
+finishes first is used.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from sub_ln.bitcoin.pool import LATENCY_SAMPLES, _percentile
+
+logger = logging.getLogger(__name__)
+
+HEDGED_METHODS = frozenset(
+    {"get_invoice_details", "get_address_details", "check_status"}
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(ServiceUnavailable):
+    def __init__(self, upstream, reason, retry_after=None):
+        super().__init__(description=f"{upstream} is unavailable: {reason}")
+        self.retry_after = retry_after
+
+    def get_headers(self, environ=None):
+        # werkzeug 0.15's ServiceUnavailable has no retry_after, later versions add it
+        headers = super().get_headers(environ)
+        if self.retry_after is not None and not any(
+            name == "Retry-After" for name, _ in headers
+        ):
+            headers.append(("Retry-After", str(self.retry_after)))
+        return headers
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return 0 if a call may be made now, otherwise the seconds until it may."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            # let one trial call through, everything else keeps failing fast
+            if self._probing:
+                return 1
+            self.state = HALF_OPEN
+            self._probing = True
+            return 0
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Circuit opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class ResilientClient:
+    """
+    Wraps an upstream client module. Functions are called through the resilience
+    policy, any other attribute (e.g. SATELLITE_API) is returned unchanged.
+    """
+
+    def __init__(
+        self,
+        name,
+        module,
+        timeout=10,
+        failure_threshold=5,
+        reset_timeout=30,
+        hedge_after=None,
+        max_workers=16,
+    ):
+        self.name = name
+        self.module = module
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"upstream-{name}"
+        )
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.module, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.call(name, attr, *args, **kwargs)
+
+        return call
+
+    def _timed(self, func, args, kwargs):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        return result, time.perf_counter() - t0
+
+    def call(self, method, func, *args, **kwargs):
+        retry_after = self.breaker.allow()
+        if retry_after:
+            with self._lock:
+                self.rejected += 1
+            raise UpstreamUnavailable(self.name, "circuit open", int(retry_after) + 1)
+
+        deadline = time.monotonic() + self.timeout
+        futures = [self._executor.submit(self._timed, func, args, kwargs)]
+        if self.hedge_after is not None and method in HEDGED_METHODS:
+            done, _ = wait(futures, timeout=min(self.hedge_after, self.timeout))
+            if not done:
+                futures.append(self._executor.submit(self._timed, func, args, kwargs))
+                with self._lock:
+                    self.hedged += 1
+        done, _ = wait(
+            futures,
+            timeout=max(0, deadline - time.monotonic()),
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            # the worker keeps running in the background, but we stop waiting for it
+            with self._lock:
+                self.calls += 1
+                self.timeouts += 1
+            self.breaker.record(ok=False)
+            logger.warning(f"{self.name}.{method} timed out after {self.timeout}s")
+            raise UpstreamUnavailable(self.name, "timed out")
+
+        future = next(f for f in futures if f in done)
+        try:
+            result, elapsed = future.result()
+        except Exception as e:
+            with self._lock:
+                self.calls += 1
+                self.failures += 1
+            self.breaker.record(ok=False)
+            logger.warning(f"{self.name}.{method} failed: {e}")
+            raise UpstreamUnavailable(self.name, str(e))
+        ok = getattr(result, "status_code", 200) < 500
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(elapsed)
+            if not ok:
+                self.failures += 1
+            if len(futures) > 1 and future is futures[1]:
+                self.hedge_wins += 1
+        self.breaker.record(ok)
+        return result
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                "calls": self.calls,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+        stats.update(
+            {
+                "breaker": self.breaker.state,
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p99": _percentile(latencies, 0.99),
+            }
+        )
+        return stats
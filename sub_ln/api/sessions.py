@@ -0,0 +1,92 @@
+"""Keep-alive HTTP sessions for the swap service and Blocksat clients.
+
+The client modules call requests.get()/requests.post() directly, which opens a new
+connection (and TLS handshake) for every call. inject() replaces the `requests` name in a
+client module with a stand-in that sends those calls through a pooled Session owned by
+the gateway, so connections to each upstream host are reused. Everything else the
+module uses from requests (exceptions, etc.) is passed through unchanged.
+"""
+
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSession:
+    """
+    A requests.Session keeping up to `pool_maxsize` connections open to each of up to
+    `pool_connections` hosts.
+    """
+
+    def __init__(self, name, pool_connections=4, pool_maxsize=16):
+        self.name = name
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+    def stats(self):
+        # the pool manager's container can't be iterated, but keys() is safe
+        manager_pools = self._adapter.poolmanager.pools
+        pools = [manager_pools.get(key) for key in manager_pools.keys()]
+        pools = [pool for pool in pools if pool is not None]
+        requests_made = sum(pool.num_requests for pool in pools)
+        connections = sum(pool.num_connections for pool in pools)
+        return {
+            "hosts": len(pools),
+            "requests": requests_made,
+            "connections": connections,
+            "reused": requests_made - connections,
+            "idle": sum(pool.pool.qsize() for pool in pools if pool.pool is not None),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class _RequestsShim:
+    """Stands in for the requests module inside a client module."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self._session.get(url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self._session.post(url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self._session.put(url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self._session.patch(url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._session.delete(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self._session.head(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def inject(module, pooled):
+    """Make module's requests calls use the pooled session. Returns False if it can't."""
+    if getattr(module, "requests", None) is not requests:
+        logger.warning(
+            f"{module.__name__} does not use requests directly, "
+            f"HTTP connections to {pooled.name} will not be pooled"
+        )
+        return False
+    module.requests = _RequestsShim(pooled.session)
+    return True
@@ -0,0 +1,255 @@
+"""Lazily constructed clients for the services behind the API.
+
+Nothing here is imported or connected until it is first needed, which keeps importing
+the API (and so restarting the server) cheap. warm_up() constructs everything ahead of
+the first request and records which backends are reachable for the readiness endpoint.
+"""
+
+import importlib
+import logging
+import threading
+
+from sub_ln.api.fee_model import FeeModel
+from sub_ln.api.resilience import ResilientClient
+from sub_ln.api.sessions import PooledSession, inject
+from sub_ln.bitcoin.coin_pool import CoinPool
+from sub_ln.bitcoin.fees import FeeBumper
+from sub_ln.bitcoin.pool import RPCPool
+from sub_ln.bitcoin.refund import RefundEngine
+from sub_ln.bitcoin.tracker import ConfirmationTracker
+from sub_ln.server.server_config import (
+    COIN_POOL_COIN_VALUE,
+    COIN_POOL_ENABLED,
+    COIN_POOL_INTERVAL,
+    COIN_POOL_LABEL,
+    COIN_POOL_MAX_SPLIT,
+    COIN_POOL_MIN_CONFIRMATIONS,
+    COIN_POOL_SIZE,
+    CONFIRMATION_POLL_INTERVAL,
+    ESTIMATE_CONF_TARGET,
+    ESTIMATE_DEFAULT_MSAT_PER_BYTE,
+    ESTIMATE_DEFAULT_SAT_PER_VBYTE,
+    ESTIMATE_DEFAULT_SWAP_FEE_RATE,
+    ESTIMATE_FUNDING_VBYTES,
+    ESTIMATE_INTERVAL,
+    ESTIMATE_SAMPLES,
+    FEE_BUMP_WITHIN,
+    FUNDING_DEADLINE_MARGIN,
+    REFUND_CONF_TARGET,
+    REFUND_MAX_INPUTS,
+    REFUND_MIN_FEE_RATE,
+    REFUND_REPLACE_AFTER,
+    RPC_BACKENDS,
+    RPC_HEALTH_INTERVAL,
+    RPC_MAX_LAG,
+    RPC_MAX_LATENCY,
+    RPC_POOL_SIZE,
+    UPSTREAM_HTTP_POOLS,
+    UPSTREAM_POLICIES,
+)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_modules = {}
+_clients = {}
+_sessions = {}
+_rpc_pools = None
+_confirmation_trackers = None
+_fee_model = None
+_refund_engines = None
+_fee_bumpers = None
+_coin_pools = None
+_components = {}
+_warm = threading.Event()
+
+
+def _module(name):
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name) or importlib.import_module(name)
+            _modules[name] = module
+    return module
+
+
+def _client(name, module_name):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                module = _module(module_name)
+                # reuse connections to the upstream instead of one per call
+                _sessions[name] = PooledSession(name, **UPSTREAM_HTTP_POOLS[name])
+                inject(module, _sessions[name])
+                client = ResilientClient(name, module, **UPSTREAM_POLICIES[name])
+                _clients[name] = client
+    return client
+
+
+def blocksat():
+    return _client("blocksat", "blocksat_api.blocksat")
+
+
+def submarine():
+    return _client("submarine", "submarine_api.submarine")
+
+
+def clients():
+    """The upstream clients which have been constructed so far."""
+    return dict(_clients)
+
+
+def http_session(name):
+    """The pooled HTTP session used by an upstream client, once it's been constructed."""
+    return _sessions.get(name)
+
+
+def rpc_pools():
+    """One pool of bitcoind backends for each configured network."""
+    global _rpc_pools
+    if _rpc_pools is None:
+        with _lock:
+            if _rpc_pools is None:
+                _rpc_pools = {
+                    network: RPCPool.from_config(
+                        backends,
+                        pool_size=RPC_POOL_SIZE,
+                        max_latency=RPC_MAX_LATENCY,
+                        max_lag=RPC_MAX_LAG,
+                        health_interval=RPC_HEALTH_INTERVAL,
+                    )
+                    for network, backends in RPC_BACKENDS.items()
+                    if backends
+                }
+    return _rpc_pools
+
+
+def rpc_pool(network):
+    """The RPCPool for network, or None if no backends are configured for it."""
+    return rpc_pools().get(network)
+
+
+def confirmation_trackers():
+    global _confirmation_trackers
+    if _confirmation_trackers is None:
+        with _lock:
+            if _confirmation_trackers is None:
+                _confirmation_trackers = {
+                    network: ConfirmationTracker(
+                        pool, network, poll_interval=CONFIRMATION_POLL_INTERVAL
+                    )
+                    for network, pool in rpc_pools().items()
+                }
+    return _confirmation_trackers
+
+
+def confirmation_tracker(network):
+    return confirmation_trackers().get(network)
+
+
+def refund_engines():
+    global _refund_engines
+    if _refund_engines is None:
+        with _lock:
+            if _refund_engines is None:
+                _refund_engines = {
+                    network: RefundEngine(
+                        pool,
+                        network,
+                        confirmation_tracker(network),
+                        conf_target=REFUND_CONF_TARGET,
+                        min_fee_rate=REFUND_MIN_FEE_RATE,
+                        max_inputs=REFUND_MAX_INPUTS,
+                        replace_after=REFUND_REPLACE_AFTER,
+                    )
+                    for network, pool in rpc_pools().items()
+                }
+    return _refund_engines
+
+
+def fee_bumpers():
+    global _fee_bumpers
+    if _fee_bumpers is None:
+        with _lock:
+            if _fee_bumpers is None:
+                _fee_bumpers = {
+                    network: FeeBumper(
+                        pool,
+                        network,
+                        confirmation_tracker(network),
+                        margin=FUNDING_DEADLINE_MARGIN,
+                        bump_within=FEE_BUMP_WITHIN,
+                    )
+                    for network, pool in rpc_pools().items()
+                }
+    return _fee_bumpers
+
+
+def coin_pools():
+    """Pools of pre-split coins for funding swaps, empty unless COIN_POOL_ENABLED."""
+    global _coin_pools
+    if _coin_pools is None:
+        with _lock:
+            if _coin_pools is None:
+                _coin_pools = {
+                    network: CoinPool(
+                        pool,
+                        network,
+                        label=COIN_POOL_LABEL,
+                        size=COIN_POOL_SIZE,
+                        coin_value=COIN_POOL_COIN_VALUE,
+                        min_confirmations=COIN_POOL_MIN_CONFIRMATIONS,
+                        max_split=COIN_POOL_MAX_SPLIT,
+                        interval=COIN_POOL_INTERVAL,
+                    )
+                    for network, pool in rpc_pools().items()
+                    if COIN_POOL_ENABLED
+                }
+    return _coin_pools
+
+
+def coin_pool(network):
+    return coin_pools().get(network)
+
+
+def fee_model():
+    global _fee_model
+    if _fee_model is None:
+        with _lock:
+            if _fee_model is None:
+                _fee_model = FeeModel(
+                    rpc_pools(),
+                    interval=ESTIMATE_INTERVAL,
+                    conf_target=ESTIMATE_CONF_TARGET,
+                    samples=ESTIMATE_SAMPLES,
+                    funding_vbytes=ESTIMATE_FUNDING_VBYTES,
+                    default_msat_per_byte=ESTIMATE_DEFAULT_MSAT_PER_BYTE,
+                    default_swap_fee_rate=ESTIMATE_DEFAULT_SWAP_FEE_RATE,
+                    default_sat_per_vbyte=ESTIMATE_DEFAULT_SAT_PER_VBYTE,
+                )
+    return _fee_model
+
+
+def warm_up():
+    """Construct every client and check which of the bitcoind backends respond."""
+    for name, loader in (("blocksat", blocksat), ("submarine", submarine)):
+        try:
+            loader()
+            _components[name] = True
+        except ImportError as e:
+            logger.error(f"Failed to load {name} client: {e}")
+            _components[name] = False
+    for network, pool in rpc_pools().items():
+        pool.check_health()
+        _components[f"bitcoind_{network}"] = any(b.healthy for b in pool.backends)
+    confirmation_trackers()
+    fee_model()
+    _warm.set()
+
+
+def readiness():
+    """Return (ready, {component: ok}), not ready until warm_up() has completed."""
+    components = dict(_components)
+    return _warm.is_set() and all(components.values()), components
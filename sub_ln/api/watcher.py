@@ -0,0 +1,157 @@
+"""Follow the progress of orders placed through mesh gateways, for their event streams.
+
+Gateways subscribed to /api/v1/events don't poll swap/check, so the server does it for
+them: every `interval` seconds it asks the swap server about funded swaps of gateway
+orders whose outcome isn't known yet, and Blocksat about paid orders which haven't been
+transmitted, up to `batch` of each, carrying on from where the last round stopped. The
+calls are at least 1 / `max_rate` seconds apart, so a large batch doesn't burst.
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from sub_ln.api import upstream
+from sub_ln.api.resilience import UpstreamUnavailable
+from sub_ln.database import db, events
+
+logger = logging.getLogger(__name__)
+
+
+def swap_timed_out(swap):
+    tracker = upstream.confirmation_tracker(swap["network"])
+    if tracker is None or tracker.height is None:
+        return False
+    return tracker.height >= swap["timeout_block_height"]
+
+
+def update_swap(uuid, swap):
+    """
+    Ask the swap server about an unsettled swap and record the outcome if there is
+    one, updating swap["state"]. Returns the swap server's check_status response.
+
+    A swap only expires once it has been funded and the swap server has answered that
+    it hasn't paid the invoice, after the timeout. The confirmation tracker stops
+    looking for the funding of a swap with an outcome.
+    """
+    result = upstream.submarine().check_status(
+        network=swap["network"],
+        invoice=swap["invoice"],
+        redeem_script=swap["redeem_script"],
+    )
+    if result.status_code != 200:
+        return result
+    status = result.json()
+    if "payment_secret" in status:
+        if db.check_swap(
+            uuid=uuid,
+            payment_secret=status["payment_secret"],
+            claim_txid=status.get("transaction_id"),
+        ):
+            # the payment secret is left out, the gateway asks swap/check for it
+            events.publish(
+                uuid, "invoice_paid", claim_txid=status.get("transaction_id")
+            )
+        swap["state"] = db.STATE_SWAP_COMPLETE
+    elif (
+        swap["state"] not in db.SWAP_RESOLVED_STATES
+        and swap["txid"] is not None
+        and swap_timed_out(swap)
+    ):
+        if db.expire_swap(uuid):
+            events.publish(
+                uuid, "swap_expired", timeout_block_height=swap["timeout_block_height"]
+            )
+        swap["state"] = db.STATE_SWAP_EXPIRED
+    else:
+        return result
+    tracker = upstream.confirmation_tracker(swap["network"])
+    if tracker is not None:
+        tracker.unwatch(uuid)
+    return result
+
+
+class OrderWatcher:
+    def __init__(self, interval=15, batch=100, max_rate=2):
+        self.interval = interval
+        self.batch = batch
+        self.max_rate = max_rate
+        self._last_call = None
+        # uuid the next round of each lookup starts after
+        self._swaps_after = None
+        self._blocksat_after = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def check_swaps(self):
+        swaps = db.lookup_unresolved_swaps(self._swaps_after, self.batch)
+        for swap in swaps:
+            if not self._pace():
+                break
+            try:
+                update_swap(swap["uuid"], swap)
+            except (UpstreamUnavailable, ValueError) as e:
+                logger.warning(f"Checking swap {swap['uuid']} failed: {e}")
+        # start again from the beginning once the end is reached
+        self._swaps_after = swaps[-1]["uuid"] if len(swaps) == self.batch else None
+
+    def check_blocksat(self):
+        orders = db.lookup_unsent_blocksat(self._blocksat_after, self.batch)
+        for order in orders:
+            if not self._pace():
+                break
+            try:
+                self._check_blocksat(order)
+            except (UpstreamUnavailable, ValueError) as e:
+                logger.warning(
+                    f"Checking Blocksat order of {order['uuid']} failed: {e}"
+                )
+        self._blocksat_after = orders[-1]["uuid"] if len(orders) == self.batch else None
+
+    def _pace(self):
+        """Wait until the next upstream call is due, returns False if stopping."""
+        if self._last_call is not None and self.max_rate:
+            delay = self._last_call + 1 / self.max_rate - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return False
+        self._last_call = time.monotonic()
+        return not self._stop.is_set()
+
+    def _check_blocksat(self, order):
+        result = upstream.blocksat().get(
+            uuid=order["blocksat_uuid"],
+            auth_token=order["auth_token"],
+            satellite_url=order["satellite_url"],
+        )
+        if result.status_code != 200:
+            logger.debug(f"Blocksat order of {order['uuid']}: {result.text}")
+            return
+        status = result.json().get("status")
+        if status is None or status == order["order_status"]:
+            return
+        if not db.set_blocksat_status(order["uuid"], status):
+            return
+        if status in db.BLOCKSAT_SENT_STATUSES:
+            events.publish(order["uuid"], "blocksat_transmitted", status=status)
+        elif status in db.BLOCKSAT_FINAL_STATUSES:
+            events.publish(order["uuid"], "blocksat_failed", status=status)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="order-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_swaps()
+                self.check_blocksat()
+            except SQLAlchemyError as e:
+                logger.error(f"Watching orders failed: {e}")
+            self._stop.wait(self.interval)
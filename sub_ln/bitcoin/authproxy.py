@@ -54,6 +54,7 @@ ServiceProxy class:
 - sends Basic HTTP authentication headers
 - parses all JSON numbers that look like floats as Decimal
 - uses standard Python json lib
+- can stream large array results incrementally, see AuthServiceProxy.stream()
 """
 
 import base64
@@ -67,6 +68,8 @@ import socket
 import time
 import urllib.parse
 
+from sub_ln.bitcoin.streaming import CHUNK_SIZE, StreamRPCError, iter_result
+
 HTTP_TIMEOUT = 30
 USER_AGENT = "AuthServiceProxy/0.1"
 
@@ -125,7 +128,7 @@ class AuthServiceProxy:
             name = "%s.%s" % (self._service_name, name)
         return AuthServiceProxy(self.__service_url, name, connection=self.__conn)
 
-    def _request(self, method, path, postdata):
+    def _request(self, method, path, postdata, stream=False):
         """
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
@@ -142,12 +145,12 @@ class AuthServiceProxy:
             self._set_conn()
         try:
             self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            return self._get_response(stream)
         except http.client.BadStatusLine as e:
             if e.line == "''":  # if connection was closed, try again
                 self.__conn.close()
                 self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
+                return self._get_response(stream)
             else:
                 raise
         except (BrokenPipeError, ConnectionResetError):
@@ -155,7 +158,7 @@ class AuthServiceProxy:
             # ConnectionResetError happens on FreeBSD with Python 3.4
             self.__conn.close()
             self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            return self._get_response(stream)
 
     def get_request(self, *args, **argsn):
         AuthServiceProxy.__id_count += 1
@@ -204,6 +207,47 @@ class AuthServiceProxy:
         else:
             return response["result"]
 
+    def stream(self, *args, path=None, **argsn):
+        """
+        Call the method, yielding the elements of its result array as they are parsed
+        from the socket instead of returning the fully decoded result. Only amount
+        fields are converted to Decimal. For calls returning an object (e.g. getblock)
+        `path` selects the member array to stream, other members are discarded.
+
+        The request is sent when the generator is first advanced. If the generator is
+        not run to completion the connection is closed rather than drained.
+        """
+        postdata = json.dumps(
+            self.get_request(*args, **argsn),
+            default=EncodeDecimal,
+            ensure_ascii=self.ensure_ascii,
+        )
+        http_response = self._request(
+            "POST", self.__url.path, postdata.encode("utf-8"), stream=True
+        )
+        complete = False
+        try:
+            yield from iter_result(http_response, path=path, chunk_size=CHUNK_SIZE)
+            complete = True
+        except StreamRPCError as e:
+            complete = True
+            raise JSONRPCException(e.error, http_response.status)
+        finally:
+            if complete and not http_response.isclosed():
+                # consume any trailing bytes so the connection can be re-used
+                while http_response.read(CHUNK_SIZE):
+                    pass
+            elif not complete:
+                self.__conn.close()
+        if http_response.status != HTTPStatus.OK:
+            raise JSONRPCException(
+                {
+                    "code": -342,
+                    "message": "non-200 HTTP status code but no JSON-RPC error",
+                },
+                http_response.status,
+            )
+
     def batch(self, rpc_call_list):
         postdata = json.dumps(
             list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii
@@ -222,7 +266,7 @@ class AuthServiceProxy:
             )
         return response
 
-    def _get_response(self):
+    def _get_response(self, stream=False):
         req_start_time = time.time()
         try:
             http_response = self.__conn.getresponse()
@@ -251,6 +295,10 @@ class AuthServiceProxy:
                 http_response.status,
             )
 
+        if stream:
+            log.debug("<-- [streaming] %s" % self._service_name)
+            return http_response
+
         responsedata = http_response.read().decode("utf8")
         response = json.loads(responsedata, parse_float=decimal.Decimal)
         elapsed = time.time() - req_start_time
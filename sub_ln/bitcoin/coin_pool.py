@@ -0,0 +1,320 @@
+"""A pool of pre-split wallet coins for funding swaps.
+
+With sendtoaddress every swap payment goes through the wallet's coin selection, which
+runs one at a time, and spends the unconfirmed change of the previous payment, building
+long chains of unconfirmed transactions. Instead, a background thread keeps `size`
+confirmed coins of `coin_value` satoshis on addresses labelled `label`, splitting new
+ones off with sendmany when the pool runs low. Pool coins are locked with lockunspent so
+the wallet never selects them itself. Each swap reserves one coin and is funded from it
+with createrawtransaction, signrawtransactionwithwallet and sendrawtransaction, so
+concurrent payments don't wait on each other and only ever spend confirmed coins.
+
+fund() returns None when no coin is available or large enough, or bitcoind rejects the
+transaction, and the caller falls back to sendtoaddress. If the connection fails while
+sending, the transaction may have been broadcast anyway, so fund() asks the wallet
+whether it was. If the wallet can't say, fund() raises FundingUnknown rather than risk
+paying twice. The coin stays reserved with its signed transaction, and funding the same
+swap again sends that same transaction.
+"""
+
+import http.client
+import logging
+import math
+import threading
+from decimal import Decimal
+
+from sub_ln.bitcoin.authproxy import JSONRPCException
+
+logger = logging.getLogger(__name__)
+
+SAT_PER_BTC = 100_000_000
+DUST_LIMIT = 546
+# signal replace-by-fee, so funding can still be bumped
+SEQUENCE_RBF = 0xFFFFFFFD
+# one P2WPKH input, a P2SH output to the swap and a P2WPKH change output
+FUNDING_VBYTES = 142
+
+
+def _btc(sats):
+    return Decimal(sats) / SAT_PER_BTC
+
+
+class FundingUnknown(Exception):
+    """A swap's funding transaction may or may not have been broadcast."""
+
+    def __init__(self, uuid, reason):
+        super().__init__(f"Funding of swap {uuid} may have been sent: {reason}")
+
+
+class _Coin:
+    __slots__ = ("txid", "vout", "value", "confirmations", "reserved_by", "signed")
+
+    def __init__(self, txid, vout, value, confirmations):
+        self.txid = txid
+        self.vout = vout
+        self.value = value
+        self.confirmations = confirmations
+        self.reserved_by = None
+        # a signed funding transaction which may have been broadcast
+        self.signed = None
+
+    @property
+    def outpoint(self):
+        return {"txid": self.txid, "vout": self.vout}
+
+
+class CoinPool:
+    def __init__(
+        self,
+        rpc,
+        network,
+        label="swap-pool",
+        size=20,
+        coin_value=100_000,
+        min_confirmations=1,
+        max_split=50,
+        interval=60,
+        min_fee_rate=1,
+    ):
+        self.rpc = rpc
+        self.network = network
+        self.label = label
+        self.size = size
+        self.coin_value = coin_value
+        self.min_confirmations = min_confirmations
+        self.max_split = max_split
+        self.interval = interval
+        self.min_fee_rate = min_fee_rate
+        self.funded = 0
+        self.fallbacks = 0
+        self.splits = 0
+        # (txid, vout) -> _Coin, every coin here is locked in the wallet
+        self._coins = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def load(self):
+        """Pick up pool coins locked by a previous run, bitcoind keeps them locked."""
+        for outpoint in self.rpc.listlockunspent():
+            tx = self.rpc.gettransaction(outpoint["txid"])
+            for detail in tx["details"]:
+                if (
+                    detail["vout"] == outpoint["vout"]
+                    and detail["category"] == "receive"
+                    and detail.get("label") == self.label
+                ):
+                    coin = _Coin(
+                        outpoint["txid"],
+                        outpoint["vout"],
+                        int(Decimal(detail["amount"]) * SAT_PER_BTC),
+                        tx["confirmations"],
+                    )
+                    with self._lock:
+                        self._coins[(coin.txid, coin.vout)] = coin
+                    break
+        self._loaded = True
+
+    def refresh(self):
+        """Lock new pool coins and update the confirmations of unconfirmed ones."""
+        if not self._loaded:
+            self.load()
+        new = [
+            _Coin(
+                u["txid"],
+                u["vout"],
+                int(Decimal(u["amount"]) * SAT_PER_BTC),
+                u["confirmations"],
+            )
+            for u in self.rpc.listunspent(0)
+            if u.get("label") == self.label and u.get("spendable", True)
+        ]
+        if new:
+            self.rpc.lockunspent(False, [coin.outpoint for coin in new])
+        with self._lock:
+            for coin in new:
+                self._coins[(coin.txid, coin.vout)] = coin
+            pending = [
+                c
+                for c in self._coins.values()
+                if c.confirmations < self.min_confirmations
+            ]
+        for coin in pending:
+            coin.confirmations = self.rpc.gettransaction(coin.txid)["confirmations"]
+            if coin.confirmations < 0:
+                # the split transaction was double spent or re-orged out
+                self._forget(coin)
+
+    def split(self):
+        """Top the pool up to `size` coins in a single transaction."""
+        with self._lock:
+            needed = self.size - sum(
+                1 for c in self._coins.values() if c.reserved_by is None
+            )
+        count = min(needed, self.max_split)
+        if count <= 0:
+            return None
+        amounts = {
+            self.rpc.getnewaddress(self.label, "bech32"): _btc(self.coin_value)
+            for _ in range(count)
+        }
+        txid = self.rpc.sendmany("", amounts)
+        self.splits += 1
+        logger.info(f"Split {count} {self.network} swap pool coins in {txid}")
+        # lock them straight away rather than waiting for the next refresh
+        self.refresh()
+        return txid
+
+    def _reserve(self, uuid, required):
+        """Reserve the smallest confirmed coin worth at least `required` satoshis."""
+        with self._lock:
+            candidates = [
+                c
+                for c in self._coins.values()
+                if c.reserved_by is None
+                and c.confirmations >= self.min_confirmations
+                and c.value >= required
+            ]
+            if not candidates:
+                return None
+            coin = min(candidates, key=lambda c: c.value)
+            coin.reserved_by = uuid
+            return coin
+
+    def _forget(self, coin):
+        with self._lock:
+            self._coins.pop((coin.txid, coin.vout), None)
+        try:
+            self.rpc.lockunspent(True, [coin.outpoint])
+        except JSONRPCException:
+            # already spent, or never locked
+            pass
+
+    def _fee_rate(self, conf_target):
+        """sat/vbyte for conf_target."""
+        result = self.rpc.estimatesmartfee(conf_target)
+        if "feerate" not in result:
+            return self.min_fee_rate
+        # in Decimal, a float rate a hair above a whole number rounds the fee up a sat
+        return max(self.min_fee_rate, Decimal(result["feerate"]) * SAT_PER_BTC / 1000)
+
+    def fund(self, uuid, address, amount, conf_target):
+        """
+        Pay `amount` satoshis to address from a reserved pool coin, returning the txid,
+        or None if the pool can't fund it. Raises FundingUnknown if it can't tell.
+        """
+        with self._lock:
+            coin = next(
+                (c for c in self._coins.values() if c.reserved_by == uuid and c.signed),
+                None,
+            )
+        if coin is not None:
+            # an earlier attempt which may have been sent, it's safe to send it again
+            return self._send(uuid, coin, resend=True)
+        fee_rate = self._fee_rate(conf_target)
+        fee = math.ceil(FUNDING_VBYTES * fee_rate)
+        coin = self._reserve(uuid, amount + fee)
+        if coin is None:
+            self.fallbacks += 1
+            return None
+        outputs = {address: _btc(amount)}
+        change = coin.value - amount - fee
+        try:
+            if change >= DUST_LIMIT:
+                outputs[self.rpc.getrawchangeaddress("bech32")] = _btc(change)
+            raw = self.rpc.createrawtransaction(
+                [dict(coin.outpoint, sequence=SEQUENCE_RBF)], outputs
+            )
+            signed = self.rpc.signrawtransactionwithwallet(raw)
+            if not signed["complete"]:
+                raise JSONRPCException(
+                    {"code": -1, "message": f"Couldn't sign {coin.txid}:{coin.vout}"}
+                )
+        except (JSONRPCException, OSError, http.client.HTTPException) as e:
+            # nothing has been sent
+            return self._failed(uuid, coin, e)
+        coin.signed = signed["hex"]
+        return self._send(uuid, coin)
+
+    def _send(self, uuid, coin, resend=False):
+        try:
+            txid = self.rpc.sendrawtransaction(coin.signed)
+        except JSONRPCException as e:
+            # rejected, so this attempt paid nothing. An earlier one may have been
+            # sent though, and now be rejected as its input is spent.
+            txid = self._sent_txid(uuid, coin) if resend else None
+            if txid is None:
+                return self._failed(uuid, coin, e)
+        except (OSError, http.client.HTTPException) as e:
+            # lost on the way there or on the way back, ask the wallet which
+            logger.warning(f"Sending the funding of swap {uuid} failed: {e}")
+            txid = self._sent_txid(uuid, coin)
+            if txid is None:
+                raise FundingUnknown(uuid, e)
+        with self._lock:
+            self._coins.pop((coin.txid, coin.vout), None)
+        self.funded += 1
+        return txid
+
+    def _sent_txid(self, uuid, coin):
+        """
+        The txid of the coin's signed transaction if the wallet has it, or None if it
+        doesn't. Raises FundingUnknown if the wallet can't be asked.
+        """
+        txid = None
+        try:
+            txid = self.rpc.decoderawtransaction(coin.signed)["txid"]
+            tx = self.rpc.gettransaction(txid)
+        except JSONRPCException as e:
+            # -5, the wallet has never seen it
+            if txid is not None and e.error.get("code") == -5:
+                return None
+            raise FundingUnknown(uuid, e)
+        except (OSError, http.client.HTTPException) as e:
+            raise FundingUnknown(uuid, e)
+        # negative confirmations mean it conflicts with a transaction in the chain
+        return txid if tx["confirmations"] >= 0 else None
+
+    def _failed(self, uuid, coin, error):
+        # unlock it, the next refresh adds it back to the pool if it's unspent
+        logger.warning(f"Funding swap {uuid} from the coin pool failed: {error}")
+        self._forget(coin)
+        self.fallbacks += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            coins = list(self._coins.values())
+        return {
+            "available": sum(
+                1
+                for c in coins
+                if c.reserved_by is None and c.confirmations >= self.min_confirmations
+            ),
+            "unconfirmed": sum(
+                1 for c in coins if c.confirmations < self.min_confirmations
+            ),
+            "reserved": sum(1 for c in coins if c.reserved_by is not None),
+            "funded": self.funded,
+            "fallbacks": self.fallbacks,
+            "splits": self.splits,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"coin-pool-{self.network}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                self.split()
+            except (JSONRPCException, OSError, http.client.HTTPException) as e:
+                logger.error(f"Maintaining the {self.network} coin pool failed: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,108 @@
+"""Fee selection and bumping for swap funding transactions.
+
+A swap's funding transaction has to confirm with enough blocks left before the swap's
+timeout for the swap server to pay the invoice and claim the funds, `margin` blocks.
+Funding transactions are sent with a confirmation target of however many blocks remain
+before that deadline (capped at `max_target`, so swaps still complete promptly) and
+signal replace-by-fee. FeeBumper then checks unconfirmed funding transactions after
+each block, and once the deadline is close bumps any paying less than
+estimatesmartfee for the blocks left.
+"""
+
+import http.client
+import logging
+from decimal import Decimal
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.database import db, events
+
+logger = logging.getLogger(__name__)
+
+SAT_PER_BTC = 100_000_000
+
+
+def blocks_to_deadline(timeout_block_height, height, margin):
+    """Blocks left for a funding transaction to confirm in, zero or less if too late."""
+    return timeout_block_height - margin - height
+
+
+def conf_target(blocks_left, max_target):
+    return max(1, min(blocks_left, max_target))
+
+
+class FeeBumper:
+    def __init__(self, rpc, network, tracker, margin=6, bump_within=6):
+        self.rpc = rpc
+        self.network = network
+        self.tracker = tracker
+        self.margin = margin
+        self.bump_within = bump_within
+        self.checked = 0
+        self.bumped = 0
+
+    def on_block(self, height, block_hash):
+        try:
+            self.run(height)
+        except (
+            JSONRPCException,
+            OSError,
+            http.client.HTTPException,
+            SQLAlchemyError,
+        ) as e:
+            logger.error(f"Bumping {self.network} funding fees failed: {e}")
+
+    def run(self, height):
+        """Bump unconfirmed funding transactions close to their deadline."""
+        rows = db.lookup_unconfirmed_funding(
+            self.network, height + self.margin + self.bump_within
+        )
+        for row in rows:
+            blocks_left = blocks_to_deadline(
+                row["timeout_block_height"], height, self.margin
+            )
+            if blocks_left < 1:
+                # too late for the swap server to claim, it'll be refunded instead
+                continue
+            self.checked += 1
+            try:
+                self._bump(row["uuid"], row["txid"], blocks_left)
+            except JSONRPCException as e:
+                logger.warning(
+                    f"Can't bump funding {row['txid']} of {row['uuid']}: {e}"
+                )
+
+    def _bump(self, uuid, txid, blocks_left):
+        tx = self.rpc.gettransaction(txid)
+        if tx["confirmations"] != 0:
+            # confirmed (or conflicted) since the last block was processed
+            return None
+        vsize = self.rpc.decoderawtransaction(tx["hex"])["vsize"]
+        fee_rate = -Decimal(tx["fee"]) * SAT_PER_BTC / vsize
+        estimate = self.rpc.estimatesmartfee(blocks_left)
+        if "feerate" not in estimate:
+            return None
+        target_rate = Decimal(estimate["feerate"]) * SAT_PER_BTC / 1000
+        if fee_rate >= target_rate:
+            return None
+        try:
+            result = self.rpc.bumpfee(txid, {"conf_target": blocks_left})
+        except JSONRPCException as e:
+            # bitcoind before 0.21 rejects the unknown key, it calls it confTarget
+            if e.error.get("code") != -3:
+                raise
+            result = self.rpc.bumpfee(txid, {"confTarget": blocks_left})
+        new_txid = result["txid"]
+        db.replace_txid(uuid, txid, new_txid)
+        events.publish(uuid, "funding_replaced", txid=new_txid, replaced_txid=txid)
+        self.tracker.watch(uuid, txid=new_txid)
+        self.bumped += 1
+        logger.info(
+            f"Bumped funding of {uuid} from {fee_rate:.1f} to {target_rate:.1f} sat/vB "
+            f"with {blocks_left} blocks to go, {txid} replaced by {new_txid}"
+        )
+        return new_txid
+
+    def stats(self):
+        return {"checked": self.checked, "bumped": self.bumped}
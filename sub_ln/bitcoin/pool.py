@@ -0,0 +1,267 @@
+"""Load balanced pool of bitcoind RPC backends for a single network.
+
+Each backend keeps its own small pool of AuthServiceProxy connections. Calls which use
+the wallet are always sent to the backend which owns it, everything else goes to the
+healthy backend with the fewest requests in flight. A background health check marks
+backends which are slow to respond or lagging behind the best known tip as unhealthy
+so they stop receiving read-only calls until they recover.
+"""
+
+import http.client
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+from sub_ln.bitcoin.authproxy import AuthServiceProxy, JSONRPCException
+
+logger = logging.getLogger(__name__)
+
+# RPCs which need the wallet, these are pinned to the backend that has it. Transactions
+# are also broadcast there so the wallet sees them straight away.
+WALLET_METHODS = frozenset(
+    {
+        "abandontransaction",
+        "bumpfee",
+        "dumpprivkey",
+        "fundrawtransaction",
+        "getaddressinfo",
+        "getbalance",
+        "getnewaddress",
+        "getrawchangeaddress",
+        "gettransaction",
+        "getwalletinfo",
+        "listlockunspent",
+        "listtransactions",
+        "listunspent",
+        "lockunspent",
+        "sendmany",
+        "sendrawtransaction",
+        "sendtoaddress",
+        "settxfee",
+        "signrawtransactionwithwallet",
+        "walletcreatefundedpsbt",
+        "walletprocesspsbt",
+    }
+)
+
+LATENCY_SAMPLES = 1000
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class RPCBackend:
+    """A single bitcoind with up to `pool_size` concurrent connections."""
+
+    def __init__(self, url, wallet=False, pool_size=4, timeout=30):
+        self.url = url
+        parsed = urllib.parse.urlparse(url)
+        self.name = f"{parsed.hostname}:{parsed.port}"
+        self.wallet = wallet
+        self.timeout = timeout
+        self.healthy = True
+        self.height = None
+        self.outstanding = 0
+        self.calls = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            self.outstanding += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return AuthServiceProxy(self.url, timeout=self.timeout)
+        except BaseException:
+            with self._lock:
+                self.outstanding -= 1
+            self._slots.release()
+            raise
+
+    def _release(self, proxy, elapsed, ok):
+        with self._lock:
+            self.outstanding -= 1
+            self.calls += 1
+            self._latencies.append(elapsed)
+            if not ok:
+                self.errors += 1
+        # a connection which failed at the transport level is not reused
+        if proxy is not None:
+            self._idle.put(proxy)
+        self._slots.release()
+
+    def call(self, method, *args, **kwargs):
+        proxy = self._acquire()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result = getattr(proxy, method)(*args, **kwargs)
+            ok = True
+            return result
+        except JSONRPCException:
+            # an RPC error, the proxy is still usable
+            ok = True
+            raise
+        finally:
+            self._release(proxy if ok else None, time.perf_counter() - t0, ok)
+
+    def stream(self, method, *args, **kwargs):
+        proxy = self._acquire()
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield from getattr(proxy, method).stream(*args, **kwargs)
+            ok = True
+        except (JSONRPCException, GeneratorExit):
+            # an RPC error or the caller stopping early, the proxy is still usable
+            ok = True
+            raise
+        finally:
+            self._release(proxy if ok else None, time.perf_counter() - t0, ok)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+        return {
+            "backend": self.name,
+            "wallet": self.wallet,
+            "healthy": self.healthy,
+            "height": self.height,
+            "outstanding": self.outstanding,
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_p50": _percentile(latencies, 0.5),
+            "latency_p99": _percentile(latencies, 0.99),
+        }
+
+
+class _PoolMethod:
+    def __init__(self, pool, name):
+        self._pool = pool
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        return self._pool.select(self._name).call(self._name, *args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        return self._pool.select(self._name).stream(self._name, *args, **kwargs)
+
+
+class _PinnedPool:
+    """An RPCPool which sends every call that doesn't need the wallet to `backend`."""
+
+    def __init__(self, pool, backend):
+        self._pool = pool
+        self._backend = backend
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return _PoolMethod(self, name)
+
+    def select(self, method):
+        if method in WALLET_METHODS:
+            return self._pool.select(method)
+        return self._backend
+
+
+class RPCPool:
+    """
+    Used like an AuthServiceProxy, e.g. `pool.getblockcount()` or
+    `pool.getblock.stream(block_hash, 2, path="tx")`.
+    """
+
+    def __init__(self, backends, max_latency=2.0, max_lag=2, health_interval=15):
+        self.backends = backends
+        self.max_latency = max_latency
+        self.max_lag = max_lag
+        self.health_interval = health_interval
+        self._wallet = next((b for b in backends if b.wallet), None)
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, backends, pool_size=4, **kwargs):
+        """Build a pool from a list of {"url": ..., "wallet": bool} dicts."""
+        return cls(
+            [
+                RPCBackend(b["url"], wallet=b.get("wallet", False), pool_size=pool_size)
+                for b in backends
+            ],
+            **kwargs,
+        )
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return _PoolMethod(self, name)
+
+    def select(self, method):
+        if method in WALLET_METHODS:
+            if self._wallet is None:
+                raise JSONRPCException(
+                    {"code": -18, "message": "No wallet backend configured"}
+                )
+            return self._wallet
+        # if nothing is healthy, try everything rather than failing outright
+        candidates = [b for b in self.backends if b.healthy] or self.backends
+        return min(candidates, key=lambda b: b.outstanding)
+
+    def pin(self):
+        """
+        A view of the pool which sends read-only calls to a single backend, for a
+        sequence of calls which must all see the same chain, e.g. walking blocks.
+        """
+        return _PinnedPool(self, self.select("getblockcount"))
+
+    def check_health(self):
+        for backend in self.backends:
+            t0 = time.perf_counter()
+            try:
+                backend.height = backend.call("getblockcount")
+            except (JSONRPCException, OSError, http.client.HTTPException) as e:
+                logger.warning(f"RPC backend {backend.name} failed health check: {e}")
+                backend.healthy = False
+                continue
+            backend.healthy = time.perf_counter() - t0 <= self.max_latency
+        heights = [b.height for b in self.backends if b.healthy]
+        if not heights:
+            return
+        best = max(heights)
+        for backend in self.backends:
+            if backend.healthy and best - backend.height > self.max_lag:
+                backend.healthy = False
+        for backend in self.backends:
+            if not backend.healthy:
+                logger.debug(f"RPC backend {backend.name} marked unhealthy")
+
+    def stats(self):
+        return [backend.stats() for backend in self.backends]
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="rpc-health", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.health_interval)
@@ -0,0 +1,209 @@
+import http.client
+import logging
+import math
+from decimal import Decimal
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from sub_ln.bitcoin import secp256k1
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.bitcoin.transaction import Transaction, TxIn, estimate_size, sign_refund
+from sub_ln.database import db, events
+
+logger = logging.getLogger(__name__)
+
+SAT_PER_BTC = 100_000_000
+DUST_LIMIT = 546
+# bitcoind's default -incrementalrelayfee, in sat/vbyte
+INCREMENTAL_RELAY_FEE = 1
+
+
+class RefundEngine:
+    """
+    Refunds swaps which timed out without the swap service claiming them.
+
+    After each new block every refundable swap funding output on the network is spent
+    in a single transaction paying back to a fresh wallet address, so the fee and the
+    number of transactions grow with the number of blocks containing failures rather
+    than the number of failed swaps. Inputs are signed with the refund address's key
+    from dumpprivkey, which requires a legacy (non-descriptor) wallet.
+
+    Refunds signal replaceability (BIP 125). The swaps stay refunding until the tracker
+    sees the refund confirm, and a refund which hasn't confirmed `replace_after` blocks
+    after it was sent is signed again at a higher fee, which also covers one dropped
+    from the mempool.
+    """
+
+    def __init__(
+        self,
+        rpc,
+        network,
+        tracker=None,
+        conf_target=6,
+        min_fee_rate=1,
+        max_inputs=200,
+        replace_after=6,
+    ):
+        self.rpc = rpc
+        self.network = network
+        self.tracker = tracker
+        self.conf_target = conf_target
+        self.min_fee_rate = min_fee_rate
+        self.max_inputs = max_inputs
+        self.replace_after = replace_after
+        self.refunded = 0
+        self.transactions = 0
+        self.replaced = 0
+
+    def on_block(self, height, block_hash):
+        try:
+            self.run(height)
+        except (
+            JSONRPCException,
+            OSError,
+            http.client.HTTPException,
+            SQLAlchemyError,
+        ) as e:
+            logger.error(f"Refunding {self.network} swaps failed: {e}")
+
+    def run(self, height):
+        """
+        Replace refunds which are taking too long to confirm, then refund everything
+        refundable at height. Returns the new refund's txid or None.
+        """
+        if self.replace_after:
+            self.replace_stuck(height)
+        rows = db.lookup_refundable(self.network, height, self.max_inputs)
+        return self._refund(rows, height)
+
+    def replace_stuck(self, height):
+        """Sign refunds sent `replace_after` blocks ago again, at a higher fee."""
+        stuck = {}
+        for row in db.lookup_pending_refunds(
+            self.network, sent_before=height - self.replace_after
+        ):
+            stuck.setdefault(row["refund_txid"], []).append(row)
+        for old_txid, rows in stuck.items():
+            old_fee = max(row["refund_fee"] or 0 for row in rows)
+            try:
+                txid = self._refund(rows, height, replaces=old_fee)
+            except JSONRPCException as e:
+                logger.warning(
+                    f"Replacing {self.network} refund {old_txid} failed: {e}"
+                )
+                continue
+            if txid is not None:
+                self.replaced += 1
+                logger.info(f"Replaced {self.network} refund {old_txid} with {txid}")
+
+    def _refund(self, rows, height, replaces=None):
+        """
+        Spend the rows' funding outputs back to the wallet, returning the txid or None.
+        `replaces` is the fee of the refund being replaced, the new one pays more.
+        """
+        inputs, keys, uuids, timeouts = [], [], [], []
+        for row in rows:
+            try:
+                # outputs spent by a transaction in the mempool, like the refund being
+                # replaced, can still be spent by a replacement
+                output = self._funding_output(row, include_mempool=replaces is None)
+                if output is None:
+                    if replaces is not None:
+                        logger.info(f"Swap {row['uuid']} was claimed while refunding")
+                        db.cancel_refund(row["uuid"])
+                    continue
+                key = self._refund_key(row["refund_address"])
+            except (JSONRPCException, ValueError) as e:
+                logger.warning(f"Can't refund swap {row['uuid']}: {e}")
+                continue
+            vout, value = output
+            redeem_script = bytes.fromhex(row["redeem_script"])
+            inputs.append(TxIn(row["txid"], vout, value, redeem_script))
+            keys.append(key)
+            uuids.append(row["uuid"])
+            timeouts.append(row["timeout_block_height"])
+        if not inputs:
+            return None
+
+        address = self.rpc.getnewaddress()
+        script_pub_key = bytes.fromhex(self.rpc.getaddressinfo(address)["scriptPubKey"])
+        # the script's CHECKLOCKTIMEVERIFY needs the lock time to be at least the
+        # timeout of every input
+        tx = Transaction(inputs, [(0, script_pub_key)], locktime=max(timeouts))
+        size = estimate_size(tx)
+        fee = math.ceil(size * self._fee_rate())
+        if replaces is not None:
+            # BIP 125: a replacement pays for its own relay on top of the fee it replaces
+            fee = max(fee, replaces + math.ceil(size * INCREMENTAL_RELAY_FEE))
+        amount = sum(txin.value for txin in inputs) - fee
+        if amount < DUST_LIMIT:
+            logger.warning(
+                f"Not refunding {len(inputs)} {self.network} swaps, fee of {fee} sat "
+                f"exceeds their value"
+            )
+            return None
+        tx.outputs = [(amount, script_pub_key)]
+        sign_refund(tx, keys)
+        txid = self.rpc.sendrawtransaction(tx.serialize().hex())
+        db.add_refunds(uuids, txid, fee, height)
+        if self.tracker is not None:
+            self.tracker.watch_refund(txid, uuids)
+            for uuid in uuids:
+                self.tracker.unwatch(uuid)
+        events.publish_many(
+            [(uuid, "refund_sent", {"refund_txid": txid}) for uuid in uuids]
+        )
+        self.transactions += 1
+        if replaces is None:
+            self.refunded += len(uuids)
+        logger.info(
+            f"Refunding {len(uuids)} {self.network} swaps in {txid}, fee {fee} sat"
+        )
+        return txid
+
+    def _funding_output(self, row, include_mempool=True):
+        """(vout, value in satoshis) of the swap's funding output, None if it's spent."""
+        funding = self.rpc.gettransaction(row["txid"])
+        decoded = self.rpc.decoderawtransaction(funding["hex"])
+        for vout in decoded["vout"]:
+            script_pub_key = vout["scriptPubKey"]
+            addresses = script_pub_key.get("addresses") or [
+                script_pub_key.get("address")
+            ]
+            if row["swap_p2sh_address"] in addresses:
+                break
+        else:
+            raise ValueError(
+                f"No output to {row['swap_p2sh_address']} in {row['txid']}"
+            )
+        if self.rpc.gettxout(row["txid"], vout["n"], include_mempool) is None:
+            # already spent, most likely claimed by the swap service
+            return None
+        return vout["n"], int(Decimal(vout["value"]) * SAT_PER_BTC)
+
+    def _refund_key(self, address):
+        secret, compressed = secp256k1.decode_wif(self.rpc.dumpprivkey(address))
+        if not compressed:
+            raise ValueError(f"Refund address {address} uses an uncompressed key")
+        pubkey = secp256k1.public_key(secret)
+        expected = self.rpc.getaddressinfo(address).get("pubkey")
+        if expected is not None and bytes.fromhex(expected) != pubkey:
+            raise ValueError(f"Key for {address} does not match the wallet's pubkey")
+        return secret, pubkey
+
+    def _fee_rate(self):
+        """Target fee rate in sat/vbyte."""
+        try:
+            result = self.rpc.estimatesmartfee(self.conf_target)
+        except JSONRPCException:
+            result = {}
+        if "feerate" not in result:
+            return self.min_fee_rate
+        return max(self.min_fee_rate, float(result["feerate"]) * SAT_PER_BTC / 1000)
+
+    def stats(self):
+        return {
+            "refunded": self.refunded,
+            "transactions": self.transactions,
+            "replaced": self.replaced,
+        }
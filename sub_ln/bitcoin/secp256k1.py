@@ -0,0 +1,164 @@
+"""Minimal secp256k1 ECDSA signing for refund transactions.
+
+bitcoind's wallet can't sign the swap HTLC scripts, so refunds are signed here with the
+private key of the refund address. Only what is needed for that is implemented:
+deriving the compressed public key, deterministic (RFC 6979) signing with low-S
+normalisation, DER encoding and decoding WIF private keys from dumpprivkey.
+
+This is plain Python integer arithmetic and makes no attempt at constant time
+operation, keys should only be used on a machine the operator controls.
+"""
+
+import hashlib
+import hmac
+
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (
+    0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+    0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
+)
+
+_B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def _inverse(value, modulus):
+    # P and N are prime, pow(value, -1, modulus) needs python 3.8
+    return pow(value, modulus - 2, modulus)
+
+
+def _jacobian_double(p):
+    x, y, z = p
+    if not y:
+        return (0, 0, 0)
+    ysq = y * y % P
+    s = 4 * x * ysq % P
+    m = 3 * x * x % P
+    nx = (m * m - 2 * s) % P
+    ny = (m * (s - nx) - 8 * ysq * ysq) % P
+    nz = 2 * y * z % P
+    return (nx, ny, nz)
+
+
+def _jacobian_add(p, q):
+    if not p[1]:
+        return q
+    if not q[1]:
+        return p
+    u1 = p[0] * q[2] ** 2 % P
+    u2 = q[0] * p[2] ** 2 % P
+    s1 = p[1] * q[2] ** 3 % P
+    s2 = q[1] * p[2] ** 3 % P
+    if u1 == u2:
+        if s1 != s2:
+            return (0, 0, 1)
+        return _jacobian_double(p)
+    h = u2 - u1
+    r = s2 - s1
+    h2 = h * h % P
+    h3 = h * h2 % P
+    u1h2 = u1 * h2 % P
+    nx = (r * r - h3 - 2 * u1h2) % P
+    ny = (r * (u1h2 - nx) - s1 * h3) % P
+    nz = h * p[2] * q[2] % P
+    return (nx, ny, nz)
+
+
+def point_multiply(k, point=G):
+    result = (0, 0, 1)
+    addend = (point[0], point[1], 1)
+    while k:
+        if k & 1:
+            result = _jacobian_add(result, addend)
+        addend = _jacobian_double(addend)
+        k >>= 1
+    x, y, z = result
+    z_inv = _inverse(z, P)
+    return (x * z_inv**2 % P, y * z_inv**3 % P)
+
+
+def public_key(secret):
+    """The 33 byte compressed public key for an integer private key."""
+    x, y = point_multiply(secret)
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, "big")
+
+
+def _rfc6979_nonce(secret, digest):
+    x = secret.to_bytes(32, "big")
+    h = (int.from_bytes(digest, "big") % N).to_bytes(32, "big")
+    v = b"\x01" * 32
+    k = b"\x00" * 32
+    k = hmac.new(k, v + b"\x00" + x + h, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    k = hmac.new(k, v + b"\x01" + x + h, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    while True:
+        v = hmac.new(k, v, hashlib.sha256).digest()
+        nonce = int.from_bytes(v, "big")
+        if 1 <= nonce < N:
+            return nonce
+        k = hmac.new(k, v + b"\x00", hashlib.sha256).digest()
+        v = hmac.new(k, v, hashlib.sha256).digest()
+
+
+def _der_integer(value):
+    encoded = value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+    if encoded[0] & 0x80:
+        encoded = b"\x00" + encoded
+    return b"\x02" + bytes([len(encoded)]) + encoded
+
+
+def sign(secret, digest):
+    """
+    Sign a 32 byte digest, returning the DER encoded signature with a low S value as
+    required by bitcoind's standardness rules.
+    """
+    z = int.from_bytes(digest, "big")
+    k = _rfc6979_nonce(secret, digest)
+    r = point_multiply(k)[0] % N
+    s = _inverse(k, N) * (z + r * secret) % N
+    if s > N // 2:
+        s = N - s
+    body = _der_integer(r) + _der_integer(s)
+    return b"\x30" + bytes([len(body)]) + body
+
+
+def verify(pubkey, digest, signature):
+    """Check a DER signature from sign() against a compressed public key."""
+    r_len = signature[3]
+    r = int.from_bytes(signature[4 : 4 + r_len], "big")
+    s = int.from_bytes(signature[6 + r_len :], "big")
+    x = int.from_bytes(pubkey[1:], "big")
+    y_sq = (pow(x, 3, P) + 7) % P
+    y = pow(y_sq, (P + 1) // 4, P)
+    if y & 1 != pubkey[0] & 1:
+        y = P - y
+    w = _inverse(s, N)
+    z = int.from_bytes(digest, "big")
+    u1 = point_multiply(z * w % N)
+    u2 = point_multiply(r * w % N, (x, y))
+    point = _jacobian_add((u1[0], u1[1], 1), (u2[0], u2[1], 1))
+    z_inv = _inverse(point[2], P)
+    return point[0] * z_inv**2 % P % N == r
+
+
+def _base58check_decode(value):
+    number = 0
+    for char in value:
+        number = number * 58 + _B58_ALPHABET.index(char)
+    data = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    data = b"\x00" * (len(value) - len(value.lstrip("1"))) + data
+    payload, checksum = data[:-4], data[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("Invalid base58 checksum")
+    return payload
+
+
+def decode_wif(wif):
+    """Return (secret, compressed) for a WIF private key as returned by dumpprivkey."""
+    payload = _base58check_decode(wif)
+    if len(payload) == 34 and payload[-1] == 1:
+        return int.from_bytes(payload[1:33], "big"), True
+    if len(payload) == 33:
+        return int.from_bytes(payload[1:], "big"), False
+    raise ValueError("Invalid WIF private key")
@@ -0,0 +1,203 @@
+"""Incremental decoding of large bitcoind JSON-RPC responses.
+
+The standard AuthServiceProxy path reads the whole HTTP body, decodes it to a str and
+then parses it, holding several copies of the payload in memory at once. For wallet
+and block calls that return many megabytes this is wasteful. The helpers here read the
+response in fixed size chunks and yield each element of the result array as soon as it
+has been parsed, so peak memory is bounded by the largest single element rather than
+the whole response.
+
+Numbers which look like floats are only converted to Decimal when they are the value of
+a known amount field, everything else is returned as a float.
+"""
+
+import codecs
+import decimal
+import json
+
+CHUNK_SIZE = 64 * 1024
+_NUMBER_CHARS = "0123456789.eE+-"
+
+# Fields which hold BTC amounts in bitcoind responses and must not lose precision
+AMOUNT_FIELDS = frozenset(
+    {
+        "amount",
+        "balance",
+        "fee",
+        "fees",
+        "feerate",
+        "value",
+        "immature_balance",
+        "unconfirmed_balance",
+        "trusted",
+        "untrusted_pending",
+        "immature",
+        "ancestorfees",
+        "descendantfees",
+        "modifiedfee",
+        "base",
+        "modified",
+        "ancestor",
+        "descendant",
+    }
+)
+
+
+class _RawNumber(str):
+    """Float literal kept as text until we know which field it belongs to."""
+
+
+def _convert(value):
+    if isinstance(value, _RawNumber):
+        return float(value)
+    if isinstance(value, list):
+        return [_convert(v) for v in value]
+    return value
+
+
+def _object_hook(obj):
+    for key, value in obj.items():
+        if isinstance(value, _RawNumber):
+            obj[key] = decimal.Decimal(value) if key in AMOUNT_FIELDS else float(value)
+        elif isinstance(value, list):
+            obj[key] = _convert(value)
+    return obj
+
+
+_decoder = json.JSONDecoder(parse_float=_RawNumber, object_hook=_object_hook)
+
+
+class StreamDecodeError(ValueError):
+    pass
+
+
+class StreamRPCError(Exception):
+    def __init__(self, rpc_error):
+        super().__init__(rpc_error)
+        self.error = rpc_error
+
+
+class _Reader:
+    """
+    Minimal pull parser over a file-like object. Only the structural tokens around the
+    streamed array are handled here, each value is handed to the stdlib decoder.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # handles multi-byte utf-8 sequences split across chunks
+        self._utf8 = codecs.getincrementaldecoder("utf8")()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            self._utf8.decode(b"", final=True)
+            return False
+        # drop what has already been consumed so the buffer doesn't grow unbounded
+        self.buf = self.buf[self.pos :] + self._utf8.decode(data)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise StreamDecodeError("unexpected end of response")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise StreamDecodeError(
+                f"expected {char!r} at offset {self.pos}, got {self.buf[self.pos]!r}"
+            )
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if (
+                self.buf[end - 1].isdigit()
+                and (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS)
+                and self._fill()
+            ):
+                continue
+            self.pos = end
+            return _convert(obj)
+
+    def array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            sep = self.peek()
+            self.pos += 1
+            if sep == "]":
+                return
+            if sep != ",":
+                raise StreamDecodeError(f"expected ',' or ']' got {sep!r}")
+
+    def members(self):
+        """Yield the keys of an object, the caller must consume each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            sep = self.peek()
+            self.pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise StreamDecodeError(f"expected ',' or '}}' got {sep!r}")
+
+
+def iter_result(fp, path=None, chunk_size=CHUNK_SIZE):
+    """
+    Parse a JSON-RPC response from fp, yielding the elements of the "result" array.
+
+    If the result is an object, `path` names the member holding the array to stream
+    (e.g. "tx" for getblock). Any other members are parsed and discarded. A non-null
+    "error" member is returned to the caller by raising StreamRPCError.
+    """
+    reader = _Reader(fp, chunk_size)
+    envelope = {}
+    for key in reader.members():
+        if key != "result":
+            envelope[key] = reader.value()
+            if key == "error" and envelope[key] is not None:
+                raise StreamRPCError(envelope[key])
+            continue
+        if reader.peek() == "[":
+            yield from reader.array()
+        elif reader.peek() == "{" and path is not None:
+            for member in reader.members():
+                if member == path and reader.peek() == "[":
+                    yield from reader.array()
+                else:
+                    reader.value()
+        else:
+            # null or scalar result, usually accompanied by an error
+            envelope[key] = reader.value()
+    if envelope.get("error") is not None:
+        raise StreamRPCError(envelope["error"])
@@ -0,0 +1,229 @@
+import http.client
+import logging
+import threading
+from collections import deque
+
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.database import db, events
+
+logger = logging.getLogger(__name__)
+
+# how many recent block hashes to remember for detecting re-orgs
+REORG_DEPTH = 12
+
+
+class ConfirmationTracker:
+    """
+    Follows the chain one block at a time and records when swap funding transactions,
+    and the refunds of swaps which timed out, confirm.
+
+    Outstanding funding txids and swap addresses are kept in memory, so the work done
+    for each block depends only on the size of the block and not on how many swaps are
+    pending. Each block is fetched once using getblockhash/getblock and its
+    transactions are streamed rather than decoded in one go.
+    """
+
+    def __init__(self, rpc, network, poll_interval=30):
+        self.rpc = rpc
+        self.network = network
+        self.poll_interval = poll_interval
+        self.height = None
+        self._recent = deque(maxlen=REORG_DEPTH)
+        self._txids = {}
+        self._addresses = {}
+        self._watched = {}
+        # refund txid -> uuids of the swaps it refunds, including replaced refunds
+        self._refunds = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def load(self, rpc=None):
+        """Rebuild the watch set from the database and start following from the tip."""
+        rpc = rpc or self.rpc
+        with self._lock:
+            self._txids.clear()
+            self._addresses.clear()
+            self._watched.clear()
+            self._refunds.clear()
+            for row in db.lookup_unconfirmed_swaps(self.network):
+                uuid, txid, *addresses = row
+                self._watch(uuid, txid, addresses)
+            for row in db.lookup_pending_refunds(self.network):
+                self._refunds.setdefault(row["refund_txid"], set()).add(row["uuid"])
+        if self.height is None:
+            # carry on from the last block processed before a restart, so funding
+            # which confirmed while the server was down is still seen
+            tip = db.lookup_chain_tip(self.network)
+            if tip is None:
+                height = rpc.getblockcount()
+                tip = (height, rpc.getblockhash(height))
+                db.save_chain_tip(self.network, *tip)
+            self.height = tip[0]
+            self._recent.append(tip)
+        logger.debug(f"Tracking {len(self._watched)} unconfirmed {self.network} swaps")
+
+    def watch(self, uuid, txid=None, addresses=()):
+        with self._lock:
+            self._watch(uuid, txid, addresses)
+
+    def _watch(self, uuid, txid, addresses):
+        old_txid, old_addresses = self._watched.get(uuid, (None, ()))
+        txid = txid or old_txid
+        addresses = tuple(a for a in addresses if a) or old_addresses
+        self._watched[uuid] = (txid, addresses)
+        if old_txid and old_txid != txid:
+            # replaced by a fee bump
+            self._txids.pop(old_txid, None)
+        if txid:
+            self._txids[txid] = uuid
+        for address in addresses:
+            self._addresses[address] = uuid
+
+    def watch_refund(self, txid, uuids):
+        """
+        Look for a refund transaction, recording the swaps as refunded once it confirms.
+        A refund it replaces is still looked for, in case that confirms instead.
+        """
+        with self._lock:
+            self._refunds[txid] = set(uuids)
+
+    def unwatch(self, uuid):
+        """Stop looking for a swap's funding, e.g. once the swap has been settled."""
+        with self._lock:
+            self._unwatch(uuid)
+
+    def _unwatch(self, uuid):
+        txid, addresses = self._watched.pop(uuid, (None, ()))
+        self._txids.pop(txid, None)
+        for address in addresses:
+            self._addresses.pop(address, None)
+
+    def add_listener(self, callback):
+        """Call callback(height, block_hash) after each new block has been processed."""
+        self._listeners.append(callback)
+
+    @property
+    def pending(self):
+        return len(self._watched)
+
+    def poll(self):
+        """Process every block between the last one seen and the current tip."""
+        # backends can briefly disagree about the chain, so a poll only asks one of
+        # them or a block hash from another would look like a re-org
+        rpc = self.rpc.pin()
+        if self.height is None:
+            self.load(rpc)
+            return
+        self._check_reorg(rpc)
+        tip = rpc.getblockcount()
+        while self.height < tip:
+            self.process_block(self.height + 1, rpc)
+
+    def _check_reorg(self, rpc):
+        fork = None
+        for height, block_hash in reversed(self._recent):
+            if rpc.getblockhash(height) == block_hash:
+                break
+            fork = height
+        if fork is None:
+            return
+        logger.warning(
+            f"{self.network} chain re-org detected, rewinding to height {fork - 1}"
+        )
+        while self._recent and self._recent[-1][0] >= fork:
+            self._recent.pop()
+        db.clear_confirmations(self.network, fork)
+        self.height = fork - 1
+        self.load(rpc)
+
+    def process_block(self, height, rpc=None):
+        rpc = rpc or self.rpc
+        block_hash = rpc.getblockhash(height)
+        confirmed = {}
+        refunds = {}
+        # lookups don't take the lock, a swap settled and unwatched meanwhile is still
+        # recorded as confirmed but keeps its state
+        for tx in rpc.getblock.stream(block_hash, 2, path="tx"):
+            if tx["txid"] in self._refunds:
+                refunds[tx["txid"]] = self._refunds[tx["txid"]]
+                continue
+            uuid = self._txids.get(tx["txid"])
+            if uuid is None:
+                uuid = self._match_outputs(tx)
+            if uuid is not None and uuid not in confirmed:
+                confirmed[uuid] = {
+                    "uuid": uuid,
+                    "txid": tx["txid"],
+                    "height": height,
+                    "block_hash": block_hash,
+                }
+        with self._lock:
+            db.add_confirmations(list(confirmed.values()))
+            for uuid in confirmed:
+                self._unwatch(uuid)
+            refunded = []
+            for txid, uuids in refunds.items():
+                refunded += [
+                    (uuid, txid) for uuid in db.confirm_refund(uuids, txid, height)
+                ]
+                # and every other refund of the same swaps, which now can't confirm
+                for other, other_uuids in list(self._refunds.items()):
+                    if other_uuids & uuids:
+                        del self._refunds[other]
+        events.publish_many(
+            [
+                (uuid, "funding_confirmed", {"txid": c["txid"], "height": height})
+                for uuid, c in confirmed.items()
+            ]
+            + [
+                (uuid, "refunded", {"refund_txid": txid, "height": height})
+                for uuid, txid in refunded
+            ]
+        )
+        db.save_chain_tip(self.network, height, block_hash)
+        self.height = height
+        self._recent.append((height, block_hash))
+        for listener in self._listeners:
+            listener(height, block_hash)
+        if confirmed:
+            logger.debug(
+                f"{self.network} block {height}: {len(confirmed)} swap funding confirmations"
+            )
+        if refunded:
+            logger.info(
+                f"{self.network} block {height}: {len(refunded)} swaps refunded"
+            )
+
+    def _match_outputs(self, tx):
+        for vout in tx["vout"]:
+            script_pub_key = vout.get("scriptPubKey", {})
+            if "address" in script_pub_key:
+                addresses = [script_pub_key["address"]]
+            else:
+                addresses = script_pub_key.get("addresses", [])
+            for address in addresses:
+                uuid = self._addresses.get(address)
+                if uuid is not None:
+                    return uuid
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"confirmation-tracker-{self.network}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except (JSONRPCException, OSError, http.client.HTTPException) as e:
+                logger.error(f"Confirmation tracker poll failed: {e}")
+            self._stop.wait(self.poll_interval)
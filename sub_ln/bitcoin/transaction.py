@@ -0,0 +1,136 @@
+"""Building and signing the refund transactions for timed-out swaps.
+
+Swap funding outputs are P2SH, so refunds are legacy (non-segwit) transactions and each
+input is signed with the original SIGHASH_ALL algorithm over the redeem script.
+"""
+
+import hashlib
+import struct
+
+from sub_ln.bitcoin import secp256k1
+
+SIGHASH_ALL = 1
+# nSequence below 0xFFFFFFFE, so the transaction's lock time is enforced and it can be
+# replaced at a higher fee (BIP 125) if it doesn't confirm
+SEQUENCE_RBF = 0xFFFFFFFD
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4C
+OP_PUSHDATA2 = 0x4D
+OP_DUP = 0x76
+OP_SHA256 = 0xA8
+
+
+def sha256d(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def varint(n):
+    if n < 0xFD:
+        return bytes([n])
+    if n <= 0xFFFF:
+        return b"\xfd" + struct.pack("<H", n)
+    if n <= 0xFFFFFFFF:
+        return b"\xfe" + struct.pack("<I", n)
+    return b"\xff" + struct.pack("<Q", n)
+
+
+def push(data):
+    """Minimal script push of data."""
+    if not data:
+        return bytes([OP_0])
+    if len(data) < OP_PUSHDATA1:
+        return bytes([len(data)]) + data
+    if len(data) <= 0xFF:
+        return bytes([OP_PUSHDATA1, len(data)]) + data
+    return bytes([OP_PUSHDATA2]) + struct.pack("<H", len(data)) + data
+
+
+class TxIn:
+    def __init__(self, txid, vout, value, redeem_script, sequence=SEQUENCE_RBF):
+        self.txid = txid
+        self.vout = vout
+        # value of the output being spent in satoshis, only used for fee calculation
+        self.value = value
+        self.redeem_script = redeem_script
+        self.sequence = sequence
+        self.script_sig = b""
+
+    def serialize(self, script):
+        return (
+            bytes.fromhex(self.txid)[::-1]
+            + struct.pack("<I", self.vout)
+            + varint(len(script))
+            + script
+            + struct.pack("<I", self.sequence)
+        )
+
+
+class Transaction:
+    def __init__(self, inputs, outputs, locktime=0, version=2):
+        self.inputs = inputs
+        # list of (value in satoshis, scriptPubKey bytes)
+        self.outputs = outputs
+        self.locktime = locktime
+        self.version = version
+
+    def serialize(self, scripts=None):
+        if scripts is None:
+            scripts = [txin.script_sig for txin in self.inputs]
+        return (
+            struct.pack("<I", self.version)
+            + varint(len(self.inputs))
+            + b"".join(txin.serialize(s) for txin, s in zip(self.inputs, scripts))
+            + varint(len(self.outputs))
+            + b"".join(
+                struct.pack("<Q", value) + varint(len(spk)) + spk
+                for value, spk in self.outputs
+            )
+            + struct.pack("<I", self.locktime)
+        )
+
+    def signature_hash(self, index, sighash=SIGHASH_ALL):
+        """Legacy signature hash for input `index`, its script code is the redeem script."""
+        scripts = [b""] * len(self.inputs)
+        scripts[index] = self.inputs[index].redeem_script
+        return sha256d(self.serialize(scripts) + struct.pack("<I", sighash))
+
+    @property
+    def txid(self):
+        return sha256d(self.serialize())[::-1].hex()
+
+
+def refund_script_sig(signature, pubkey, redeem_script):
+    """
+    scriptSig spending the timeout branch of a swap script.
+
+    Scripts paying to a refund public key hash start OP_DUP OP_SHA256 and hash the
+    pubkey, which won't match the payment hash. Scripts paying to a refund public key
+    start OP_SHA256 and are given an empty dummy value instead.
+    """
+    if redeem_script[:2] == bytes([OP_DUP, OP_SHA256]):
+        items = (signature, pubkey, redeem_script)
+    elif redeem_script[:1] == bytes([OP_SHA256]):
+        items = (signature, b"", redeem_script)
+    else:
+        raise ValueError("Unrecognised swap redeem script")
+    return b"".join(push(item) for item in items)
+
+
+def sign_refund(tx, keys):
+    """
+    Sign every input of tx, filling in each input's scriptSig. keys holds the refund
+    (private key, compressed public key) for each input in turn.
+    """
+    for index, (txin, (secret, pubkey)) in enumerate(zip(tx.inputs, keys)):
+        digest = tx.signature_hash(index)
+        signature = secp256k1.sign(secret, digest) + bytes([SIGHASH_ALL])
+        txin.script_sig = refund_script_sig(signature, pubkey, txin.redeem_script)
+
+
+def estimate_size(tx):
+    """Size of tx once signed, assuming the largest possible signature for each input."""
+    signature = b"\x00" * 73
+    pubkey = b"\x00" * 33
+    scripts = [refund_script_sig(signature, pubkey, t.redeem_script) for t in tx.inputs]
+    return len(tx.serialize(scripts))
@@ -0,0 +1,557 @@
+"""Client for the gateway API, for apps on either side of the mesh.
+
+GatewayClient wraps each endpoint and the order workflow shown in demo.py:
+
+- Independent calls are pipelined: the invoice lookup and refund address requests are
+  sent together rather than one after the other.
+- Requests the server turns away with Retry-After (rate limits, open circuit breakers),
+  and idempotent requests which fail to connect, are retried with exponential backoff
+  and full jitter.
+- Swap status is long polled with If-None-Match where the server supports it, so an
+  unchanged status costs a single empty 304 response. Against servers which don't, it
+  falls back to polling with backoff.
+- Gateways relaying for many nodes can follow all their orders at once with events()
+  (given gateway_id and gateway_token), a server-sent event stream which resumes from
+  the last event after a disconnect.
+- Responses are requested gzipped.
+
+OfflineQueue keeps orders which can't be sent yet in a SQLite file, and OrderSender
+sends them in the background, in order, whenever the gateway can be reached. Each order's
+progress is saved after every step so nothing is paid twice after a restart.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    func,
+    inspect,
+    select,
+)
+
+logger = logging.getLogger(__name__)
+
+URL = "http://127.0.0.1:5000/api/v1/"
+
+# how long each swap/check long poll asks the server to wait
+LONG_POLL_WAIT = 25
+
+# OfflineQueue order states, orders are removed once paid
+QUEUED = "queued"
+CREATED = "created"
+QUOTED = "quoted"
+FAILED = "failed"
+
+
+class GatewayError(Exception):
+    def __init__(self, response):
+        self.status_code = response.status_code
+        try:
+            self.body = response.json()
+        except ValueError:
+            self.body = response.text
+        super().__init__(
+            f"{response.request.method} {response.url}: "
+            f"{self.status_code} {self.body}"
+        )
+
+
+class Backoff:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, base=1.0, cap=60.0):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2**self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _parse_events(lines):
+    """Server-sent events from the lines of an event stream, as dicts."""
+    fields = {}
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield {
+                    "id": fields.get("id"),
+                    "type": fields.get("event", "message"),
+                    "data": json.loads("\n".join(data)),
+                }
+            fields, data = {}, []
+        elif not line.startswith(":"):
+            name, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if name == "data":
+                data.append(value)
+            else:
+                fields[name] = value
+
+
+def _swap_status(body):
+    """The swap server's status from a swap/check response body."""
+    try:
+        return json.loads(body["swap_check"])
+    except (KeyError, TypeError, ValueError):
+        return {}
+
+
+class GatewayClient:
+    def __init__(
+        self,
+        url=URL,
+        client_id=None,
+        gateway_id=None,
+        gateway_token=None,
+        timeout=60,
+        retries=5,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+        max_workers=4,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # one session so connections are kept alive, it asks for gzip by default
+        self.session = requests.Session()
+        if client_id is not None:
+            self.session.headers["X-Client-Id"] = client_id
+        if gateway_id is not None:
+            self.session.headers["X-Gateway-Id"] = gateway_id
+        if gateway_token is not None:
+            self.session.headers["Authorization"] = f"Bearer {gateway_token}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # cleared if the server doesn't support long polling swap/check
+        self.long_poll = True
+        # uuid -> ETag of the last swap/check response
+        self._etags = {}
+
+    def _backoff(self):
+        return Backoff(self.backoff_base, self.backoff_cap)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request, returning the response. Requests answered with Retry-After are
+        retried, as are GET requests which fail to connect or get a 503.
+        """
+        idempotent = method == "GET"
+        backoff = self._backoff()
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.session.request(
+                    method,
+                    self.url + path,
+                    json=body,
+                    headers=headers,
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or last:
+                    raise
+                delay = backoff.next()
+            else:
+                retry_after = _retry_after(response)
+                if last or not (
+                    retry_after is not None
+                    or (idempotent and response.status_code == 503)
+                ):
+                    return response
+                delay = max(retry_after or 0, backoff.next())
+            logger.debug(f"Retrying {method} {path} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _json(self, method, path, body=None):
+        response = self.request(method, path, body)
+        if response.status_code != 200:
+            raise GatewayError(response)
+        return response.json()
+
+    def random_message(self):
+        return self._json("GET", "util/random_message")["message"]
+
+    def estimate(self, message, network):
+        return self._json(
+            "GET", "order/estimate", {"message": message, "network": network}
+        )["estimate"]
+
+    def create_order(self, message, bid, network):
+        """Returns the response body, with the order's "uuid" and Blocksat "order"."""
+        return self._json(
+            "POST",
+            "order/create",
+            {"message": message, "bid": bid, "network": network},
+        )
+
+    def lookup_order(self, uuid):
+        return self._json("GET", "order/lookup", {"uuid": uuid})["order"]
+
+    def lookup_invoice(self, invoice, network):
+        return self._json(
+            "GET", "swap/lookup_invoice", {"invoice": invoice, "network": network}
+        )["invoice"]
+
+    def new_address(self, uuid, address_type="legacy"):
+        return self._json(
+            "GET", "bitcoin/new_address", {"uuid": uuid, "type": address_type}
+        )["address"]
+
+    def quote(self, uuid, invoice, network, refund_address):
+        return self._json(
+            "POST",
+            "swap/quote",
+            {
+                "uuid": uuid,
+                "invoice": invoice,
+                "network": network,
+                "refund_address": refund_address,
+            },
+        )["swap"]
+
+    def pay(self, uuid):
+        return self._json("POST", "swap/pay", {"uuid": uuid})["txid"]
+
+    def check(self, uuid, wait=0):
+        """
+        The swap/check response body, or None if it hasn't changed since the last check.
+        With wait, the server holds the request for up to that many seconds until it
+        changes.
+        """
+        body = {"uuid": uuid}
+        if wait:
+            body["wait"] = wait
+        headers = {}
+        if uuid in self._etags:
+            headers["If-None-Match"] = self._etags[uuid]
+        response = self.request("GET", "swap/check", body, headers)
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200:
+            raise GatewayError(response)
+        if "ETag" in response.headers:
+            self._etags[uuid] = response.headers["ETag"]
+        return response.json()
+
+    def prepare_swap(self, uuid, invoice, network, address_type="legacy"):
+        """
+        Look up the invoice and get a refund address at the same time, then request the
+        swap quote. Returns the quote.
+        """
+        lookup = self._executor.submit(self.lookup_invoice, invoice, network)
+        address = self._executor.submit(self.new_address, uuid, address_type)
+        lookup.result()
+        return self.quote(uuid, invoice, network, address.result())
+
+    def send(self, message, bid, network, address_type="legacy"):
+        """
+        Place an order and pay for it, returning (uuid, txid). txid is None for a message
+        the gateway had already ordered, which needs no swap.
+        """
+        order = self.create_order(message, bid, network)
+        if order.get("dedup_of"):
+            return order["uuid"], None
+        invoice = order["order"]["lightning_invoice"]["payreq"]
+        self.prepare_swap(order["uuid"], invoice, network, address_type)
+        return order["uuid"], self.pay(order["uuid"])
+
+    def wait_for_swap(self, uuid, timeout=600):
+        """
+        Wait until the swap server has paid the invoice or the swap has timed out,
+        returning the swap server's status. Returns None after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        backoff = Backoff(base=5, cap=60)
+        while time.monotonic() < deadline:
+            remaining = deadline - time.monotonic()
+            if self.long_poll:
+                try:
+                    body = self.check(uuid, wait=min(LONG_POLL_WAIT, remaining))
+                except GatewayError as e:
+                    if e.status_code != 400:
+                        raise
+                    # an older server rejecting "wait", poll instead
+                    logger.info("Server doesn't support long polling, polling instead")
+                    self.long_poll = False
+                    continue
+            else:
+                body = self.check(uuid)
+            if body is not None:
+                status = _swap_status(body)
+                if "state" in body or "payment_secret" in status:
+                    return status
+            if not self.long_poll:
+                time.sleep(min(backoff.next(), max(deadline - time.monotonic(), 0)))
+        return None
+
+    def events(self, last_event_id=None):
+        """
+        Yield the events of every order relayed by this gateway as dicts with "id",
+        "type" and "data", forever. Pass the id of the last event handled to resume
+        after it. The stream is reopened with backoff whenever it drops, carrying on
+        after the last event yielded.
+        """
+        backoff = self._backoff()
+        while True:
+            headers = {"Accept": "text/event-stream"}
+            if last_event_id is not None:
+                headers["Last-Event-ID"] = str(last_event_id)
+            try:
+                with self.session.get(
+                    self.url + "events",
+                    headers=headers,
+                    stream=True,
+                    timeout=self.timeout,
+                ) as response:
+                    retry_after = _retry_after(response)
+                    if response.status_code == 200:
+                        backoff.reset()
+                        # read a byte at a time, the server doesn't chunk the stream
+                        lines = response.iter_lines(chunk_size=1, decode_unicode=True)
+                        for event in _parse_events(lines):
+                            last_event_id = event["id"]
+                            yield event
+                    elif retry_after is None and response.status_code != 503:
+                        raise GatewayError(response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.debug(f"Event stream dropped: {e}")
+                retry_after = None
+            delay = max(retry_after or 0, backoff.next())
+            logger.debug(f"Reopening the event stream in {delay:.1f}s")
+            time.sleep(delay)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class OfflineQueue:
+    """Orders waiting to be sent, kept in a SQLite file so they survive restarts."""
+
+    def __init__(self, path):
+        self.engine = create_engine(f"sqlite:///{path}")
+        metadata = MetaData()
+        self.outbox = Table(
+            "outbox",
+            metadata,
+            Column("id", Integer, primary_key=True),
+            Column("message", String),
+            Column("bid", String),
+            Column("network", String(10)),
+            Column("state", String(10)),
+            Column("uuid", String(32)),
+            Column("invoice", String),
+            Column("error", String),
+            Column("created_at", Integer),
+            # failed attempts to send the order while the gateway was up
+            Column("attempts", Integer, default=0),
+        )
+        metadata.create_all(self.engine)
+        # queue files from before attempts were counted
+        existing = {c["name"] for c in inspect(self.engine).get_columns("outbox")}
+        if "attempts" not in existing:
+            self.engine.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER")
+
+    def put(self, message, bid, network):
+        """Queue an order, returns its id in the queue."""
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                self.outbox.insert().values(
+                    message=message,
+                    bid=str(bid),
+                    network=network,
+                    state=QUEUED,
+                    created_at=int(time.time()),
+                )
+            )
+            return result.inserted_primary_key[0]
+
+    def pending(self):
+        """Orders still to be sent, oldest first."""
+        query = (
+            select([self.outbox])
+            .where(self.outbox.c.state != FAILED)
+            .order_by(self.outbox.c.id)
+        )
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(query)]
+
+    def failed(self):
+        query = select([self.outbox]).where(self.outbox.c.state == FAILED)
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(query)]
+
+    def update(self, order_id, **values):
+        with self.engine.begin() as conn:
+            conn.execute(
+                self.outbox.update()
+                .where(self.outbox.c.id == order_id)
+                .values(**values)
+            )
+
+    def remove(self, order_id):
+        with self.engine.begin() as conn:
+            conn.execute(self.outbox.delete().where(self.outbox.c.id == order_id))
+
+    def __len__(self):
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select([func.count()])
+                .select_from(self.outbox)
+                .where(self.outbox.c.state != FAILED)
+            ).scalar()
+
+
+class OrderSender:
+    """
+    Sends the orders in an OfflineQueue through a GatewayClient. While the gateway can't
+    be reached it retries with backoff, otherwise it checks the queue every `interval`
+    seconds. `on_sent(order_id, uuid, txid)` is called for each order once it's paid.
+
+    An order the gateway keeps failing with a server error is marked failed after
+    `max_attempts` tries, so it doesn't hold up the orders queued after it for good.
+    """
+
+    def __init__(
+        self,
+        client,
+        queue,
+        interval=5,
+        address_type="legacy",
+        on_sent=None,
+        max_attempts=10,
+    ):
+        self.client = client
+        self.queue = queue
+        self.interval = interval
+        self.address_type = address_type
+        self.on_sent = on_sent
+        self.max_attempts = max_attempts
+        self._backoff = Backoff(base=client.backoff_base, cap=client.backoff_cap)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="order-sender", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Try sending straight away, e.g. after queueing an order."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+                self._backoff.reset()
+                delay = self.interval
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self._backoff.next()
+                logger.info(f"Gateway unreachable, retrying in {delay:.1f}s: {e}")
+            except GatewayError as e:
+                # the gateway is up but struggling, e.g. its upstreams are down
+                delay = self._backoff.next()
+                logger.warning(f"Sending queued orders failed: {e}")
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def drain(self):
+        """Send every queued order, returns the number sent."""
+        sent = 0
+        for order in self.queue.pending():
+            if self._stop.is_set():
+                break
+            try:
+                sent += self._send(order)
+            except GatewayError as e:
+                # rate limited or upstreams down, the order itself may be fine
+                if e.status_code in (429, 503):
+                    raise
+                attempts = (order["attempts"] or 0) + 1
+                if e.status_code >= 500 and attempts < self.max_attempts:
+                    self.queue.update(order["id"], attempts=attempts, error=str(e))
+                    raise
+                # rejected, or failing every time, sending it again won't help
+                logger.error(f"Queued order {order['id']} failed: {e}")
+                self.queue.update(
+                    order["id"], state=FAILED, attempts=attempts, error=str(e)
+                )
+        return sent
+
+    def _send(self, order):
+        client = self.client
+        resumed = order["state"]
+        if order["state"] == QUEUED:
+            created = client.create_order(
+                order["message"], order["bid"], order["network"]
+            )
+            if created.get("dedup_of"):
+                self._sent(order, created["uuid"], None)
+                return 1
+            order.update(
+                state=CREATED,
+                uuid=created["uuid"],
+                invoice=created["order"]["lightning_invoice"]["payreq"],
+            )
+            self.queue.update(
+                order["id"],
+                state=CREATED,
+                uuid=order["uuid"],
+                invoice=order["invoice"],
+            )
+        if order["state"] == CREATED:
+            # the last quote request may have gone through with its response lost
+            if resumed != CREATED or not client.lookup_order(order["uuid"])["swaps"]:
+                client.prepare_swap(
+                    order["uuid"], order["invoice"], order["network"], self.address_type
+                )
+            order["state"] = QUOTED
+            self.queue.update(order["id"], state=QUOTED)
+        txid = None
+        if resumed == QUOTED:
+            # the last pay request may have gone through with its response lost
+            txid = client.lookup_order(order["uuid"])["orders"]["txid"]
+        if txid is None:
+            txid = client.pay(order["uuid"])
+        self._sent(order, order["uuid"], txid)
+        return 1
+
+    def _sent(self, order, uuid, txid):
+        self.queue.remove(order["id"])
+        logger.info(f"Sent queued order {order['id']} as {uuid}")
+        if self.on_sent is not None:
+            self.on_sent(order["id"], uuid, txid)
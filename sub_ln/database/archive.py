@@ -0,0 +1,71 @@
+import json
+import time
+import zlib
+
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table
+from sqlalchemy import create_engine
+from sqlalchemy.sql import select
+
+from sub_ln.server.server_config import ARCHIVE_DB_PATH
+
+# Completed orders are moved here from the main database. Each order is stored as a
+# single zlib compressed JSON document holding its orders, blocksat and swaps rows.
+engine = create_engine(f"sqlite:///{ARCHIVE_DB_PATH}")
+metadata = MetaData()
+
+archived_orders = Table(
+    "archived_orders",
+    metadata,
+    Column("uuid", String(32), primary_key=True),
+    Column("network", String(10)),
+    Column("state", String(20)),
+    Column("created_at", Integer),
+    Column("archived_at", Integer),
+    Column("data", LargeBinary),
+)
+
+
+def init():
+    metadata.create_all(engine)
+
+
+def _pack(record):
+    return zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf8"))
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode("utf8"))
+
+
+def add_orders(records):
+    """
+    Store exported order records, see db.export_orders(). Existing entries are
+    replaced so an interrupted archive run can simply be repeated.
+    """
+    if not records:
+        return
+    now = int(time.time())
+    with engine.begin() as conn:
+        conn.execute(
+            archived_orders.insert().prefix_with("OR REPLACE"),
+            [
+                {
+                    "uuid": uuid,
+                    "network": record["orders"]["network"],
+                    "state": record["orders"]["state"],
+                    "created_at": record["orders"]["created_at"],
+                    "archived_at": now,
+                    "data": _pack(record),
+                }
+                for uuid, record in records.items()
+            ],
+        )
+
+
+def lookup_order(uuid):
+    conn = engine.connect()
+    s = select([archived_orders.c.data]).where(archived_orders.c.uuid == uuid)
+    row = conn.execute(s).fetchone()
+    if row is None:
+        return None
+    return _unpack(row[0])
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from sub_ln.database import archive, db, events
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    """
+    Periodically moves orders which reached a terminal state more than `retention`
+    seconds ago out of the main database and into the archive, then releases some of
+    the freed pages so the main database file stays small. Order events older than
+    `event_retention` seconds are deleted.
+    """
+
+    def __init__(
+        self,
+        retention,
+        interval=3600,
+        batch_size=500,
+        vacuum_pages=1000,
+        event_retention=7 * 24 * 60 * 60,
+    ):
+        self.retention = retention
+        self.event_retention = event_retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self._thread = None
+        self._stop = threading.Event()
+
+    def run_once(self):
+        """Archive every eligible order, one batch at a time. Returns the count."""
+        before = int(time.time()) - self.retention
+        archived = 0
+        while not self._stop.is_set():
+            uuids = db.lookup_archivable(before=before, limit=self.batch_size)
+            if not uuids:
+                break
+            # write the archive first, if we stop before the delete the next run
+            # just archives the same orders again
+            archive.add_orders(db.export_orders(uuids))
+            db.delete_orders(uuids)
+            db.incremental_vacuum(self.vacuum_pages)
+            archived += len(uuids)
+        if archived:
+            logger.info(f"Archived {archived} completed orders")
+        pruned = events.prune(int(time.time()) - self.event_retention)
+        if pruned:
+            logger.info(f"Deleted {pruned} old order events")
+        return archived
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except SQLAlchemyError as e:
+                logger.error(f"Archiving failed: {e}")
+            self._stop.wait(self.interval)
@@ -1,27 +1,80 @@
+import heapq
+import logging
+import time
+
 from sqlalchemy import (
     Column,
+    Index,
     Integer,
+    LargeBinary,
     MetaData,
     String,
     Table,
-    create_engine,
     ForeignKey,
+    inspect,
 )
-from sqlalchemy.sql import select, or_
+from sqlalchemy.sql import bindparam, case, cast, exists, func, select, tuple_
 from sqlalchemy.exc import IntegrityError
 
-# TODO: remove
-import logging
+from sub_ln.database import archive
+from sub_ln.database.storage import open_storage
+from sub_ln.database.writer import GroupCommitWriter
+from sub_ln.server.server_config import DB_PATH, DB_SHARDS
 
 logger = logging.getLogger(__name__)
-FORMAT = "[%(asctime)s - %(levelname)s] - %(message)s"
-logging.basicConfig(level=logging.DEBUG, format=FORMAT)
 
+storage = open_storage(DB_PATH, DB_SHARDS)
+# engine -> GroupCommitWriter, empty unless group commit is enabled
+_writers = {}
+metadata = MetaData()
 
-from sub_ln.server.server_config import DB_PATH
+# Order states, in the order an order normally moves through them
+STATE_CREATED = "created"
+STATE_BLOCKSAT_PLACED = "blocksat_placed"
+STATE_SWAP_QUOTED = "swap_quoted"
+STATE_SWAP_FUNDED = "swap_funded"
+STATE_FUNDING_CONFIRMED = "funding_confirmed"
+STATE_SWAP_COMPLETE = "swap_complete"
+# the swap timed out without the invoice being paid, the funds can be refunded
+STATE_SWAP_EXPIRED = "swap_expired"
+# a refund transaction has been sent, and is replaced if it doesn't confirm
+STATE_REFUNDING = "refunding"
+STATE_REFUNDED = "refunded"
+# the message was already queued by another order, see dedup_of
+STATE_DEDUPLICATED = "deduplicated"
+ORDER_STATES = (
+    STATE_CREATED,
+    STATE_BLOCKSAT_PLACED,
+    STATE_SWAP_QUOTED,
+    STATE_SWAP_FUNDED,
+    STATE_FUNDING_CONFIRMED,
+    STATE_SWAP_COMPLETE,
+    STATE_SWAP_EXPIRED,
+    STATE_REFUNDING,
+    STATE_REFUNDED,
+    STATE_DEDUPLICATED,
+)
+# orders in these states are eventually moved to the archive
+TERMINAL_STATES = (STATE_SWAP_COMPLETE, STATE_REFUNDED, STATE_DEDUPLICATED)
+# the Blocksat invoice of an order in these states has been paid
+PAID_STATES = (STATE_SWAP_COMPLETE,)
+# the outcome of the swap is known and will not change
+SWAP_RESOLVED_STATES = (
+    STATE_SWAP_COMPLETE,
+    STATE_SWAP_EXPIRED,
+    STATE_REFUNDING,
+    STATE_REFUNDED,
+)
+# the swap's funds have been claimed by the swap server or refunded. An expired swap can
+# still be claimed until it is refunded.
+SWAP_SETTLED_STATES = (STATE_SWAP_COMPLETE, STATE_REFUNDED)
+# Blocksat order statuses of a paid order waiting for, or in, transmission
+BLOCKSAT_QUEUED_STATUSES = ("paid", "transmitting")
+# Blocksat order statuses after which it will not change again
+BLOCKSAT_SENT_STATUSES = ("sent", "received")
+BLOCKSAT_FINAL_STATUSES = BLOCKSAT_SENT_STATUSES + ("cancelled", "expired")
 
-engine = create_engine(f"sqlite:///{DB_PATH}")
-metadata = MetaData()
+MAX_PAGE_SIZE = 500
 
 orders = Table(
     "orders",
@@ -31,7 +84,21 @@ orders = Table(
     Column("network", String(10)),
     Column("refund_address", String),
     Column("txid", String),
+    Column("funding_height", Integer),
+    Column("funding_block_hash", String),
+    Column("state", String(20)),
+    Column("created_at", Integer),
+    Column("updated_at", Integer),
+    # uuid of the order whose Blocksat order also carries this order's message
+    Column("dedup_of", String(32)),
+    # the mesh gateway the order was placed through, which is sent its events
+    Column("gateway", String),
 )
+# the listing query pages on (created_at, uuid) so every filter index ends with those
+Index("ix_orders_created_at", orders.c.created_at, orders.c.uuid)
+Index("ix_orders_network", orders.c.network, orders.c.created_at, orders.c.uuid)
+Index("ix_orders_state", orders.c.state, orders.c.created_at, orders.c.uuid)
+Index("ix_orders_txid", orders.c.txid)
 
 blocksat = Table(
     "blocksat",
@@ -45,10 +112,20 @@ blocksat = Table(
     Column("expires_at", Integer),
     Column("id", String),
     Column("sha256_message_digest", String),
-    Column("msatoshi", String),
+    Column("msatoshi", Integer),
     Column("payreq", String),
     Column("rhash", String),
+    # the status of the invoice when the order was placed
     Column("status", String),
+    # the status of the Blocksat order, as last checked with Blocksat
+    Column("order_status", String),
+)
+Index("ix_blocksat_blocksat_uuid", blocksat.c.blocksat_uuid)
+Index("ix_blocksat_status", blocksat.c.status)
+Index(
+    "ix_blocksat_sha256_message_digest",
+    blocksat.c.sha256_message_digest,
+    blocksat.c.created_at,
 )
 
 swaps = Table(
@@ -70,116 +147,1025 @@ swaps = Table(
     Column("swap_p2wsh_address", String),
     Column("timeout_block_height", Integer),
     Column("payment_secret", String),
+    # the swap service's transaction claiming the funding output
+    Column("claim_txid", String),
+    # our transaction spending the funding output back to the wallet after the timeout
+    Column("refund_txid", String),
+    # its fee in satoshis and the height it was sent at, for replacing it if it's stuck
+    Column("refund_fee", Integer),
+    Column("refund_sent_height", Integer),
+    # the block it confirmed in
+    Column("refund_height", Integer),
+)
+Index("ix_swaps_payment_hash", swaps.c.payment_hash)
+
+# the last block each network's confirmation tracker processed, so blocks mined while
+# the server was down are still checked. Only used in the first shard.
+chain_tips = Table(
+    "chain_tips",
+    metadata,
+    Column("network", String(10), primary_key=True),
+    Column("height", Integer),
+    Column("block_hash", String),
 )
 
 
 # This will check for the presence of each table first before creating, so it’s safe to call
 # multiple times
 def init():
+    for engine in storage.engines:
+        _init_shard(engine)
+    archive.init()
+
+
+def _init_shard(engine):
+    _enable_incremental_vacuum(engine)
     metadata.create_all(engine)
+    _add_missing_columns(engine)
+    _migrate_column_types(engine)
+    _add_missing_indexes(engine)
+    _backfill_orders(engine)
+
+
+def _enable_incremental_vacuum(engine):
+    """
+    Let the archiver hand freed pages back to the filesystem a few at a time. Switching
+    an existing database over requires a one-off full VACUUM.
+    """
+    conn = engine.connect()
+    if conn.execute("PRAGMA auto_vacuum").scalar() == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if inspect(engine).get_table_names():
+        logger.info("Enabling incremental vacuum, this may take a while")
+        conn.execute("VACUUM")
+
+
+def incremental_vacuum(pages):
+    storage.scatter(_incremental_vacuum, pages)
+
+
+def _incremental_vacuum(engine, pages):
+    # the sqlite3 module only steps a pragma statement once, freeing a single page,
+    # executescript() runs it to completion
+    conn = engine.raw_connection()
+    try:
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    finally:
+        conn.close()
+
+
+def _add_missing_columns(engine):
+    """
+    create_all() will not alter a table which already exists, so add any columns which
+    were introduced after the database was first created.
+    """
+    inspector = inspect(engine)
+    conn = engine.connect()
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(engine.dialect)
+                logger.info(f"Adding column {table.name}.{column.name}")
+                conn.execute(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                )
 
 
-def add_order(uuid, message, network):
+def _migrate_column_types(engine):
+    """
+    SQLite can't change a column's type in place, so rebuild any table which has an
+    Integer column that was created with a text type, casting the existing values.
+    """
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        changed = [
+            column.name
+            for column in table.columns
+            if isinstance(column.type, Integer)
+            and not isinstance(existing[column.name], Integer)
+        ]
+        if not changed:
+            continue
+        logger.info(f"Converting {table.name} columns {changed} to INTEGER")
+        names = ", ".join(c.name for c in table.columns)
+        values = ", ".join(
+            f"CAST({c.name} AS INTEGER)" if c.name in changed else c.name
+            for c in table.columns
+        )
+        with engine.begin() as conn:
+            conn.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+            # indexes follow the renamed table, drop them so they can be recreated
+            for index in table.indexes:
+                conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+            table.create(conn)
+            conn.execute(
+                f"INSERT INTO {table.name} ({names}) "
+                f"SELECT {values} FROM {table.name}_old"
+            )
+            conn.execute(f"DROP TABLE {table.name}_old")
+
+
+def _add_missing_indexes(engine):
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f"Creating index {index.name}")
+                index.create(engine)
+
+
+def _backfill_orders(engine):
+    """Give orders created before state tracking a state and a creation time."""
     conn = engine.connect()
-    ins = orders.insert()
+    up = (
+        orders.update()
+        .where(orders.c.state.is_(None))
+        .values(
+            created_at=0,
+            updated_at=0,
+            state=case(
+                [
+                    (orders.c.funding_height.isnot(None), STATE_FUNDING_CONFIRMED),
+                    (orders.c.txid.isnot(None), STATE_SWAP_FUNDED),
+                    (
+                        exists().where(swaps.c.uuid == orders.c.uuid),
+                        STATE_SWAP_QUOTED,
+                    ),
+                    (
+                        exists().where(blocksat.c.uuid == orders.c.uuid),
+                        STATE_BLOCKSAT_PLACED,
+                    ),
+                ],
+                else_=STATE_CREATED,
+            ),
+        )
+    )
+    conn.execute(up)
+
+
+def enable_group_commit(max_batch, max_delay):
+    """
+    Send single order writes through a GroupCommitWriter for each shard, committing
+    concurrent writes together instead of one transaction each.
+    """
+    disable_group_commit()
+    for engine in storage.engines:
+        _writers[engine] = GroupCommitWriter(engine, max_batch, max_delay)
+
+
+def disable_group_commit():
+    while _writers:
+        _, writer = _writers.popitem()
+        writer.stop()
+
+
+def group_commit_stats():
+    return [writer.stats() for writer in _writers.values()]
+
+
+def _write(uuid, func):
+    """Run func(conn) in a transaction on the order's shard, returning its result."""
+    return _write_shard(storage.engine_for(uuid), func)
+
+
+def _write_shard(engine, func):
+    """Run func(conn) in a transaction on the shard, returning its result."""
+    writer = _writers.get(engine)
+    if writer is not None:
+        return writer.write(func)
+    with engine.begin() as conn:
+        return func(conn)
+
+
+def _set_state(conn, uuid, state):
+    up = (
+        orders.update()
+        .where(orders.c.uuid == uuid)
+        .values(state=state, updated_at=int(time.time()))
+    )
+    conn.execute(up)
+
+
+def add_order(uuid, message, network, dedup_of=None, gateway=None):
+    now = int(time.time())
+    ins = orders.insert().values(
+        uuid=uuid,
+        message=message,
+        network=network,
+        state=STATE_CREATED if dedup_of is None else STATE_DEDUPLICATED,
+        created_at=now,
+        updated_at=now,
+        dedup_of=dedup_of,
+        gateway=gateway,
+    )
     try:
-        conn.execute(ins, uuid=uuid, message=message, network=network)
+        _write(uuid, lambda conn: conn.execute(ins))
     except IntegrityError as e:
         raise e
 
 
 def add_blocksat(uuid, satellite_url, result):
-    conn = engine.connect()
-    ins = blocksat.insert()
+    ins = blocksat.insert().values(
+        uuid=uuid,
+        satellite_url=satellite_url,
+        blocksat_uuid=result["uuid"],
+        auth_token=result["auth_token"],
+        created_at=result["lightning_invoice"]["created_at"],
+        description=result["lightning_invoice"]["description"],
+        expires_at=result["lightning_invoice"]["expires_at"],
+        id=result["lightning_invoice"]["id"],
+        sha256_message_digest=result["lightning_invoice"]["metadata"][
+            "sha256_message_digest"
+        ],
+        msatoshi=int(result["lightning_invoice"]["msatoshi"]),
+        payreq=result["lightning_invoice"]["payreq"],
+        rhash=result["lightning_invoice"]["rhash"],
+        status=result["lightning_invoice"]["status"],
+    )
+
+    def write(conn):
+        conn.execute(ins)
+        _set_state(conn, uuid, STATE_BLOCKSAT_PLACED)
+
     try:
-        conn.execute(
-            ins,
-            uuid=uuid,
-            satellite_url=satellite_url,
-            blocksat_uuid=result["uuid"],
-            auth_token=result["auth_token"],
-            created_at=result["lightning_invoice"]["created_at"],
-            description=result["lightning_invoice"]["description"],
-            expires_at=result["lightning_invoice"]["expires_at"],
-            id=result["lightning_invoice"]["id"],
-            sha256_message_digest=result["lightning_invoice"]["metadata"][
-                "sha256_message_digest"
-            ],
-            msatoshi=result["lightning_invoice"]["msatoshi"],
-            payreq=result["lightning_invoice"]["payreq"],
-            rhash=result["lightning_invoice"]["rhash"],
-            status=result["lightning_invoice"]["status"],
-        )
+        _write(uuid, write)
     except IntegrityError as e:
         raise e
 
 
 def add_refund_addr(uuid, refund_addr):
-    conn = engine.connect()
     up = orders.update().where(orders.c.uuid == uuid).values(refund_address=refund_addr)
     try:
-        conn.execute(up)
+        _write(uuid, lambda conn: conn.execute(up))
     except IntegrityError as e:
         raise e
 
 
 def add_swap(uuid, result):
-    conn = engine.connect()
-    ins = swaps.insert()
     # add uuid to the result
     result["uuid"] = uuid
-    try:
+    ins = swaps.insert()
+
+    def write(conn):
         # now we can pass result as a dict() as it matches table exactly
         conn.execute(ins, result)
+        _set_state(conn, uuid, STATE_SWAP_QUOTED)
+
+    try:
+        _write(uuid, write)
     except IntegrityError as e:
         raise e
 
 
 def add_txid(uuid, txid):
-    conn = engine.connect()
-    up = orders.update().where(orders.c.uuid == uuid).values(txid=txid)
+    up = (
+        orders.update()
+        .where(orders.c.uuid == uuid)
+        .values(txid=txid, state=STATE_SWAP_FUNDED, updated_at=int(time.time()))
+    )
     try:
-        conn.execute(up)
+        _write(uuid, lambda conn: conn.execute(up))
     except IntegrityError as e:
         raise e
 
 
-def check_swap(uuid, preimage):
-    conn = engine.connect()
-    up = swaps.update().where(swaps.c.uuid == uuid).values(preimage=preimage)
-    try:
+def replace_txid(uuid, old_txid, new_txid):
+    """Record that a fee bump replaced an order's funding transaction."""
+    up = (
+        orders.update()
+        .where((orders.c.uuid == uuid) & (orders.c.txid == old_txid))
+        .values(txid=new_txid, updated_at=int(time.time()))
+    )
+    _write(uuid, lambda conn: conn.execute(up))
+
+
+def add_confirmations(confirmations):
+    """
+    Record the block each funding transaction confirmed in. `confirmations` is a list of
+    dicts with keys uuid, txid, height and block_hash, written in one transaction per
+    shard. Swaps whose outcome is already known keep their state.
+    """
+    if not confirmations:
+        return
+    up = (
+        orders.update()
+        .where(orders.c.uuid == bindparam("_uuid"))
+        .values(
+            txid=bindparam("_txid"),
+            funding_height=bindparam("_height"),
+            funding_block_hash=bindparam("_block_hash"),
+            state=case(
+                [
+                    (
+                        orders.c.state.in_((STATE_SWAP_QUOTED, STATE_SWAP_FUNDED)),
+                        STATE_FUNDING_CONFIRMED,
+                    )
+                ],
+                else_=orders.c.state,
+            ),
+            updated_at=int(time.time()),
+        )
+    )
+    by_uuid = {c["uuid"]: c for c in confirmations}
+    for engine, uuids in storage.group_by_engine(by_uuid).items():
+        params = [
+            {
+                "_uuid": uuid,
+                "_txid": by_uuid[uuid]["txid"],
+                "_height": by_uuid[uuid]["height"],
+                "_block_hash": by_uuid[uuid]["block_hash"],
+            }
+            for uuid in uuids
+        ]
+        _write_shard(engine, lambda conn, params=params: conn.execute(up, params))
+
+
+def clear_confirmations(network, from_height):
+    """
+    Forget funding and refund confirmations at or above from_height, used after a chain
+    re-org. Only orders which were waiting on the funding confirmation go back to
+    swap_funded, refunded orders go back to refunding.
+    """
+    at_or_above = (orders.c.network == network) & (
+        orders.c.funding_height >= from_height
+    )
+    now = int(time.time())
+    unconfirm = (
+        orders.update()
+        .where(at_or_above & (orders.c.state == STATE_FUNDING_CONFIRMED))
+        .values(
+            funding_height=None,
+            funding_block_hash=None,
+            state=STATE_SWAP_FUNDED,
+            updated_at=now,
+        )
+    )
+    forget = (
+        orders.update()
+        .where(at_or_above)
+        .values(funding_height=None, funding_block_hash=None)
+    )
+    # refunds confirmed in the replaced blocks are waited on again
+    reorged_refunds = select([swaps.c.uuid]).where(swaps.c.refund_height >= from_height)
+    unrefund = (
+        orders.update()
+        .where(
+            (orders.c.network == network)
+            & (orders.c.state == STATE_REFUNDED)
+            & orders.c.uuid.in_(reorged_refunds)
+        )
+        .values(state=STATE_REFUNDING, updated_at=now)
+    )
+    forget_refunds = (
+        swaps.update()
+        .where(
+            (swaps.c.refund_height >= from_height)
+            & swaps.c.uuid.in_(
+                select([orders.c.uuid]).where(orders.c.network == network)
+            )
+        )
+        .values(refund_height=None)
+    )
+
+    def write(conn):
+        conn.execute(unconfirm)
+        conn.execute(forget)
+        conn.execute(unrefund)
+        conn.execute(forget_refunds)
+
+    storage.scatter(_write_shard, write)
+
+
+def check_swap(uuid, payment_secret, claim_txid):
+    """
+    Record that the swap service paid the invoice and claimed the funding output, also
+    when the swap had been marked expired. Returns False if it was already settled.
+    """
+    up = (
+        swaps.update()
+        .where(swaps.c.uuid == uuid)
+        .values(payment_secret=payment_secret, claim_txid=claim_txid)
+    )
+    state = (
+        orders.update()
+        .where(orders.c.uuid == uuid)
+        .where(orders.c.state.notin_(SWAP_SETTLED_STATES))
+        .values(state=STATE_SWAP_COMPLETE, updated_at=int(time.time()))
+    )
+
+    def write(conn):
         conn.execute(up)
-    except IntegrityError as e:
-        raise e
+        return conn.execute(state).rowcount > 0
+
+    return _write(uuid, write)
+
+
+def expire_swap(uuid):
+    """
+    Record that the swap timed out unpaid, unless its outcome is already known.
+    Returns False if it was.
+    """
+    up = (
+        orders.update()
+        .where(orders.c.uuid == uuid)
+        .where(orders.c.state.notin_(SWAP_RESOLVED_STATES))
+        .values(state=STATE_SWAP_EXPIRED, updated_at=int(time.time()))
+    )
+    return _write(uuid, lambda conn: conn.execute(up).rowcount > 0)
+
+
+def set_blocksat_status(uuid, order_status):
+    """Record the status of an order's Blocksat order, returns False if unchanged."""
+    up = (
+        blocksat.update()
+        .where(blocksat.c.uuid == uuid)
+        .where(
+            blocksat.c.order_status.is_(None)
+            | (blocksat.c.order_status != order_status)
+        )
+        .values(order_status=order_status)
+    )
+    return _write(uuid, lambda conn: conn.execute(up).rowcount > 0)
+
+
+def lookup_refundable(network, height, limit):
+    """
+    Return confirmed swap funding outputs on network which can be refunded at `height`
+    and have been neither claimed nor refunded, earliest timeout first.
+    """
+    s = (
+        select(
+            [
+                orders.c.uuid,
+                orders.c.txid,
+                orders.c.refund_address,
+                swaps.c.swap_p2sh_address,
+                swaps.c.redeem_script,
+                swaps.c.timeout_block_height,
+            ]
+        )
+        .where(
+            (orders.c.uuid == swaps.c.uuid)
+            & (orders.c.network == network)
+            & orders.c.state.in_((STATE_FUNDING_CONFIRMED, STATE_SWAP_EXPIRED))
+            & orders.c.txid.isnot(None)
+            & (swaps.c.timeout_block_height <= height)
+            & swaps.c.payment_secret.is_(None)
+            & swaps.c.refund_txid.is_(None)
+        )
+        .order_by(swaps.c.timeout_block_height)
+        .limit(limit)
+    )
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    rows = heapq.merge(*shards, key=lambda row: row["timeout_block_height"])
+    return list(rows)[:limit]
+
+
+def add_refunds(uuids, refund_txid, fee, height):
+    """
+    Record the transaction refunding each of the swaps, sent at `height` paying `fee`
+    satoshis, also when it replaces an earlier refund. The swaps are refunded once it
+    confirms, see confirm_refund(). Swaps which were claimed meanwhile are left alone.
+    """
+    now = int(time.time())
+    refundable = orders.c.state.in_(
+        (STATE_FUNDING_CONFIRMED, STATE_SWAP_EXPIRED, STATE_REFUNDING)
+    )
+    for engine, shard_uuids in storage.group_by_engine(uuids).items():
+
+        def write(conn, shard_uuids=shard_uuids):
+            conn.execute(
+                swaps.update()
+                .where(
+                    swaps.c.uuid.in_(
+                        select([orders.c.uuid]).where(
+                            orders.c.uuid.in_(shard_uuids) & refundable
+                        )
+                    )
+                )
+                .values(
+                    refund_txid=refund_txid,
+                    refund_fee=fee,
+                    refund_sent_height=height,
+                    refund_height=None,
+                )
+            )
+            conn.execute(
+                orders.update()
+                .where(orders.c.uuid.in_(shard_uuids) & refundable)
+                .values(state=STATE_REFUNDING, updated_at=now)
+            )
+
+        _write_shard(engine, write)
+
+
+def confirm_refund(uuids, refund_txid, height):
+    """
+    Record that refund_txid confirmed at `height`, refunding those of the swaps still
+    being refunded. It may be a refund which was since replaced. Returns their uuids.
+    """
+    now = int(time.time())
+    refunded = []
+    for engine, shard_uuids in storage.group_by_engine(uuids).items():
+
+        def write(conn, shard_uuids=shard_uuids):
+            found = [
+                row[0]
+                for row in conn.execute(
+                    select([orders.c.uuid]).where(
+                        orders.c.uuid.in_(shard_uuids)
+                        & (orders.c.state == STATE_REFUNDING)
+                    )
+                )
+            ]
+            if found:
+                conn.execute(
+                    swaps.update()
+                    .where(swaps.c.uuid.in_(found))
+                    .values(refund_txid=refund_txid, refund_height=height)
+                )
+                conn.execute(
+                    orders.update()
+                    .where(orders.c.uuid.in_(found))
+                    .values(state=STATE_REFUNDED, updated_at=now)
+                )
+            return found
+
+        refunded += _write_shard(engine, write)
+    return refunded
+
+
+def cancel_refund(uuid):
+    """
+    Forget the refund of a swap whose funding output was spent by something else,
+    most likely claimed by the swap server, putting it back to swap_expired.
+    """
+    up = (
+        orders.update()
+        .where((orders.c.uuid == uuid) & (orders.c.state == STATE_REFUNDING))
+        .values(state=STATE_SWAP_EXPIRED, updated_at=int(time.time()))
+    )
+    clear = (
+        swaps.update()
+        .where(swaps.c.uuid == uuid)
+        .values(refund_txid=None, refund_fee=None, refund_sent_height=None)
+    )
+
+    def write(conn):
+        if conn.execute(up).rowcount > 0:
+            conn.execute(clear)
+
+    _write(uuid, write)
+
+
+def lookup_pending_refunds(network, sent_before=None):
+    """
+    Return the swaps on network whose refund hasn't confirmed, like lookup_refundable()
+    with the refund's txid, fee and height sent. With `sent_before`, only refunds sent
+    at or before that height.
+    """
+    s = select(
+        [
+            orders.c.uuid,
+            orders.c.txid,
+            orders.c.refund_address,
+            swaps.c.swap_p2sh_address,
+            swaps.c.redeem_script,
+            swaps.c.timeout_block_height,
+            swaps.c.refund_txid,
+            swaps.c.refund_fee,
+            swaps.c.refund_sent_height,
+        ]
+    ).where(
+        (orders.c.uuid == swaps.c.uuid)
+        & (orders.c.network == network)
+        & (orders.c.state == STATE_REFUNDING)
+    )
+    if sent_before is not None:
+        s = s.where(swaps.c.refund_sent_height <= sent_before)
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    return [row for rows in shards for row in rows]
 
 
 def lookup_bump(uuid):
-    conn = engine.connect()
+    conn = storage.engine_for(uuid).connect()
     s = select(
         [blocksat.c.blocksat_uuid, blocksat.c.auth_token, blocksat.c.satellite_url]
     ).where(blocksat.c.uuid == uuid)
     return conn.execute(s).fetchone().values()
 
 
+def lookup_network(uuid):
+    conn = storage.engine_for(uuid).connect()
+    s = select([orders.c.network]).where(orders.c.uuid == uuid)
+    return conn.execute(s).scalar()
+
+
 def lookup_refund_addr(uuid):
-    conn = engine.connect()
+    conn = storage.engine_for(uuid).connect()
     s = select([orders.c.refund_address]).where(orders.c.uuid == uuid)
     return conn.execute(s).fetchone().values()
 
 
 def lookup_pay_details(uuid):
-    conn = engine.connect()
-    s = select([swaps.c.swap_amount, swaps.c.swap_p2sh_address]).where(
-        swaps.c.uuid == uuid
-    )
+    conn = storage.engine_for(uuid).connect()
+    s = select(
+        [swaps.c.swap_amount, swaps.c.swap_p2sh_address, swaps.c.timeout_block_height]
+    ).where(swaps.c.uuid == uuid)
     return conn.execute(s).fetchone().values()
 
 
-def lookup_swap_details(uuid):
-    conn = engine.connect()
-    s = select([orders.c.network, swaps.c.invoice, swaps.c.redeem_script]).where(
-        or_(swaps.c.uuid == uuid, orders.c.uuid == uuid)
+def lookup_swap_quote(uuid):
+    """The swap server's quote stored for an order as a dict, None if it has no swap."""
+    ours = (
+        "uuid",
+        "payment_secret",
+        "claim_txid",
+        "refund_txid",
+        "refund_fee",
+        "refund_sent_height",
+        "refund_height",
     )
-    result = conn.execute(s).fetchone()
-    logger.debug(result)
-    return conn.execute(s).fetchone().values()
+    conn = storage.engine_for(uuid).connect()
+    s = select([c for c in swaps.c if c.name not in ours]).where(swaps.c.uuid == uuid)
+    row = conn.execute(s).fetchone()
+    return dict(row) if row is not None else None
+
+
+def lookup_swap_check(uuid):
+    """
+    Return what is needed to check a swap, and its outcome if known, as a dict. Reads
+    through to the archive. Returns None if there is no swap for the order.
+    """
+    columns = [
+        orders.c.network,
+        orders.c.state,
+        orders.c.updated_at,
+        orders.c.txid,
+        swaps.c.invoice,
+        swaps.c.redeem_script,
+        swaps.c.timeout_block_height,
+        swaps.c.payment_secret,
+        swaps.c.claim_txid,
+        swaps.c.refund_txid,
+    ]
+    conn = storage.engine_for(uuid).connect()
+    s = select(columns).where((orders.c.uuid == uuid) & (swaps.c.uuid == uuid))
+    row = conn.execute(s).fetchone()
+    if row is not None:
+        return dict(row)
+    record = archive.lookup_order(uuid)
+    if record is None or not record["swaps"]:
+        return None
+    return {c.name: record[c.table.name].get(c.name) for c in columns}
+
+
+def lookup_duplicate(digest, satellite_url, since):
+    """
+    Find the newest Blocksat order for the same message and satellite API, placed since
+    `since`, which has been paid. Returns a dict or None.
+    """
+    s = (
+        select(
+            [
+                blocksat.c.uuid,
+                blocksat.c.blocksat_uuid,
+                blocksat.c.created_at,
+                blocksat.c.expires_at,
+                blocksat.c.id,
+                blocksat.c.msatoshi,
+                blocksat.c.sha256_message_digest,
+                blocksat.c.status,
+            ]
+        )
+        .where(
+            (blocksat.c.sha256_message_digest == digest)
+            & (blocksat.c.satellite_url == satellite_url)
+            & (blocksat.c.created_at >= since)
+            & (orders.c.uuid == blocksat.c.uuid)
+            # an original which isn't paid yet, even with its swap funded, may never
+            # be, leaving its duplicates unsent
+            & (
+                orders.c.state.in_(PAID_STATES)
+                | blocksat.c.order_status.in_(
+                    BLOCKSAT_QUEUED_STATUSES + BLOCKSAT_SENT_STATUSES
+                )
+            )
+        )
+        .order_by(blocksat.c.created_at.desc())
+        .limit(1)
+    )
+    shards = storage.scatter(lambda engine: engine.execute(s).fetchone())
+    found = [dict(row) for row in shards if row is not None]
+    return max(found, key=lambda row: row["created_at"], default=None)
+
+
+def save_chain_tip(network, height, block_hash):
+    ins = chain_tips.insert().prefix_with("OR REPLACE")
+    storage.engines[0].execute(
+        ins, {"network": network, "height": height, "block_hash": block_hash}
+    )
+
+
+def lookup_chain_tip(network):
+    """(height, block_hash) of the last block processed on network, or None."""
+    s = select([chain_tips.c.height, chain_tips.c.block_hash]).where(
+        chain_tips.c.network == network
+    )
+    row = storage.engines[0].execute(s).fetchone()
+    return tuple(row) if row is not None else None
+
+
+def lookup_unconfirmed_swaps(network):
+    s = select(
+        [
+            orders.c.uuid,
+            orders.c.txid,
+            swaps.c.swap_p2sh_address,
+            swaps.c.swap_p2sh_p2wsh_address,
+            swaps.c.swap_p2wsh_address,
+        ]
+    ).where(
+        (orders.c.uuid == swaps.c.uuid)
+        & (orders.c.network == network)
+        & (orders.c.funding_height.is_(None))
+        & orders.c.state.notin_(SWAP_RESOLVED_STATES)
+    )
+    shards = storage.scatter(lambda engine: engine.execute(s).fetchall())
+    return [row for rows in shards for row in rows]
+
+
+def lookup_unconfirmed_funding(network, max_timeout):
+    """
+    Return swaps on network whose funding transaction has been sent but not confirmed
+    and which time out at or before `max_timeout`.
+    """
+    s = select([orders.c.uuid, orders.c.txid, swaps.c.timeout_block_height]).where(
+        (orders.c.uuid == swaps.c.uuid)
+        & (orders.c.network == network)
+        & (orders.c.state == STATE_SWAP_FUNDED)
+        & orders.c.txid.isnot(None)
+        & orders.c.funding_height.is_(None)
+        & (swaps.c.timeout_block_height <= max_timeout)
+    )
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    return [row for rows in shards for row in rows]
+
+
+def lookup_gateways(uuids):
+    """Return {uuid: gateway} for those of the orders placed through a gateway."""
+    gateways = {}
+    for engine, shard_uuids in storage.group_by_engine(uuids).items():
+        s = select([orders.c.uuid, orders.c.gateway]).where(
+            orders.c.uuid.in_(shard_uuids) & orders.c.gateway.isnot(None)
+        )
+        gateways.update(engine.execute(s).fetchall())
+    return gateways
+
+
+def lookup_unresolved_swaps(after, limit):
+    """
+    Return funded swaps of orders placed through a gateway whose outcome isn't known
+    yet, as dicts like lookup_swap_check() with the uuid. Ordered by uuid, starting
+    after `after` (or the first if None).
+    """
+    s = (
+        select(
+            [
+                orders.c.uuid,
+                orders.c.network,
+                orders.c.state,
+                orders.c.updated_at,
+                orders.c.txid,
+                swaps.c.invoice,
+                swaps.c.redeem_script,
+                swaps.c.timeout_block_height,
+            ]
+        )
+        .where(
+            (orders.c.uuid == swaps.c.uuid)
+            & orders.c.state.in_((STATE_SWAP_FUNDED, STATE_FUNDING_CONFIRMED))
+            & orders.c.gateway.isnot(None)
+        )
+        .order_by(orders.c.uuid)
+        .limit(limit)
+    )
+    if after is not None:
+        s = s.where(orders.c.uuid > after)
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    rows = heapq.merge(*shards, key=lambda row: row["uuid"])
+    return list(rows)[:limit]
+
+
+def lookup_unsent_blocksat(after, limit):
+    """
+    Return the Blocksat orders of paid orders placed through a gateway which haven't
+    been transmitted, cancelled or expired yet. Ordered by uuid, starting after `after`
+    (or the first if None).
+    """
+    s = (
+        select(
+            [
+                orders.c.uuid,
+                blocksat.c.blocksat_uuid,
+                blocksat.c.auth_token,
+                blocksat.c.satellite_url,
+                blocksat.c.order_status,
+            ]
+        )
+        .where(
+            (orders.c.uuid == blocksat.c.uuid)
+            & (orders.c.state == STATE_SWAP_COMPLETE)
+            & orders.c.gateway.isnot(None)
+            & (
+                blocksat.c.order_status.is_(None)
+                | blocksat.c.order_status.notin_(BLOCKSAT_FINAL_STATUSES)
+            )
+        )
+        .order_by(orders.c.uuid)
+        .limit(limit)
+    )
+    if after is not None:
+        s = s.where(orders.c.uuid > after)
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    rows = heapq.merge(*shards, key=lambda row: row["uuid"])
+    return list(rows)[:limit]
+
+
+def lookup_fee_samples(network, limit):
+    """
+    Return the most recent Blocksat bids as (msatoshi, message bytes) and swap quotes as
+    (fee_tokens_per_vbyte, swap_fee, swap_amount) for network, newest first.
+    """
+    bids = (
+        select(
+            [
+                orders.c.created_at,
+                blocksat.c.msatoshi,
+                func.length(cast(orders.c.message, LargeBinary)),
+            ]
+        )
+        .where((orders.c.uuid == blocksat.c.uuid) & (orders.c.network == network))
+        .order_by(orders.c.created_at.desc())
+        .limit(limit)
+    )
+    quotes = (
+        select(
+            [
+                orders.c.created_at,
+                swaps.c.fee_tokens_per_vbyte,
+                swaps.c.swap_fee,
+                swaps.c.swap_amount,
+            ]
+        )
+        .where((orders.c.uuid == swaps.c.uuid) & (orders.c.network == network))
+        .order_by(orders.c.created_at.desc())
+        .limit(limit)
+    )
+
+    def newest(shards):
+        rows = heapq.merge(*shards, key=lambda row: row[0], reverse=True)
+        return [tuple(row[1:]) for row in rows][:limit]
+
+    shards = storage.scatter(
+        lambda engine: (
+            engine.execute(bids).fetchall(),
+            engine.execute(quotes).fetchall(),
+        )
+    )
+    return (
+        newest([shard[0] for shard in shards]),
+        newest([shard[1] for shard in shards]),
+    )
+
+
+def list_orders(
+    network=None,
+    state=None,
+    since=None,
+    until=None,
+    txid=None,
+    payment_hash=None,
+    after=None,
+    limit=50,
+):
+    """
+    Return a page of orders, newest first, and the cursor for the next page (or None).
+
+    Pagination is keyset based: `after` is the cursor returned with the previous page,
+    so fetching any page costs the same however deep into the table it is. Each shard
+    returns its own first page and these are merged.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    s = select(
+        [
+            orders.c.uuid,
+            orders.c.network,
+            orders.c.state,
+            orders.c.created_at,
+            orders.c.updated_at,
+            orders.c.txid,
+            orders.c.funding_height,
+            orders.c.refund_address,
+            blocksat.c.blocksat_uuid,
+            blocksat.c.msatoshi,
+            blocksat.c.status.label("blocksat_status"),
+            swaps.c.payment_hash,
+            swaps.c.swap_amount,
+        ]
+    ).select_from(
+        orders.outerjoin(blocksat, blocksat.c.uuid == orders.c.uuid).outerjoin(
+            swaps, swaps.c.uuid == orders.c.uuid
+        )
+    )
+    if network is not None:
+        s = s.where(orders.c.network == network)
+    if state is not None:
+        s = s.where(orders.c.state == state)
+    if since is not None:
+        s = s.where(orders.c.created_at >= since)
+    if until is not None:
+        s = s.where(orders.c.created_at < until)
+    if txid is not None:
+        s = s.where(orders.c.txid == txid)
+    if payment_hash is not None:
+        s = s.where(swaps.c.payment_hash == payment_hash)
+    if after is not None:
+        created_at, uuid = parse_cursor(after)
+        s = s.where(
+            tuple_(orders.c.created_at, orders.c.uuid) < tuple_(created_at, uuid)
+        )
+    s = s.order_by(orders.c.created_at.desc(), orders.c.uuid.desc()).limit(limit + 1)
+    shards = storage.scatter(lambda engine: [dict(row) for row in engine.execute(s)])
+    rows = list(
+        heapq.merge(
+            *shards, key=lambda row: (row["created_at"], row["uuid"]), reverse=True
+        )
+    )[: limit + 1]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = make_cursor(rows[-1]["created_at"], rows[-1]["uuid"])
+    return rows, next_cursor
+
+
+def make_cursor(created_at, uuid):
+    return f"{created_at}:{uuid}"
+
+
+def parse_cursor(cursor):
+    try:
+        created_at, uuid = cursor.split(":", 1)
+        return int(created_at), uuid
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def lookup_archivable(before, limit):
+    s = (
+        select([orders.c.uuid])
+        .where(orders.c.state.in_(TERMINAL_STATES))
+        .where(orders.c.updated_at < before)
+        .limit(limit)
+    )
+    shards = storage.scatter(lambda engine: [row[0] for row in engine.execute(s)])
+    return [uuid for uuids in shards for uuid in uuids][:limit]
+
+
+def export_orders(uuids):
+    """
+    Return {uuid: {"orders": row, "blocksat": row, "swaps": row}} for the given orders,
+    with a table's entry None if the order has no row there.
+    """
+    records = {
+        uuid: {"orders": None, "blocksat": None, "swaps": None} for uuid in uuids
+    }
+    for engine, shard_uuids in storage.group_by_engine(uuids).items():
+        conn = engine.connect()
+        for table in (orders, blocksat, swaps):
+            s = select([table]).where(table.c.uuid.in_(shard_uuids))
+            for row in conn.execute(s):
+                records[row["uuid"]][table.name] = dict(row)
+    return records
+
+
+def delete_orders(uuids):
+    for engine, shard_uuids in storage.group_by_engine(uuids).items():
+        with engine.begin() as conn:
+            for table in (swaps, blocksat, orders):
+                conn.execute(table.delete().where(table.c.uuid.in_(shard_uuids)))
+
+
+def lookup_order(uuid):
+    """
+    Return the full record for an order, see export_orders(), reading through to the
+    archive if it's no longer in the main database. Returns None if not found.
+    """
+    record = export_orders([uuid])[uuid]
+    if record["orders"] is not None:
+        return record
+    return archive.lookup_order(uuid)
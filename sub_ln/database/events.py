@@ -0,0 +1,195 @@
+"""Log of order progress events, for the mesh gateways the orders were placed through.
+
+Events are kept in their own SQLite file with an increasing id, which a gateway passes
+back to resume its stream after a disconnect. The newest `EVENTS_BUFFER_SIZE` events
+are also kept in memory: publishing an event appends it there and wakes every waiting
+subscriber at once, so the database is only read by subscribers catching up on events
+which have already dropped out of the buffer.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import func, select
+
+from sub_ln.database import db
+from sub_ln.server.server_config import EVENTS_BUFFER_SIZE, EVENTS_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# events read from the database at a time when catching up
+CATCH_UP_PAGE = 500
+
+engine = create_engine(f"sqlite:///{EVENTS_DB_PATH}")
+metadata = MetaData()
+
+events = Table(
+    "events",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("gateway", String),
+    Column("uuid", String(32)),
+    Column("type", String(30)),
+    Column("data", String),
+    Column("created_at", Integer),
+    # never reuse ids, even once every event has been pruned
+    sqlite_autoincrement=True,
+)
+Index("ix_events_gateway", events.c.gateway, events.c.id)
+Index("ix_events_created_at", events.c.created_at)
+
+_cond = threading.Condition()
+_recent = deque(maxlen=EVENTS_BUFFER_SIZE)
+# every event up to _floor is in the database but not in _recent
+_floor = 0
+_last_id = 0
+_published = 0
+_subscribers = 0
+
+
+def init():
+    global _floor, _last_id
+    metadata.create_all(engine)
+    last_id = engine.execute(select([func.max(events.c.id)])).scalar() or 0
+    with _cond:
+        _last_id = max(_last_id, last_id)
+        _floor = max(_floor, last_id)
+
+
+def publish(uuid, event_type, **data):
+    publish_many([(uuid, event_type, data)])
+
+
+def publish_many(items):
+    """
+    Log an event for each (uuid, type, data) in items whose order was placed through a
+    gateway. Failures are logged rather than raised, the change an event describes has
+    already been made.
+    """
+    global _floor, _last_id, _published
+    if not items:
+        return
+    now = int(time.time())
+    try:
+        gateways = db.lookup_gateways({uuid for uuid, _, _ in items})
+        rows = [
+            {
+                "gateway": gateways[uuid],
+                "uuid": uuid,
+                "type": event_type,
+                "data": data,
+                "created_at": now,
+            }
+            for uuid, event_type, data in items
+            if uuid in gateways
+        ]
+        if not rows:
+            return
+        # ids are handed out under the lock, so the buffer stays in id order
+        with _cond:
+            with engine.begin() as conn:
+                for row in rows:
+                    result = conn.execute(
+                        events.insert(), dict(row, data=json.dumps(row["data"]))
+                    )
+                    row["id"] = result.inserted_primary_key[0]
+            for row in rows:
+                if len(_recent) == _recent.maxlen:
+                    _floor = _recent[0]["id"]
+                _recent.append(row)
+            _last_id = rows[-1]["id"]
+            _published += len(rows)
+            _cond.notify_all()
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to log {[item[1] for item in items]} events: {e}")
+
+
+def lookup_events(gateway, after, limit):
+    """Return up to `limit` of the gateway's events with ids above `after`."""
+    s = (
+        select([events])
+        .where((events.c.gateway == gateway) & (events.c.id > after))
+        .order_by(events.c.id)
+        .limit(limit)
+    )
+    return [dict(row, data=json.loads(row["data"])) for row in engine.execute(s)]
+
+
+def subscribe(gateway, after=None, keepalive=15):
+    """
+    Yield the gateway's events with ids above `after`, then each new one as it is
+    published. Without `after` only new events are yielded. Yields None whenever
+    `keepalive` seconds pass without an event, so the caller can check the subscriber
+    is still there.
+    """
+    global _subscribers
+    with _cond:
+        # a cursor from before the log was reset
+        if after is None or after > _last_id:
+            after = _last_id
+        _subscribers += 1
+    try:
+        idle_since = time.monotonic()
+        while True:
+            while after < _floor:
+                floor = _floor
+                page = lookup_events(gateway, after, CATCH_UP_PAGE)
+                for event in page:
+                    after = event["id"]
+                    yield event
+                if len(page) < CATCH_UP_PAGE:
+                    after = max(after, floor)
+                idle_since = time.monotonic()
+            with _cond:
+                if _last_id <= after:
+                    _cond.wait(max(0, keepalive - (time.monotonic() - idle_since)))
+                if after < _floor:
+                    # fell behind the buffer
+                    continue
+                new = []
+                for event in reversed(_recent):
+                    if event["id"] <= after:
+                        break
+                    new.append(event)
+            if new:
+                after = new[0]["id"]
+            mine = [event for event in reversed(new) if event["gateway"] == gateway]
+            for event in mine:
+                yield event
+            if mine:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= keepalive:
+                yield None
+                idle_since = time.monotonic()
+    finally:
+        with _cond:
+            _subscribers -= 1
+
+
+def last_id():
+    with _cond:
+        return _last_id
+
+
+def prune(before):
+    """Delete events logged before the unix time `before`, returns how many."""
+    with engine.begin() as conn:
+        return conn.execute(
+            events.delete().where(events.c.created_at < before)
+        ).rowcount
+
+
+def stats():
+    with _cond:
+        return {
+            "subscribers": _subscribers,
+            "published": _published,
+            "last_id": _last_id,
+            "buffered": len(_recent),
+        }
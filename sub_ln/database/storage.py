@@ -0,0 +1,72 @@
+"""Where the order tables live.
+
+Every order's rows (orders, blocksat and swaps) are always stored together in one
+SQLite file, chosen from the order uuid. With a single shard this is just DB_PATH. With
+several shards each file has its own engine and its own write lock, so writers for
+different orders don't queue behind each other. Queries which aren't for a single
+order are run against every shard in parallel and the results combined by the caller.
+"""
+
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+
+
+class SQLiteStorage:
+    """All orders in a single SQLite file."""
+
+    def __init__(self, path):
+        self.paths = [path]
+        self.engines = [create_engine(f"sqlite:///{path}")]
+        self._executor = None
+
+    def engine_for(self, uuid):
+        return self.engines[0]
+
+    def group_by_engine(self, uuids):
+        """Split uuids into {engine: [uuid, ...]} by the shard that holds them."""
+        groups = {}
+        for uuid in uuids:
+            groups.setdefault(self.engine_for(uuid), []).append(uuid)
+        return groups
+
+    def scatter(self, func, *args, **kwargs):
+        """Call func(engine, *args, **kwargs) for every shard, returning the results."""
+        if len(self.engines) == 1:
+            return [func(self.engines[0], *args, **kwargs)]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self.engines), thread_name_prefix="db-scatter"
+            )
+        futures = [
+            self._executor.submit(func, engine, *args, **kwargs)
+            for engine in self.engines
+        ]
+        return [future.result() for future in futures]
+
+
+class ShardedSQLiteStorage(SQLiteStorage):
+    """
+    Orders spread over `shards` SQLite files by a hash of their uuid. The files are
+    named after `path` with the shard number added, e.g. database.0.db.
+
+    The shard count must not be changed once orders have been written.
+    """
+
+    def __init__(self, path, shards):
+        root, ext = os.path.splitext(path)
+        self.paths = [f"{root}.{i}{ext}" for i in range(shards)]
+        self.engines = [create_engine(f"sqlite:///{p}") for p in self.paths]
+        self._executor = None
+
+    def engine_for(self, uuid):
+        # crc32 is stable across processes, unlike hash()
+        return self.engines[zlib.crc32(uuid.encode("utf8")) % len(self.engines)]
+
+
+def open_storage(path, shards=1):
+    if shards > 1:
+        return ShardedSQLiteStorage(path, shards)
+    return SQLiteStorage(path)
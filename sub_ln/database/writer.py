@@ -0,0 +1,106 @@
+"""Group commit for writes to a single SQLite file.
+
+Committing a transaction waits for the file to be synced to disk, and SQLite only lets
+one transaction write at a time, so under concurrent load most of the time is spent
+queuing for fsync. A GroupCommitWriter runs every write for its file on one thread:
+writes arriving while a batch is being committed are queued and committed together in
+the next transaction, up to `max_batch` writes or `max_delay` seconds after the first.
+write() returns only once the transaction holding that write has committed.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    __slots__ = ("func", "done", "error", "result")
+
+    def __init__(self, func):
+        self.func = func
+        self.done = threading.Event()
+        self.error = None
+        self.result = None
+
+
+class GroupCommitWriter:
+    def __init__(self, engine, max_batch=64, max_delay=0.002):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self.retried = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="db-group-commit", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, func):
+        """
+        Call func(conn) inside the next batch's transaction and wait for it to commit,
+        returning what func returned. Exceptions raised by func are raised here.
+        """
+        item = _Write(func)
+        self._queue.put(item)
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "retried": self.retried,
+            "mean_batch": self.writes / self.batches if self.batches else None,
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            try:
+                with self.engine.begin() as conn:
+                    for item in batch:
+                        item.result = item.func(conn)
+            except Exception:
+                # the whole transaction was rolled back, commit each write on its own so
+                # only the caller whose write failed sees an error
+                self.retried += len(batch)
+                for item in batch:
+                    try:
+                        with self.engine.begin() as conn:
+                            item.result = item.func(conn)
+                    except Exception as e:
+                        item.error = e
+            self.batches += 1
+            self.writes += len(batch)
+        finally:
+            for item in batch:
+                item.done.set()
@@ -1,6 +1,13 @@
+import logging
+import threading
+
 from flask import Flask
 from flask_restful import Api
 
+from sub_ln.api import admission, compression, profiler, upstream
+from sub_ln.api.dedup import Deduplicator
+from sub_ln.api.prefetch import Prefetcher
+from sub_ln.api.watcher import OrderWatcher
 from sub_ln.api.api import (
     BlocksatBump,
     SwapCheckRefundAddress,
@@ -11,29 +18,173 @@ from sub_ln.api.api import (
     GetRefundAddress,
     SwapLookupInvoice,
     Rand64ByteMsg,
+    ListOrders,
+    OrderEstimate,
+    LookupOrder,
+    RPCStats,
+    AdmissionStats,
+    UpstreamStats,
+    DedupStats,
+    CoinPoolStats,
+    EventStats,
+    OrderEvents,
+    PrefetchStats,
+    ProfileStats,
+    Ready,
+)
+from sub_ln.database import db, events
+from sub_ln.database.archiver import Archiver
+from sub_ln.server.server_config import (
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_RATES,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_RETENTION_DAYS,
+    ARCHIVE_VACUUM_PAGES,
+    COMPRESS_LEVEL,
+    COMPRESS_MIN_SIZE,
+    DB_GROUP_COMMIT,
+    DB_GROUP_COMMIT_MAX_BATCH,
+    DB_GROUP_COMMIT_MAX_DELAY,
+    DEBUG,
+    DEDUP_WINDOW,
+    EVENTS_POLL_BATCH,
+    EVENTS_POLL_INTERVAL,
+    EVENTS_POLL_MAX_RATE,
+    EVENTS_RETENTION_DAYS,
+    FEE_BUMPS_ENABLED,
+    PREFETCH_ADDRESS_TYPE,
+    PREFETCH_TTL,
+    PREFETCH_WAIT,
+    PREFETCH_WORKERS,
+    PROFILE_HEADER,
+    PROFILE_INTERVAL,
+    PROFILE_SAMPLE_RATE,
+    REFUNDS_ENABLED,
+    USE_RELOADER,
 )
-from sub_ln.database import db
-
-
-# setup the Flask app
-app = Flask(__name__)
-app.config["DEBUG"] = True
-api = Api(app)
-
-# add the API endpoints
-api.add_resource(Rand64ByteMsg, "/api/v1/util/random_message")
-api.add_resource(SwapLookupInvoice, "/api/v1/swap/lookup_invoice")
-api.add_resource(SwapCheckRefundAddress, "/api/v1/swap/check_refund_addr")
-api.add_resource(CreateOrder, "/api/v1/order/create")
-api.add_resource(BlocksatBump, "/api/v1/blocksat/bump")
-api.add_resource(GetRefundAddress, "/api/v1/bitcoin/new_address")
-api.add_resource(SwapQuote, "/api/v1/swap/quote")
-api.add_resource(SwapPay, "/api/v1/swap/pay")
-api.add_resource(SwapCheck, "/api/v1/swap/check")
-
-# initialise the db, this will check for presence of tables before creating, so safe
-# to call multiple times
-db.init()
-
-# start the API server
-app.run()
+
+logger = logging.getLogger(__name__)
+FORMAT = "[%(asctime)s - %(levelname)s] - %(message)s"
+
+
+def create_app(start_background=True):
+    """
+    Build the Flask app.
+
+    Upstream clients are constructed lazily, so this returns quickly. With
+    start_background they are warmed up in a separate thread, which then starts the
+    RPC health checks, confirmation trackers and archiver. /api/v1/ready reports when
+    that has finished.
+    """
+    app = Flask(__name__)
+    app.config["DEBUG"] = DEBUG
+    api = Api(app)
+
+    # per-client rate limits and fair queuing in front of every endpoint
+    controller = admission.AdmissionController(
+        ADMISSION_RATES,
+        max_concurrent=ADMISSION_MAX_CONCURRENT,
+        queue_size=ADMISSION_QUEUE_SIZE,
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    )
+    app.extensions["admission"] = controller
+    admission.install(app, controller)
+    app.extensions["dedup"] = Deduplicator(DEDUP_WINDOW)
+    app.extensions["prefetch"] = Prefetcher(
+        ttl=PREFETCH_TTL,
+        wait=PREFETCH_WAIT,
+        address_type=PREFETCH_ADDRESS_TYPE,
+        max_workers=PREFETCH_WORKERS,
+    )
+
+    # opt-in sampling profiler, see /api/v1/stats/profile
+    request_profiler = profiler.RequestProfiler(
+        sample_rate=PROFILE_SAMPLE_RATE,
+        interval=PROFILE_INTERVAL,
+        header=PROFILE_HEADER,
+    )
+    app.extensions["profiler"] = request_profiler
+    profiler.install(app, request_profiler)
+    compression.install(app, min_size=COMPRESS_MIN_SIZE, level=COMPRESS_LEVEL)
+
+    # add the API endpoints
+    api.add_resource(Rand64ByteMsg, "/api/v1/util/random_message")
+    api.add_resource(SwapLookupInvoice, "/api/v1/swap/lookup_invoice")
+    api.add_resource(SwapCheckRefundAddress, "/api/v1/swap/check_refund_addr")
+    api.add_resource(CreateOrder, "/api/v1/order/create")
+    api.add_resource(OrderEstimate, "/api/v1/order/estimate")
+    api.add_resource(ListOrders, "/api/v1/order/list")
+    api.add_resource(LookupOrder, "/api/v1/order/lookup")
+    api.add_resource(BlocksatBump, "/api/v1/blocksat/bump")
+    api.add_resource(GetRefundAddress, "/api/v1/bitcoin/new_address")
+    api.add_resource(SwapQuote, "/api/v1/swap/quote")
+    api.add_resource(SwapPay, "/api/v1/swap/pay")
+    api.add_resource(SwapCheck, "/api/v1/swap/check")
+    api.add_resource(OrderEvents, "/api/v1/events")
+    api.add_resource(RPCStats, "/api/v1/stats/rpc")
+    api.add_resource(AdmissionStats, "/api/v1/stats/admission")
+    api.add_resource(UpstreamStats, "/api/v1/stats/upstreams")
+    api.add_resource(DedupStats, "/api/v1/stats/dedup")
+    api.add_resource(CoinPoolStats, "/api/v1/stats/coin_pool")
+    api.add_resource(EventStats, "/api/v1/stats/events")
+    api.add_resource(PrefetchStats, "/api/v1/stats/prefetch")
+    api.add_resource(ProfileStats, "/api/v1/stats/profile")
+    api.add_resource(Ready, "/api/v1/ready")
+
+    # initialise the db, this will check for presence of tables before creating, so safe
+    # to call multiple times
+    db.init()
+    events.init()
+    if DB_GROUP_COMMIT:
+        db.enable_group_commit(DB_GROUP_COMMIT_MAX_BATCH, DB_GROUP_COMMIT_MAX_DELAY)
+
+    if start_background:
+        threading.Thread(target=_start_background, name="warm-up", daemon=True).start()
+    return app
+
+
+def _start_background():
+    upstream.warm_up()
+
+    # health check the bitcoind backends and follow new blocks on each network to
+    # record swap funding confirmations
+    for pool in upstream.rpc_pools().values():
+        pool.start()
+    for network, tracker in upstream.confirmation_trackers().items():
+        # refund timed out swaps as each block arrives
+        if REFUNDS_ENABLED:
+            tracker.add_listener(upstream.refund_engines()[network].on_block)
+        # bump the fees of funding transactions at risk of missing their deadline
+        if FEE_BUMPS_ENABLED:
+            tracker.add_listener(upstream.fee_bumpers()[network].on_block)
+        tracker.start()
+    # keep coins ready for funding swaps
+    for pool in upstream.coin_pools().values():
+        pool.start()
+    # keep the inputs for order cost estimates up to date
+    upstream.fee_model().start()
+    # follow swaps and Blocksat orders for the gateways' event streams
+    OrderWatcher(
+        interval=EVENTS_POLL_INTERVAL,
+        batch=EVENTS_POLL_BATCH,
+        max_rate=EVENTS_POLL_MAX_RATE,
+    ).start()
+
+    # move completed orders out of the main database once they are old enough
+    Archiver(
+        retention=ARCHIVE_RETENTION_DAYS * 24 * 60 * 60,
+        interval=ARCHIVE_INTERVAL,
+        batch_size=ARCHIVE_BATCH_SIZE,
+        vacuum_pages=ARCHIVE_VACUUM_PAGES,
+        event_retention=EVENTS_RETENTION_DAYS * 24 * 60 * 60,
+    ).start()
+    logger.info("Background services started")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO, format=FORMAT)
+    # start the API server
+    create_app().run(debug=DEBUG, use_reloader=USE_RELOADER)
@@ -1,12 +1,156 @@
 # General
 SATOSHIS = 100_000_000
 
+# Server
+DEBUG = False
+# The reloader runs the server in a second process, doubling memory use
+USE_RELOADER = False
+# Fraction of requests to profile, 0 disables sampling. Requests sent with the
+# PROFILE_HEADER header are always profiled. Stacks are sampled every PROFILE_INTERVAL
+# seconds while a profiled request runs, see /api/v1/stats/profile.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_INTERVAL = 0.005
+PROFILE_HEADER = "X-Debug-Profile"
+# Responses of at least COMPRESS_MIN_SIZE bytes are gzipped for clients which accept it
+COMPRESS_MIN_SIZE = 200
+COMPRESS_LEVEL = 6
+# swap/check requests with "wait" are held for up to SWAP_CHECK_MAX_WAIT seconds until
+# the order changes in the database, which is checked every SWAP_CHECK_POLL_INTERVAL
+# seconds. The swap server is asked once per request.
+SWAP_CHECK_MAX_WAIT = 30
+SWAP_CHECK_POLL_INTERVAL = 2
+
+# Admission control, clients are identified by their address, or by their gateway and
+# X-Client-Id header for requests from a gateway with its token, see
+# EVENTS_GATEWAY_TOKENS.
+# Requests per second and burst size allowed for each client, by endpoint class
+ADMISSION_RATES = {
+    "order": (0.2, 5),
+    "swap": (1, 10),
+    "read": (5, 20),
+}
+# Requests handled at once, further requests wait in a queue served round-robin across
+# clients. Requests arriving to a full queue, or waiting longer than
+# ADMISSION_QUEUE_TIMEOUT seconds, get a 429 response.
+ADMISSION_MAX_CONCURRENT = 16
+ADMISSION_QUEUE_SIZE = 64
+ADMISSION_QUEUE_TIMEOUT = 5.0
+
+# Calls to the swap service and Blocksat. Calls taking longer than `timeout` seconds
+# get a 503 response. After `failure_threshold` consecutive failures the upstream is
+# not called for `reset_timeout` seconds. With `hedge_after` set, idempotent lookups
+# still running after that many seconds are sent a second time and the first reply
+# used. `max_workers` limits the concurrent calls to each upstream.
+UPSTREAM_POLICIES = {
+    "blocksat": {
+        "timeout": 10,
+        "failure_threshold": 5,
+        "reset_timeout": 30,
+        "hedge_after": None,
+        "max_workers": 16,
+    },
+    "submarine": {
+        "timeout": 10,
+        "failure_threshold": 5,
+        "reset_timeout": 30,
+        "hedge_after": 1.0,
+        "max_workers": 16,
+    },
+}
+# Keep-alive HTTP connections to each upstream. Connections are kept for up to
+# pool_connections hosts, with at most pool_maxsize idle connections to each.
+UPSTREAM_HTTP_POOLS = {
+    "blocksat": {"pool_connections": 4, "pool_maxsize": 16},
+    "submarine": {"pool_connections": 4, "pool_maxsize": 16},
+}
+
 # Bitcoin
 NETWORK = "testnet"
 RPC_HOST = "127.0.0.1"
 RPC_PORT = "18332"
 RPC_USER = "user"
 RPC_PASSWORD = "password"
+# bitcoind RPC endpoints for each network. Read-only calls are balanced across every
+# healthy backend, wallet calls always go to the one backend marked "wallet".
+RPC_BACKENDS = {
+    "testnet": [
+        {
+            "url": f"http://{RPC_USER}:{RPC_PASSWORD}@{RPC_HOST}:{RPC_PORT}",
+            "wallet": True,
+        },
+    ],
+    "mainnet": [],
+}
+# Maximum concurrent connections to each backend
+RPC_POOL_SIZE = 4
+# Seconds between backend health checks
+RPC_HEALTH_INTERVAL = 15
+# Backends slower than this (seconds) or more than RPC_MAX_LAG blocks behind the best
+# tip are taken out of rotation until they recover
+RPC_MAX_LATENCY = 2.0
+RPC_MAX_LAG = 2
+# Seconds between checks for new blocks when tracking swap funding confirmations
+CONFIRMATION_POLL_INTERVAL = 30
+# Swap funding transactions must confirm FUNDING_DEADLINE_MARGIN blocks before the swap
+# times out, leaving the swap server time to pay and claim. They're sent with a
+# confirmation target of the blocks left until then, at most FUNDING_MAX_CONF_TARGET,
+# and signal replace-by-fee. Once within FEE_BUMP_WITHIN blocks of that deadline,
+# unconfirmed funding transactions paying less than the current estimate are bumped.
+FUNDING_DEADLINE_MARGIN = 6
+FUNDING_MAX_CONF_TARGET = 6
+FEE_BUMPS_ENABLED = True
+FEE_BUMP_WITHIN = 6
+# Fund swaps from a pool of pre-split coins rather than with sendtoaddress, so concurrent
+# payments don't queue for the wallet's coin selection or spend unconfirmed change. The
+# pool is kept at COIN_POOL_SIZE coins of COIN_POOL_COIN_VALUE satoshis on addresses
+# labelled COIN_POOL_LABEL, splitting up to COIN_POOL_MAX_SPLIT new coins at a time from
+# the wallet's other funds. Swaps larger than a pool coin, or arriving while the pool is
+# empty, are paid with sendtoaddress as before.
+COIN_POOL_ENABLED = False
+COIN_POOL_LABEL = "swap-pool"
+COIN_POOL_SIZE = 20
+COIN_POOL_COIN_VALUE = 100_000
+COIN_POOL_MIN_CONFIRMATIONS = 1
+COIN_POOL_MAX_SPLIT = 50
+# Seconds between checks of the pool
+COIN_POOL_INTERVAL = 60
+# Refund swaps which time out unpaid. After each block all refundable swaps on a network
+# are spent back to the wallet in one transaction of up to REFUND_MAX_INPUTS inputs,
+# paying estimatesmartfee(REFUND_CONF_TARGET) but at least REFUND_MIN_FEE_RATE sat/vB.
+# A refund still unconfirmed REFUND_REPLACE_AFTER blocks later is replaced at a higher
+# fee, 0 never replaces them. Needs a legacy wallet, the refund keys are read with
+# dumpprivkey.
+REFUNDS_ENABLED = True
+REFUND_CONF_TARGET = 6
+REFUND_MIN_FEE_RATE = 1
+REFUND_MAX_INPUTS = 200
+REFUND_REPLACE_AFTER = 6
+
+# A new order for the same message as an order placed in the last DEDUP_WINDOW seconds,
+# whose Blocksat invoice has been paid, is linked to that order rather than sent again.
+# 0 disables this.
+DEDUP_WINDOW = 24 * 60 * 60
+
+# After an order is created, its swap invoice lookup, a refund address of type
+# PREFETCH_ADDRESS_TYPE and a swap quote are fetched in the background, ready for the
+# client's next requests. Results not used within PREFETCH_TTL seconds are discarded, 0
+# disables this. Requests wait up to PREFETCH_WAIT seconds for a prefetch still running.
+PREFETCH_TTL = 300
+PREFETCH_WAIT = 10
+PREFETCH_ADDRESS_TYPE = "legacy"
+PREFETCH_WORKERS = 4
+
+# Order cost estimates. Inputs are refreshed every ESTIMATE_INTERVAL seconds from the
+# last ESTIMATE_SAMPLES orders on each network and estimatesmartfee(ESTIMATE_CONF_TARGET).
+ESTIMATE_INTERVAL = 60
+ESTIMATE_CONF_TARGET = 6
+ESTIMATE_SAMPLES = 100
+# Size of the transaction funding a swap, one input and two outputs
+ESTIMATE_FUNDING_VBYTES = 141
+# Used until there are orders or a fee estimate to base the estimate on
+ESTIMATE_DEFAULT_MSAT_PER_BYTE = 50
+ESTIMATE_DEFAULT_SWAP_FEE_RATE = 0.01
+ESTIMATE_DEFAULT_SAT_PER_VBYTE = 1
 
 # Database
 # Database path is relative to the CWD the server is run from
@@ -14,3 +158,43 @@ RPC_PASSWORD = "password"
 # exist will raise an `sqlalchemy.exc.OperationalError: (sqlite3.OperationalError)
 # unable to open database file`
 DB_PATH = "database/database.db"
+# Number of SQLite files orders are spread across by a hash of their uuid. With more
+# than one shard the files are named database.0.db, database.1.db etc. Must not be
+# changed once orders have been written.
+DB_SHARDS = 1
+# Commit concurrent order writes together, up to DB_GROUP_COMMIT_MAX_BATCH writes or
+# DB_GROUP_COMMIT_MAX_DELAY seconds after the first, rather than one transaction each.
+# Each request still waits for its own write to be committed.
+DB_GROUP_COMMIT = False
+DB_GROUP_COMMIT_MAX_BATCH = 64
+DB_GROUP_COMMIT_MAX_DELAY = 0.002
+
+# Completed orders are moved from DB_PATH to ARCHIVE_DB_PATH after the retention period
+ARCHIVE_DB_PATH = "database/archive.db"
+ARCHIVE_RETENTION_DAYS = 30
+# Seconds between archive runs
+ARCHIVE_INTERVAL = 3600
+ARCHIVE_BATCH_SIZE = 500
+# Maximum number of free pages returned to the filesystem after each archive batch
+ARCHIVE_VACUUM_PAGES = 1000
+
+# Progress events for orders placed through a mesh gateway are streamed to it from
+# /api/v1/events. A gateway sends its id in the X-Gateway-Id header and its token from
+# EVENTS_GATEWAY_TOKENS, {gateway id: token}, as "Authorization: Bearer <token>". Orders
+# are only linked to, and events only streamed to, gateways with the right token. Events
+# are kept in EVENTS_DB_PATH for EVENTS_RETENTION_DAYS so a gateway can resume where it
+# left off, and the newest EVENTS_BUFFER_SIZE are also kept in memory for subscribers
+# which are up to date. Idle streams are sent a comment every EVENTS_KEEPALIVE seconds.
+EVENTS_GATEWAY_TOKENS = {}
+EVENTS_DB_PATH = "database/events.db"
+EVENTS_RETENTION_DAYS = 7
+EVENTS_BUFFER_SIZE = 10_000
+EVENTS_KEEPALIVE = 15
+# Every EVENTS_POLL_INTERVAL seconds the swap server is asked about up to
+# EVENTS_POLL_BATCH funded swaps of gateway orders, and Blocksat about as many paid
+# orders, so gateways hear about paid invoices and transmitted messages without polling
+# swap/check. The calls are spread out to at most EVENTS_POLL_MAX_RATE a second, as they
+# share the upstreams' circuit breakers with client requests.
+EVENTS_POLL_INTERVAL = 15
+EVENTS_POLL_BATCH = 100
+EVENTS_POLL_MAX_RATE = 2
@@ -4,8 +4,6 @@ import time
 import functools
 
 logger = logging.getLogger(__name__)
-FORMAT = "[%(asctime)s - %(levelname)s] - %(message)s"
-logging.basicConfig(level=logging.DEBUG, format=FORMAT)
 
 
 def create_random_message():
@@ -0,0 +1,161 @@
+import collections
+import types
+
+import pytest
+from sqlalchemy import create_engine
+
+from sub_ln.api import upstream
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.bitcoin.transaction import push
+from sub_ln.database import archive, db, events
+from sub_ln.database.storage import open_storage
+
+
+class _Method:
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+    def stream(self, *args, path=None):
+        return iter(self.func(*args)[path] if path else self.func(*args))
+
+
+class FakeRPC:
+    """
+    Stands in for an RPCPool. Set `rpc.<method> = func` to answer a call, every call is
+    recorded in `calls` and methods which weren't set raise "Method not found".
+    """
+
+    def __init__(self, **methods):
+        self.__dict__["calls"] = []
+        self.__dict__["methods"] = dict(methods)
+
+    def __setattr__(self, name, func):
+        self.methods[name] = func
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name, args))
+            if name not in self.methods:
+                raise JSONRPCException(
+                    {"code": -32601, "message": f"Method not found: {name}"}
+                )
+            return self.methods[name](*args)
+
+        return _Method(call)
+
+    def pin(self):
+        return self
+
+    def called(self, name):
+        return [args for method, args in self.calls if method == name]
+
+
+class Response:
+    """Stands in for the requests.Response of an upstream call."""
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+
+def swap_script(timeout, refund_pubkey_hash=b"\x11" * 20):
+    """A swap redeem script whose timeout branch pays to a refund public key hash."""
+    return (
+        bytes([0x76, 0xA8])  # OP_DUP OP_SHA256
+        + push(b"\x22" * 32)
+        + bytes([0x87, 0x63, 0x75])  # OP_EQUAL OP_IF OP_DROP
+        + push(b"\x02" + b"\x33" * 32)
+        + bytes([0x67])  # OP_ELSE
+        + push(timeout.to_bytes(3, "little"))
+        + bytes([0xB1, 0x75, 0x76, 0xA9])  # OP_CLTV OP_DROP OP_DUP OP_HASH160
+        + push(refund_pubkey_hash)
+        + bytes([0x88, 0x68, 0xAC])  # OP_EQUALVERIFY OP_ENDIF OP_CHECKSIG
+    )
+
+
+def script_pushes(script):
+    """The data pushed by a script made only of pushes."""
+    items = []
+    while script:
+        length, script = script[0], script[1:]
+        if length == 0x4C:
+            length, script = script[0], script[1:]
+        elif length == 0x4D:
+            length, script = int.from_bytes(script[:2], "little"), script[2:]
+        items.append(script[:length])
+        script = script[length:]
+    return items
+
+
+@pytest.fixture
+def database(request, tmp_path, monkeypatch):
+    """
+    Empty order and event databases in a temporary directory. Parametrize it indirectly
+    with a number of shards to spread the orders over several files.
+    """
+    shards = getattr(request, "param", 1)
+    monkeypatch.setattr(
+        db, "storage", open_storage(str(tmp_path / "orders.db"), shards)
+    )
+    for module, name in ((archive, "archive.db"), (events, "events.db")):
+        monkeypatch.setattr(
+            module, "engine", create_engine(f"sqlite:///{tmp_path / name}")
+        )
+    monkeypatch.setattr(events, "_recent", collections.deque(maxlen=100))
+    monkeypatch.setattr(events, "_floor", 0)
+    monkeypatch.setattr(events, "_last_id", 0)
+    monkeypatch.setattr(events, "_published", 0)
+    db.init()
+    events.init()
+    yield
+    db.disable_group_commit()
+
+
+@pytest.fixture
+def rpc():
+    return FakeRPC()
+
+
+def fake_upstream(monkeypatch, name, *methods):
+    """
+    Replace an upstream client with one answering each of `methods` with
+    `fake.response`, set with fake.respond(status_code, body). Calls are recorded in
+    `fake.calls`.
+    """
+    fake = types.SimpleNamespace(response=Response(200), calls=[])
+    fake.respond = lambda *args: setattr(fake, "response", Response(*args))
+
+    def call(**kwargs):
+        fake.calls.append(kwargs)
+        return fake.response
+
+    for method in methods:
+        setattr(fake, method, call)
+    monkeypatch.setattr(upstream, name, lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def submarine(monkeypatch):
+    """The swap server, see fake_upstream()."""
+    return fake_upstream(monkeypatch, "submarine", "check_status", "get_quote")
+
+
+@pytest.fixture
+def blocksat(monkeypatch):
+    """The Blocksat API, see fake_upstream()."""
+    return fake_upstream(monkeypatch, "blocksat", "get")
+
+
+@pytest.fixture
+def app(database):
+    from sub_ln.server.server import create_app
+
+    return create_app(start_background=False)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from sub_ln.api import admission
+from sub_ln.api.admission import AdmissionController, Rejected
+
+RATES = {"read": (100, 100)}
+
+
+def queue_up(controller, client, order):
+    """Queue a request from client in a thread, appending client to order once run."""
+
+    def run():
+        controller.admit(client, "read")
+        order.append(client)
+        controller.release()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_queued(controller, queued):
+    deadline = time.monotonic() + 5
+    while controller.stats()["queued"] < queued:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_queued_clients_take_turns():
+    controller = AdmissionController(RATES, max_concurrent=1, queue_timeout=5)
+    controller.admit("busy", "read")
+    order = []
+    threads = []
+    for client in ("a", "a", "a", "b"):
+        threads.append(queue_up(controller, client, order))
+        wait_queued(controller, len(threads))
+    controller.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_a_full_queue_doesnt_use_up_the_rate_limit():
+    controller = AdmissionController(
+        {"read": (0.001, 1)}, max_concurrent=1, queue_size=0
+    )
+    controller.admit("busy", "read")
+    with pytest.raises(Rejected) as e:
+        controller.admit("a", "read")
+    assert e.value.reason == "server busy"
+    controller.release()
+    controller.admit("a", "read")
+    with pytest.raises(Rejected) as e:
+        controller.admit("a", "read")
+    assert e.value.reason == "rate limited"
+    counts = controller.stats()["classes"]["read"]
+    assert (counts["queue_full"], counts["rate_limited"]) == (1, 1)
+
+
+def test_rate_limited_requests_get_retry_after(app, monkeypatch):
+    controller = app.extensions["admission"]
+    monkeypatch.setitem(controller.rates, "read", (0.1, 1))
+    client = app.test_client()
+    assert client.get("/api/v1/util/random_message").status_code == 200
+    response = client.get("/api/v1/util/random_message")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 10
+    # changing the client id doesn't give a fresh allowance
+    response = client.get(
+        "/api/v1/util/random_message", headers={"X-Client-Id": "another"}
+    )
+    assert response.status_code == 429
+
+
+def test_gateways_with_their_token_can_name_clients(app, monkeypatch):
+    monkeypatch.setitem(admission.EVENTS_GATEWAY_TOKENS, "gw-a", "secret-a")
+    monkeypatch.setitem(app.extensions["admission"].rates, "read", (0.1, 1))
+    client = app.test_client()
+    gateway = {"X-Gateway-Id": "gw-a", "Authorization": "Bearer secret-a"}
+    for node in ("node1", "node2"):
+        response = client.get(
+            "/api/v1/util/random_message",
+            headers=dict(gateway, **{"X-Client-Id": node}),
+        )
+        assert response.status_code == 200
+    response = client.get(
+        "/api/v1/util/random_message", headers=dict(gateway, **{"X-Client-Id": "node1"})
+    )
+    assert response.status_code == 429
@@ -0,0 +1,105 @@
+import types
+
+import pytest
+
+from sub_ln.client import CREATED, FAILED, QUOTED, GatewayError, OfflineQueue
+from sub_ln.client import OrderSender
+
+
+def error(status_code):
+    request = types.SimpleNamespace(method="POST")
+    response = types.SimpleNamespace(
+        status_code=status_code, request=request, url="swap/quote", text="error"
+    )
+    response.json = lambda: {"error": "error"}
+    return GatewayError(response)
+
+
+class FakeClient:
+    """Stands in for a GatewayClient, `fail[uuid]` is raised when quoting the order."""
+
+    backoff_base = 0
+    backoff_cap = 0
+
+    def __init__(self):
+        self.fail = {}
+        self.quoted = []
+        self.swaps = {}
+        self.count = 0
+
+    def create_order(self, message, bid, network):
+        self.count += 1
+        uuid = f"u{self.count}"
+        return {"uuid": uuid, "order": {"lightning_invoice": {"payreq": "lntb1"}}}
+
+    def prepare_swap(self, uuid, invoice, network, address_type):
+        if uuid in self.fail:
+            raise self.fail[uuid]
+        self.quoted.append(uuid)
+        self.swaps[uuid] = {"invoice": invoice}
+
+    def lookup_order(self, uuid):
+        return {"orders": {"txid": None}, "swaps": self.swaps.get(uuid)}
+
+    def pay(self, uuid):
+        return f"tx-{uuid}"
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return OfflineQueue(str(tmp_path / "outbox.db"))
+
+
+def test_an_order_failing_every_time_stops_holding_up_the_queue(queue):
+    client = FakeClient()
+    client.fail["u1"] = error(500)
+    sent = []
+    sender = OrderSender(
+        client,
+        queue,
+        max_attempts=3,
+        on_sent=lambda order_id, uuid, txid: sent.append(txid),
+    )
+    first = queue.put("stuck", 1000, "testnet")
+    queue.put("next", 1000, "testnet")
+    for _ in range(2):
+        with pytest.raises(GatewayError):
+            sender.drain()
+    assert sent == []
+    assert sender.drain() == 1
+    assert sent == ["tx-u2"]
+    [failed] = queue.failed()
+    assert failed["id"] == first
+    assert failed["state"] == FAILED and failed["attempts"] == 3
+    assert len(queue) == 0
+
+
+def test_rate_limits_dont_use_up_an_orders_attempts(queue):
+    client = FakeClient()
+    client.fail["u1"] = error(429)
+    sender = OrderSender(client, queue, max_attempts=1)
+    queue.put("message", 1000, "testnet")
+    with pytest.raises(GatewayError):
+        sender.drain()
+    [order] = queue.pending()
+    assert order["state"] == CREATED and not order["attempts"]
+
+
+def test_a_quote_whose_response_was_lost_is_not_requested_again(queue):
+    client = FakeClient()
+    order_id = queue.put("message", 1000, "testnet")
+    queue.update(order_id, state=CREATED, uuid="u1", invoice="lntb1")
+    client.swaps["u1"] = {"invoice": "lntb1"}
+    sender = OrderSender(client, queue)
+    assert sender.drain() == 1
+    assert client.quoted == []
+    assert len(queue) == 0
+
+
+def test_orders_carry_on_from_the_step_they_reached(queue):
+    client = FakeClient()
+    order_id = queue.put("message", 1000, "testnet")
+    queue.update(order_id, state=QUOTED, uuid="u7", invoice="lntb1")
+    sender = OrderSender(client, queue)
+    assert sender.drain() == 1
+    assert client.count == 0 and client.quoted == []
@@ -0,0 +1,152 @@
+import types
+from decimal import Decimal
+
+import pytest
+
+from sub_ln.api import upstream
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.bitcoin.coin_pool import CoinPool, FundingUnknown, _Coin
+from sub_ln.database import db
+
+COIN = ("cc" * 32, 0)
+
+
+def rejected(code, message):
+    def raise_error(*args):
+        raise JSONRPCException({"code": code, "message": message})
+
+    return raise_error
+
+
+def timed_out(*args):
+    raise TimeoutError("timed out")
+
+
+@pytest.fixture
+def pool(rpc):
+    """A pool holding one confirmed 100,000 sat coin, funding from it as "fund1"."""
+    rpc.estimatesmartfee = lambda target: {"feerate": Decimal("0.00001")}
+    rpc.getrawchangeaddress = lambda address_type: "tb1qchange"
+    rpc.createrawtransaction = lambda inputs, outputs: "raw"
+    rpc.signrawtransactionwithwallet = lambda raw: {"complete": True, "hex": "signed"}
+    rpc.sendrawtransaction = lambda signed: "fund1"
+    rpc.decoderawtransaction = lambda signed: {"txid": "fund1"}
+    rpc.lockunspent = lambda unlock, outpoints: True
+    pool = CoinPool(rpc, "testnet")
+    pool._loaded = True
+    pool._coins[COIN] = _Coin(*COIN, 100_000, 3)
+    return pool
+
+
+def fund(pool):
+    return pool.fund("u1", "2Nswap1", 50_000, conf_target=6)
+
+
+def unlocked(rpc):
+    return [args for args in rpc.called("lockunspent") if args[0]]
+
+
+def test_funds_from_a_pool_coin(pool, rpc):
+    assert fund(pool) == "fund1"
+    ((inputs, outputs),) = rpc.called("createrawtransaction")
+    assert inputs == [{"txid": COIN[0], "vout": 0, "sequence": 0xFFFFFFFD}]
+    # 142 vbytes at 1 sat/vbyte
+    assert outputs == {
+        "2Nswap1": Decimal("0.0005"),
+        "tb1qchange": Decimal("0.00049858"),
+    }
+    assert pool.stats()["funded"] == 1
+    assert COIN not in pool._coins
+
+
+def test_falls_back_when_bitcoind_rejects_it(pool, rpc):
+    rpc.sendrawtransaction = rejected(-26, "min relay fee not met")
+    assert fund(pool) is None
+    assert unlocked(rpc) == [(True, [{"txid": COIN[0], "vout": 0}])]
+    assert pool.stats()["fallbacks"] == 1
+
+
+def test_falls_back_when_signing_fails(pool, rpc):
+    rpc.signrawtransactionwithwallet = timed_out
+    assert fund(pool) is None
+    assert rpc.called("sendrawtransaction") == []
+    assert len(unlocked(rpc)) == 1
+
+
+def test_lost_reply_for_a_sent_transaction(pool, rpc):
+    rpc.sendrawtransaction = timed_out
+    rpc.gettransaction = lambda txid: {"confirmations": 0}
+    assert fund(pool) == "fund1"
+    assert rpc.called("gettransaction") == [("fund1",)]
+    assert unlocked(rpc) == []
+
+
+@pytest.mark.parametrize(
+    "gettransaction",
+    [timed_out, rejected(-5, "Invalid or non-wallet transaction id")],
+    ids=["wallet unreachable", "not in wallet yet"],
+)
+def test_lost_reply_which_cant_be_checked(pool, rpc, gettransaction):
+    rpc.sendrawtransaction = timed_out
+    rpc.gettransaction = gettransaction
+    with pytest.raises(FundingUnknown):
+        fund(pool)
+    # the coin may be spent, it's neither unlocked nor used for another swap
+    assert unlocked(rpc) == []
+    assert pool._coins[COIN].reserved_by == "u1"
+    assert pool.fund("u2", "2Nswap2", 10_000, conf_target=6) is None
+
+    # trying again sends the same transaction
+    rpc.sendrawtransaction = lambda signed: "fund1"
+    assert fund(pool) == "fund1"
+    assert rpc.called("sendrawtransaction")[-1] == ("signed",)
+    assert len(rpc.called("createrawtransaction")) == 1
+
+
+def test_resend_of_a_transaction_which_went_out(pool, rpc):
+    rpc.sendrawtransaction = timed_out
+    rpc.gettransaction = timed_out
+    with pytest.raises(FundingUnknown):
+        fund(pool)
+    # it was sent and has confirmed, so its input is now spent
+    rpc.sendrawtransaction = rejected(-25, "bad-txns-inputs-missingorspent")
+    rpc.gettransaction = lambda txid: {"confirmations": 1}
+    assert fund(pool) == "fund1"
+    assert unlocked(rpc) == []
+
+
+def test_resend_of_a_transaction_which_never_went_out(pool, rpc):
+    rpc.sendrawtransaction = timed_out
+    rpc.gettransaction = timed_out
+    with pytest.raises(FundingUnknown):
+        fund(pool)
+    rpc.sendrawtransaction = rejected(-26, "min relay fee not met")
+    rpc.gettransaction = rejected(-5, "Invalid or non-wallet transaction id")
+    assert fund(pool) is None
+    assert len(unlocked(rpc)) == 1
+
+
+def test_swap_pay_doesnt_fall_back_when_funding_is_unknown(app, pool, rpc, monkeypatch):
+    db.add_order("u1", "message", "testnet")
+    db.add_swap(
+        "u1",
+        {
+            "swap_amount": 50_000,
+            "swap_p2sh_address": "2Nswap1",
+            "timeout_block_height": 1000,
+        },
+    )
+    monkeypatch.setattr(upstream, "rpc_pool", lambda network: rpc)
+    monkeypatch.setattr(upstream, "coin_pool", lambda network: pool)
+    monkeypatch.setattr(
+        upstream,
+        "confirmation_tracker",
+        lambda network: types.SimpleNamespace(height=900),
+    )
+    rpc.sendrawtransaction = timed_out
+    rpc.gettransaction = timed_out
+
+    response = app.test_client().post("/api/v1/swap/pay", json={"uuid": "u1"})
+    assert response.status_code == 503
+    assert rpc.called("sendtoaddress") == []
+    assert db.lookup_swap_check("u1")["state"] == db.STATE_SWAP_QUOTED
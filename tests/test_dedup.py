@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from sub_ln.api.dedup import Deduplicator
+from sub_ln.database import db
+
+SATELLITE = "https://api.blockstream.space/testnet"
+DIGEST = "ab" * 32
+
+
+def place(uuid, created_at=None):
+    created_at = created_at or int(time.time())
+    db.add_order(uuid, "message", "testnet")
+    db.add_blocksat(
+        uuid,
+        SATELLITE,
+        {
+            "uuid": f"blocksat-{uuid}",
+            "auth_token": "token",
+            "lightning_invoice": {
+                "created_at": created_at,
+                "description": "",
+                "expires_at": created_at + 3600,
+                "id": f"invoice-{uuid}",
+                "metadata": {"sha256_message_digest": DIGEST},
+                "msatoshi": "1000",
+                "payreq": "lntb1",
+                "rhash": "00",
+                "status": "unpaid",
+            },
+        },
+    )
+
+
+def test_unpaid_originals_are_not_matched(database):
+    place("u1")
+    assert Deduplicator(3600).find(DIGEST, SATELLITE) is None
+
+
+def fund(uuid):
+    db.add_swap(uuid, {"swap_p2sh_address": f"2N{uuid}"})
+    db.add_txid(uuid, f"fund-{uuid}")
+
+
+def test_completed_originals_are_matched(database):
+    place("u1")
+    fund("u1")
+    db.check_swap("u1", "11" * 32, "claim1")
+    dedup = Deduplicator(3600)
+    assert dedup.find(DIGEST, SATELLITE)["uuid"] == "u1"
+    assert dedup.stats()["msatoshi_saved"] == 1000
+
+
+def test_funded_originals_are_not_matched(database):
+    place("u1")
+    fund("u1")
+    assert Deduplicator(3600).find(DIGEST, SATELLITE) is None
+
+
+def test_expired_originals_are_not_matched(database):
+    place("u1")
+    fund("u1")
+    db.expire_swap("u1")
+    assert Deduplicator(3600).find(DIGEST, SATELLITE) is None
+    db.add_refunds(["u1"], "refund1", 300, 600)
+    db.confirm_refund(["u1"], "refund1", 601)
+    assert Deduplicator(3600).find(DIGEST, SATELLITE) is None
+
+
+@pytest.mark.parametrize(
+    "status, matched", [("paid", True), ("sent", True), ("cancelled", False)]
+)
+def test_originals_are_matched_by_blocksat_status(database, status, matched):
+    place("u1")
+    db.set_blocksat_status("u1", status)
+    found = Deduplicator(3600).find(DIGEST, SATELLITE)
+    assert (found is not None) == matched
+
+
+def test_originals_outside_the_window_are_not_matched(database):
+    place("u1", created_at=int(time.time()) - 7200)
+    db.set_blocksat_status("u1", "paid")
+    assert Deduplicator(3600).find(DIGEST, SATELLITE) is None
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+from flask import request
+
+from sub_ln.api import admission
+from sub_ln.database import db, events
+
+
+@pytest.fixture
+def orders(database):
+    db.add_order("a1", "message", "testnet", gateway="gw-a")
+    db.add_order("a2", "message", "testnet", gateway="gw-a")
+    db.add_order("b1", "message", "testnet", gateway="gw-b")
+    db.add_order("direct", "message", "testnet")
+
+
+def take(stream, count):
+    return [next(stream) for _ in range(count)]
+
+
+def test_only_gateway_orders_are_logged(orders):
+    events.publish_many(
+        [
+            ("a1", "swap_funded", {"txid": "t1"}),
+            ("direct", "swap_funded", {"txid": "t2"}),
+            ("unknown", "swap_funded", {"txid": "t3"}),
+        ]
+    )
+    (event,) = events.lookup_events("gw-a", 0, 10)
+    assert (event["uuid"], event["type"], event["data"]) == (
+        "a1",
+        "swap_funded",
+        {"txid": "t1"},
+    )
+    assert events.stats()["published"] == 1
+
+
+def test_subscribers_only_see_their_own_events(orders):
+    events.publish("a1", "swap_quoted")
+    events.publish("b1", "swap_quoted")
+    events.publish("a2", "swap_funded", txid="t1")
+    stream = events.subscribe("gw-a", after=0, keepalive=0.05)
+    assert [(e["uuid"], e["type"]) for e in take(stream, 2)] == [
+        ("a1", "swap_quoted"),
+        ("a2", "swap_funded"),
+    ]
+    # nothing more for this gateway, so a keep-alive
+    assert next(stream) is None
+    stream.close()
+    assert events.stats()["subscribers"] == 0
+
+
+def test_resumes_after_the_last_event_id(orders):
+    for uuid in ("a1", "a2", "a1"):
+        events.publish(uuid, "swap_quoted")
+    first, second, third = events.lookup_events("gw-a", 0, 10)
+    stream = events.subscribe("gw-a", after=second["id"], keepalive=0.05)
+    assert next(stream)["id"] == third["id"]
+    stream.close()
+
+
+def test_catches_up_from_the_database(orders, monkeypatch):
+    monkeypatch.setattr(events, "CATCH_UP_PAGE", 2)
+    for i in range(5):
+        events.publish("a1", "swap_quoted", n=i)
+    # as after a restart, with nothing buffered
+    monkeypatch.setattr(events, "_recent", events.deque(maxlen=100))
+    monkeypatch.setattr(events, "_floor", events.last_id())
+    stream = events.subscribe("gw-a", after=0, keepalive=0.05)
+    assert [e["data"]["n"] for e in take(stream, 5)] == [0, 1, 2, 3, 4]
+    stream.close()
+
+
+def test_new_events_wake_subscribers(orders):
+    stream = events.subscribe("gw-a", after=events.last_id(), keepalive=5)
+    received = []
+    reader = threading.Thread(target=lambda: received.append(next(stream)))
+    reader.start()
+    time.sleep(0.05)
+    events.publish("b1", "swap_quoted")
+    events.publish("a1", "invoice_paid", claim_txid="c1")
+    reader.join(2)
+    assert [(e["uuid"], e["type"]) for e in received] == [("a1", "invoice_paid")]
+    stream.close()
+
+
+def test_prune(orders):
+    events.publish("a1", "swap_quoted")
+    assert events.prune(time.time() - 60) == 0
+    assert events.prune(time.time() + 60) == 1
+    assert events.lookup_events("gw-a", 0, 10) == []
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    monkeypatch.setitem(admission.EVENTS_GATEWAY_TOKENS, "gw-a", "secret-a")
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"X-Gateway-Id": "gw-a", "Authorization": "Bearer secret-a"}, "gw-a"),
+        ({"X-Gateway-Id": "gw-a", "Authorization": "Bearer secret-b"}, None),
+        ({"X-Gateway-Id": "gw-a", "Authorization": "Basic secret-a"}, None),
+        ({"X-Gateway-Id": "gw-a"}, None),
+        ({"X-Gateway-Id": "gw-b", "Authorization": "Bearer secret-a"}, None),
+        ({}, None),
+    ],
+)
+def test_gateways_need_their_token(app, tokens, headers, expected):
+    with app.test_request_context(headers=headers):
+        assert admission.gateway_id(request) == expected
+
+
+@pytest.mark.parametrize(
+    "headers, status_code",
+    [
+        ({}, 401),
+        ({"X-Gateway-Id": "gw-a"}, 401),
+        ({"X-Gateway-Id": "gw-a", "Authorization": "Bearer secret-b"}, 401),
+        ({"X-Gateway-Id": "gw-a", "Authorization": "Bearer secret-a"}, 200),
+    ],
+)
+def test_streams_need_a_token(app, tokens, headers, status_code):
+    response = app.test_client().get("/api/v1/events", headers=headers)
+    assert response.status_code == status_code
+    if status_code == 401:
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+    else:
+        assert response.mimetype == "text/event-stream"
+    response.close()
@@ -0,0 +1,124 @@
+from decimal import Decimal
+
+import pytest
+
+from sub_ln.bitcoin import fees
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.bitcoin.tracker import ConfirmationTracker
+from sub_ln.database import db, events
+
+HEIGHT = 1000
+
+
+@pytest.mark.parametrize(
+    "timeout, margin, expected", [(1020, 6, 14), (1006, 6, 0), (1003, 6, -3)]
+)
+def test_blocks_to_deadline(timeout, margin, expected):
+    assert fees.blocks_to_deadline(timeout, HEIGHT, margin) == expected
+
+
+@pytest.mark.parametrize(
+    "blocks_left, expected", [(-3, 1), (0, 1), (1, 1), (14, 14), (500, 144)]
+)
+def test_conf_target(blocks_left, expected):
+    assert fees.conf_target(blocks_left, 144) == expected
+
+
+def funded_swap(uuid, timeout, txid=None):
+    db.add_order(uuid, "message", "testnet", gateway="gw1")
+    db.add_swap(
+        uuid, {"swap_p2sh_address": f"2N{uuid}", "timeout_block_height": timeout}
+    )
+    db.add_txid(uuid, txid or f"fund-{uuid}")
+
+
+@pytest.fixture
+def bumper(database, rpc):
+    """
+    A FeeBumper whose funding transactions pay 1 sat/vbyte, against 5 estimated. Amounts
+    are Decimals, as AuthServiceProxy returns them.
+    """
+    rpc.gettransaction = lambda txid: {
+        "confirmations": 0,
+        "fee": Decimal("-0.000002"),
+        "hex": txid,
+    }
+    rpc.decoderawtransaction = lambda raw: {"vsize": 200}
+    rpc.estimatesmartfee = lambda target: {"feerate": Decimal("0.00005")}
+    rpc.bumpfee = lambda txid, options: {"txid": f"bumped-{txid}"}
+    tracker = ConfirmationTracker(rpc, "testnet")
+    return fees.FeeBumper(rpc, "testnet", tracker, margin=6, bump_within=6)
+
+
+def test_bumps_underpaying_funding_near_the_deadline(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+    bumper.run(HEIGHT)
+
+    assert rpc.called("estimatesmartfee") == [(4,)]
+    assert rpc.called("bumpfee") == [("fund-u1", {"conf_target": 4})]
+    assert db.export_orders(["u1"])["u1"]["orders"]["txid"] == "bumped-fund-u1"
+    assert bumper.tracker._txids == {"bumped-fund-u1": "u1"}
+    (event,) = events.lookup_events("gw1", 0, 10)
+    assert event["type"] == "funding_replaced"
+    assert event["data"] == {"txid": "bumped-fund-u1", "replaced_txid": "fund-u1"}
+    assert bumper.stats() == {"checked": 1, "bumped": 1}
+
+
+def test_leaves_swaps_far_from_or_past_the_deadline(bumper, rpc):
+    funded_swap("early", HEIGHT + 13)
+    funded_swap("late", HEIGHT + 6)
+    bumper.run(HEIGHT)
+    assert rpc.called("gettransaction") == []
+    assert bumper.stats() == {"checked": 0, "bumped": 0}
+
+
+def test_leaves_funding_paying_the_estimate(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+    rpc.estimatesmartfee = lambda target: {"feerate": Decimal("0.00001")}
+    bumper.run(HEIGHT)
+    assert rpc.called("bumpfee") == []
+
+
+def test_leaves_funding_without_an_estimate(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+    rpc.estimatesmartfee = lambda target: {"errors": ["Insufficient data"]}
+    bumper.run(HEIGHT)
+    assert rpc.called("bumpfee") == []
+
+
+def test_leaves_confirmed_funding(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+    rpc.gettransaction = lambda txid: {"confirmations": 1, "fee": Decimal("-0.000002")}
+    bumper.run(HEIGHT)
+    assert rpc.called("estimatesmartfee") == []
+
+
+def test_falls_back_to_conf_target_before_0_21(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+
+    def bumpfee(txid, options):
+        if "conf_target" in options:
+            raise JSONRPCException({"code": -3, "message": "Unexpected key"})
+        return {"txid": "bumped"}
+
+    rpc.bumpfee = bumpfee
+    bumper.run(HEIGHT)
+    assert rpc.called("bumpfee")[-1] == ("fund-u1", {"confTarget": 4})
+    assert db.export_orders(["u1"])["u1"]["orders"]["txid"] == "bumped"
+
+
+def test_carries_on_after_a_failed_bump(bumper, rpc):
+    funded_swap("u1", HEIGHT + 10)
+    funded_swap("u2", HEIGHT + 10)
+
+    def bumpfee(txid, options):
+        if txid == "fund-u1":
+            raise JSONRPCException({"code": -4, "message": "Insufficient funds"})
+        return {"txid": f"bumped-{txid}"}
+
+    rpc.bumpfee = bumpfee
+    bumper.run(HEIGHT)
+    assert bumper.stats() == {"checked": 2, "bumped": 1}
+    orders = db.export_orders(["u1", "u2"])
+    assert orders["u1"]["orders"]["txid"] == "fund-u1"
+    assert orders["u2"]["orders"]["txid"] == "bumped-fund-u2"
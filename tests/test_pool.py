@@ -0,0 +1,66 @@
+import pytest
+
+from sub_ln.bitcoin.authproxy import JSONRPCException
+from sub_ln.bitcoin.pool import RPCBackend, RPCPool
+
+
+class FakeProxy:
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+
+    def __getattr__(self, method):
+        def call(*args):
+            if self.error is not None:
+                raise self.error
+            return (self.name, method) + args
+
+        return call
+
+
+def backend(name, proxy=None, wallet=False, pool_size=1):
+    b = RPCBackend(f"http://user:pass@{name}:8332", wallet=wallet, pool_size=pool_size)
+    b._idle.put(proxy or FakeProxy(name))
+    return b
+
+
+def slot_free(b):
+    if not b._slots.acquire(blocking=False):
+        return False
+    b._slots.release()
+    return True
+
+
+@pytest.mark.parametrize("error", [ValueError("bad reply"), KeyError("result")])
+def test_unexpected_errors_release_the_slot(error):
+    b = backend("node1", FakeProxy("node1", error))
+    with pytest.raises(type(error)):
+        b.call("getblockcount")
+    assert b.outstanding == 0
+    assert b.errors == 1
+    assert slot_free(b)
+    # the connection which failed isn't reused
+    assert b._idle.empty()
+
+
+def test_rpc_errors_keep_the_connection():
+    proxy = FakeProxy("node1", JSONRPCException({"code": -5, "message": "No tx"}))
+    b = backend("node1", proxy)
+    with pytest.raises(JSONRPCException):
+        b.call("getrawtransaction", "00")
+    assert b.errors == 0
+    assert slot_free(b)
+    assert b._idle.get_nowait() is proxy
+
+
+def test_pinned_pool_sends_reads_to_one_backend():
+    wallet = backend("wallet", wallet=True, pool_size=4)
+    reader = backend("reader", pool_size=4)
+    pool = RPCPool([wallet, reader])
+    pinned = pool.pin()
+    first = pinned.getblockhash(1)[0]
+    # would normally pick the other backend, being the less busy one
+    next(b for b in pool.backends if b.name.startswith(first)).outstanding += 1
+    assert pool.getblockhash(2)[0] != first
+    assert pinned.getblockhash(2)[0] == first
+    assert pinned.sendrawtransaction("00")[0] == "wallet"
@@ -0,0 +1,220 @@
+import struct
+
+from conftest import script_pushes, swap_script
+
+from sub_ln.bitcoin import secp256k1
+from sub_ln.bitcoin.refund import RefundEngine
+from sub_ln.bitcoin.tracker import ConfirmationTracker
+from sub_ln.bitcoin.transaction import Transaction, TxIn, estimate_size
+from sub_ln.database import db, events
+
+FUNDING_TXID = "aa" * 32
+TIMEOUT = 600_000
+REDEEM_SCRIPT = swap_script(TIMEOUT)
+# private key 1
+REFUND_WIF = "KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn"
+REFUND_PUBKEY = secp256k1.public_key(1)
+WALLET_SCRIPT = bytes.fromhex("0014") + b"\x44" * 20
+
+
+def parse(raw):
+    """Split a legacy transaction into a Transaction, keeping each scriptSig."""
+
+    def read_varint(data):
+        if data[0] == 0xFD:
+            return struct.unpack("<H", data[1:3])[0], data[3:]
+        return data[0], data[1:]
+
+    version, raw = struct.unpack("<I", raw[:4])[0], raw[4:]
+    count, raw = read_varint(raw)
+    inputs = []
+    for _ in range(count):
+        txid, vout = raw[:32][::-1].hex(), struct.unpack("<I", raw[32:36])[0]
+        length, raw = read_varint(raw[36:])
+        script_sig, raw = raw[:length], raw[length:]
+        sequence, raw = struct.unpack("<I", raw[:4])[0], raw[4:]
+        txin = TxIn(txid, vout, None, script_pushes(script_sig)[-1], sequence)
+        txin.script_sig = script_sig
+        inputs.append(txin)
+    count, raw = read_varint(raw)
+    outputs = []
+    for _ in range(count):
+        value = struct.unpack("<Q", raw[:8])[0]
+        length, raw = read_varint(raw[8:])
+        outputs.append((value, raw[:length]))
+        raw = raw[length:]
+    assert len(raw) == 4
+    return Transaction(inputs, outputs, struct.unpack("<I", raw)[0], version)
+
+
+def refundable_swap(database):
+    db.add_order("u1", "message", "testnet", gateway="gw1")
+    db.add_swap(
+        "u1",
+        {
+            "swap_p2sh_address": "2Nswap1",
+            "redeem_script": REDEEM_SCRIPT.hex(),
+            "timeout_block_height": TIMEOUT,
+        },
+    )
+    db.add_refund_addr("u1", "tb1qrefund")
+    db.add_txid("u1", FUNDING_TXID)
+    db.add_confirmations(
+        [
+            {
+                "uuid": "u1",
+                "txid": FUNDING_TXID,
+                "height": TIMEOUT - 10,
+                "block_hash": "h",
+            }
+        ]
+    )
+
+
+def wallet(rpc, spent=False):
+    rpc.gettransaction = lambda txid: {"hex": "funding"}
+    rpc.decoderawtransaction = lambda raw: {
+        "vout": [
+            {"n": 0, "value": "0.01", "scriptPubKey": {"address": "tb1qchange"}},
+            {"n": 1, "value": "0.0002", "scriptPubKey": {"address": "2Nswap1"}},
+        ]
+    }
+    rpc.gettxout = lambda txid, n, include_mempool: None if spent else {"value": 0.0002}
+    rpc.dumpprivkey = lambda address: REFUND_WIF
+    rpc.getaddressinfo = lambda address: {
+        "pubkey": REFUND_PUBKEY.hex(),
+        "scriptPubKey": WALLET_SCRIPT.hex(),
+    }
+    rpc.getnewaddress = lambda: "tb1qnew"
+    rpc.estimatesmartfee = lambda conf_target: {"feerate": 0.00002}
+    sent = []
+
+    def sendrawtransaction(raw):
+        sent.append(raw)
+        return f"refund{len(sent)}"
+
+    rpc.sendrawtransaction = sendrawtransaction
+
+
+def mine(rpc, tracker, height, txids):
+    """Have the tracker process block `height` holding txids."""
+    rpc.getblockhash = lambda h: f"hash{h}"
+    rpc.getblock = lambda block_hash, verbosity: {
+        "tx": [{"txid": txid, "vout": []} for txid in txids]
+    }
+    tracker.process_block(height)
+
+
+def test_refunds_timed_out_swaps(database, rpc):
+    refundable_swap(database)
+    wallet(rpc)
+    engine = RefundEngine(rpc, "testnet")
+    assert engine.run(TIMEOUT - 1) is None
+    assert engine.run(TIMEOUT) == "refund1"
+
+    (raw,) = rpc.called("sendrawtransaction")[0]
+    tx = parse(bytes.fromhex(raw))
+    assert tx.serialize().hex() == raw
+    assert tx.locktime == TIMEOUT
+    (txin,) = tx.inputs
+    assert (txin.txid, txin.vout, txin.redeem_script) == (
+        FUNDING_TXID,
+        1,
+        REDEEM_SCRIPT,
+    )
+    # a final sequence would disable the lock time, and this one signals replaceability
+    assert txin.sequence == 0xFFFFFFFD
+    signature, pubkey, _ = script_pushes(txin.script_sig)
+    assert pubkey == REFUND_PUBKEY
+    assert secp256k1.verify(pubkey, tx.signature_hash(0), signature[:-1])
+    # 2 sat/vbyte on the estimated size, rounded up
+    ((amount, script_pub_key),) = tx.outputs
+    assert script_pub_key == WALLET_SCRIPT
+    assert 0 <= 20_000 - amount - estimate_size(tx) * 2 <= 1
+
+    assert db.lookup_swap_check("u1")["state"] == db.STATE_REFUNDING
+    assert db.lookup_refundable("testnet", TIMEOUT, 10) == []
+    assert [e["type"] for e in events.lookup_events("gw1", 0, 10)] == ["refund_sent"]
+    assert engine.stats() == {"refunded": 1, "transactions": 1, "replaced": 0}
+
+
+def test_refunds_are_refunded_once_they_confirm(database, rpc):
+    refundable_swap(database)
+    wallet(rpc)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    engine = RefundEngine(rpc, "testnet", tracker=tracker)
+    engine.run(TIMEOUT)
+    mine(rpc, tracker, TIMEOUT + 1, ["other"])
+    assert db.lookup_swap_check("u1")["state"] == db.STATE_REFUNDING
+    mine(rpc, tracker, TIMEOUT + 2, ["refund1"])
+
+    swap = db.lookup_swap_check("u1")
+    assert (swap["state"], swap["refund_txid"]) == (db.STATE_REFUNDED, "refund1")
+    event = events.lookup_events("gw1", 0, 10)[-1]
+    assert event["type"] == "refunded"
+    assert event["data"] == {"refund_txid": "refund1", "height": TIMEOUT + 2}
+
+    # a re-org of the block puts it back to waiting for the refund
+    db.clear_confirmations("testnet", TIMEOUT + 2)
+    assert db.lookup_swap_check("u1")["state"] == db.STATE_REFUNDING
+
+
+def test_stuck_refunds_are_replaced_at_a_higher_fee(database, rpc):
+    refundable_swap(database)
+    wallet(rpc)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    engine = RefundEngine(rpc, "testnet", tracker=tracker, replace_after=3)
+    engine.run(TIMEOUT)
+    # the refund is in the mempool, spending the funding output
+    rpc.gettxout = lambda txid, n, include_mempool: (
+        None if include_mempool else {"value": 0.0002}
+    )
+    assert engine.run(TIMEOUT + 2) is None
+    assert len(rpc.called("sendrawtransaction")) == 1
+    engine.run(TIMEOUT + 3)
+
+    first, second = [
+        parse(bytes.fromhex(raw)) for (raw,) in rpc.called("sendrawtransaction")
+    ]
+    assert [(i.txid, i.vout) for i in second.inputs] == [(FUNDING_TXID, 1)]
+    size = estimate_size(second)
+    # at least the old fee plus 1 sat/vbyte for relaying the replacement
+    assert first.outputs[0][0] - second.outputs[0][0] >= size
+    assert db.lookup_swap_check("u1")["refund_txid"] == "refund2"
+    assert engine.stats()["replaced"] == 1
+
+    # the replaced refund confirms after all
+    mine(rpc, tracker, TIMEOUT + 4, ["refund1"])
+    swap = db.lookup_swap_check("u1")
+    assert (swap["state"], swap["refund_txid"]) == (db.STATE_REFUNDED, "refund1")
+
+
+def test_refunds_of_claimed_swaps_are_given_up(database, rpc):
+    refundable_swap(database)
+    wallet(rpc)
+    engine = RefundEngine(rpc, "testnet", replace_after=3)
+    engine.run(TIMEOUT)
+    # the swap server's claim confirmed instead
+    rpc.gettxout = lambda txid, n, include_mempool: None
+    engine.run(TIMEOUT + 3)
+    assert len(rpc.called("sendrawtransaction")) == 1
+    swap = db.lookup_swap_check("u1")
+    assert (swap["state"], swap["refund_txid"]) == (db.STATE_SWAP_EXPIRED, None)
+
+
+def test_skips_claimed_swaps(database, rpc):
+    refundable_swap(database)
+    wallet(rpc, spent=True)
+    assert RefundEngine(rpc, "testnet").run(TIMEOUT) is None
+    assert rpc.called("sendrawtransaction") == []
+
+
+def test_skips_keys_which_dont_match_the_wallet(database, rpc):
+    refundable_swap(database)
+    wallet(rpc)
+    rpc.getaddressinfo = lambda address: {
+        "pubkey": secp256k1.public_key(2).hex(),
+        "scriptPubKey": WALLET_SCRIPT.hex(),
+    }
+    assert RefundEngine(rpc, "testnet").run(TIMEOUT) is None
+    assert rpc.called("sendrawtransaction") == []
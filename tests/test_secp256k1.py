@@ -0,0 +1,94 @@
+import hashlib
+
+import pytest
+
+from sub_ln.bitcoin import secp256k1
+
+# RFC 6979 deterministic signatures with SHA-256 on secp256k1, as used by Trezor,
+# bitcoinj and python-ecdsa: (private key, message, nonce, low-S DER signature)
+SIGNATURES = [
+    (
+        1,
+        "Satoshi Nakamoto",
+        0x8F8A276C19F4149656B280621E358CCE24F5F52542772691EE69063B74F15D15,
+        "3045022100934b1ea10a4b3c1757e2b0c017d0b6143ce3c9a7e6a4a49860d7a6ab210ee3d8"
+        "02202442ce9d2b916064108014783e923ec36b49743e2ffa1c4496f01a512aafd9e5",
+    ),
+    (
+        1,
+        "All those moments will be lost in time, like tears in rain. Time to die...",
+        0x38AA22D72376B4DBC472E06C3BA403EE0A394DA63FC58D88686C611ABA98D6B3,
+        "30450221008600dbd41e348fe5c9465ab92d23e3db8b98b873beecd930736488696438cb6b"
+        "0220547fe64427496db33bf66019dacbf0039c04199abb0122918601db38a72cfc21",
+    ),
+    (
+        0xF8B8AF8CE3C7CCA5E300D33939540C10D45CE001B8F252BFBC57BA0342904181,
+        "Alan Turing",
+        0x525A82B70E67874398067543FD84C83D30C175FDC45FDEEE082FE13B1D7CFDF1,
+        "304402207063ae83e7f62bbb171798131b4a0564b956930092b33b07b395615d9ec7e15c"
+        "022058dfcc1e00a35e1572f366ffe34ba0fc47db1e7189759b9fb233c5b05ab388ea",
+    ),
+]
+
+
+def digest(message):
+    return hashlib.sha256(message.encode("utf8")).digest()
+
+
+@pytest.mark.parametrize(
+    "secret, expected",
+    [
+        (1, "0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798"),
+        (2, "02c6047f9441ed7d6d3045406e95c07cd85c778e4b8cef3ca7abac09b95c709ee5"),
+        (3, "02f9308a019258c31049344f85f89d5229b531c845836f99b08601f113bce036f9"),
+    ],
+)
+def test_public_key(secret, expected):
+    assert secp256k1.public_key(secret).hex() == expected
+
+
+def test_point_multiply_by_the_group_order_minus_one_negates():
+    x, y = secp256k1.point_multiply(secp256k1.N - 1)
+    assert (x, y) == (secp256k1.G[0], secp256k1.P - secp256k1.G[1])
+
+
+@pytest.mark.parametrize("secret, message, nonce, signature", SIGNATURES)
+def test_rfc6979_vectors(secret, message, nonce, signature):
+    assert secp256k1._rfc6979_nonce(secret, digest(message)) == nonce
+    assert secp256k1.sign(secret, digest(message)).hex() == signature
+
+
+def test_signatures_have_low_s():
+    # before normalisation these have a high S value
+    for secret in (1, 12345, secp256k1.N - 1):
+        signature = secp256k1.sign(secret, digest("Satoshi Nakamoto"))
+        r_len = signature[3]
+        s = int.from_bytes(signature[6 + r_len :], "big")
+        assert s <= secp256k1.N // 2
+
+
+@pytest.mark.parametrize("secret, message, nonce, signature", SIGNATURES)
+def test_verify(secret, message, nonce, signature):
+    pubkey = secp256k1.public_key(secret)
+    signature = bytes.fromhex(signature)
+    assert secp256k1.verify(pubkey, digest(message), signature)
+    assert not secp256k1.verify(pubkey, digest(message + "."), signature)
+    assert not secp256k1.verify(
+        secp256k1.public_key(secret + 1), digest(message), signature
+    )
+
+
+@pytest.mark.parametrize(
+    "wif, compressed",
+    [
+        ("KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn", True),
+        ("5HpHagT65TZzG1PH3CSu63k8DbpvD8s5ip4nEB3kEsreAnchuDf", False),
+    ],
+)
+def test_decode_wif(wif, compressed):
+    assert secp256k1.decode_wif(wif) == (1, compressed)
+
+
+def test_decode_wif_checks_the_checksum():
+    with pytest.raises(ValueError):
+        secp256k1.decode_wif("KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWo")
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from sub_ln.database import db
+from sub_ln.database.storage import ShardedSQLiteStorage
+
+UUIDS = [f"{i:032x}" for i in range(12)]
+
+sharded = pytest.mark.parametrize("database", [3], indirect=True)
+
+
+def add_order(uuid, created_at, timeout=500):
+    db.add_order(uuid, "message", "testnet", gateway="gw1")
+    db.add_swap(
+        uuid,
+        {
+            "swap_p2sh_address": f"2N{uuid}",
+            "redeem_script": "00",
+            "timeout_block_height": timeout,
+        },
+    )
+    db.add_txid(uuid, f"fund-{uuid}")
+    db.storage.engine_for(uuid).execute(
+        db.orders.update().where(db.orders.c.uuid == uuid).values(created_at=created_at)
+    )
+
+
+def test_orders_are_routed_by_uuid(tmp_path):
+    path = str(tmp_path / "orders.db")
+    storage = ShardedSQLiteStorage(path, 3)
+    assert [os.path.basename(p) for p in storage.paths] == [
+        "orders.0.db",
+        "orders.1.db",
+        "orders.2.db",
+    ]
+    # the same in another process, and every shard gets some
+    again = ShardedSQLiteStorage(path, 3)
+    shards = [storage.engines.index(storage.engine_for(u)) for u in UUIDS]
+    assert shards == [again.engines.index(again.engine_for(u)) for u in UUIDS]
+    assert set(shards) == {0, 1, 2}
+    groups = storage.group_by_engine(UUIDS)
+    assert sorted(u for uuids in groups.values() for u in uuids) == UUIDS
+    for engine, uuids in groups.items():
+        assert all(storage.engine_for(u) is engine for u in uuids)
+
+
+@sharded
+def test_an_orders_rows_are_kept_together(database):
+    add_order(UUIDS[0], created_at=1)
+    holding = [
+        engine
+        for engine in db.storage.engines
+        if engine.execute(db.swaps.select()).fetchall()
+        or engine.execute(db.orders.select()).fetchall()
+    ]
+    assert holding == [db.storage.engine_for(UUIDS[0])]
+    assert db.lookup_order(UUIDS[0])["swaps"]["swap_p2sh_address"] == f"2N{UUIDS[0]}"
+
+
+@sharded
+def test_listing_merges_every_shard_in_order(database):
+    for i, uuid in enumerate(UUIDS):
+        add_order(uuid, created_at=1000 + i)
+    seen = []
+    cursor = None
+    while True:
+        rows, cursor = db.list_orders(after=cursor, limit=5)
+        seen += [row["uuid"] for row in rows]
+        if cursor is None:
+            break
+    assert seen == UUIDS[::-1]
+
+
+@sharded
+def test_scattered_lookups_combine_every_shard(database):
+    for i, uuid in enumerate(UUIDS):
+        add_order(uuid, created_at=1000, timeout=500 + i)
+        db.add_confirmations(
+            [{"uuid": uuid, "txid": f"fund-{uuid}", "height": 400, "block_hash": "h"}]
+        )
+    refundable = db.lookup_refundable("testnet", 505, 4)
+    assert [row["uuid"] for row in refundable] == UUIDS[:4]
+    assert db.lookup_gateways(UUIDS) == {uuid: "gw1" for uuid in UUIDS}
+    unresolved = db.lookup_unresolved_swaps(UUIDS[5], 3)
+    assert [row["uuid"] for row in unresolved] == UUIDS[6:9]
+
+    db.clear_confirmations("testnet", 400)
+    assert db.lookup_refundable("testnet", 600, 100) == []
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from sub_ln.api import api, upstream
+from sub_ln.database import db
+
+
+@pytest.fixture
+def swap(app, submarine, monkeypatch):
+    monkeypatch.setattr(api, "SWAP_CHECK_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(upstream, "confirmation_tracker", lambda network: None)
+    db.add_order("u1", "message", "testnet")
+    db.add_swap(
+        "u1",
+        {
+            "swap_p2sh_address": "2Nswap1",
+            "invoice": "lntb1",
+            "redeem_script": "00",
+            "timeout_block_height": 500,
+        },
+    )
+    db.add_txid("u1", "fund1")
+    submarine.respond(200, {"status": "funded"})
+
+
+def check(client, wait=0, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(
+        "/api/v1/swap/check", json={"uuid": "u1", "wait": wait}, headers=headers
+    )
+
+
+def later(func, delay=0.05):
+    thread = threading.Thread(target=lambda: (time.sleep(delay), func()))
+    thread.start()
+    return thread
+
+
+def test_long_poll_asks_the_swap_server_once(app, swap, submarine):
+    client = app.test_client()
+    etag = check(client).headers["ETag"]
+    t0 = time.monotonic()
+    response = check(client, wait=0.2, etag=etag)
+    assert response.status_code == 304
+    assert time.monotonic() - t0 >= 0.2
+    assert len(submarine.calls) == 2
+
+
+def test_long_poll_returns_an_outcome_recorded_while_waiting(app, swap, submarine):
+    client = app.test_client()
+    etag = check(client).headers["ETag"]
+    thread = later(lambda: db.check_swap("u1", "11" * 32, "claim1"))
+    response = check(client, wait=5, etag=etag)
+    thread.join()
+    assert response.status_code == 200
+    assert response.json["state"] == db.STATE_SWAP_COMPLETE
+    assert "claim1" in response.json["swap_check"]
+    assert len(submarine.calls) == 2
+
+
+def test_long_poll_ends_early_when_the_order_changes(app, swap, submarine):
+    client = app.test_client()
+    etag = check(client).headers["ETag"]
+    confirmation = {"uuid": "u1", "txid": "fund1", "height": 400, "block_hash": "h"}
+    thread = later(lambda: db.add_confirmations([confirmation]))
+    t0 = time.monotonic()
+    response = check(client, wait=5, etag=etag)
+    thread.join()
+    # the client is sent back to ask the swap server again
+    assert response.status_code == 304
+    assert time.monotonic() - t0 < 4
+    assert len(submarine.calls) == 2
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from sub_ln.api import upstream
+from sub_ln.database import db
+
+QUOTE = {
+    "invoice": "lntb1",
+    "redeem_script": "00",
+    "swap_amount": 12000,
+    "swap_p2sh_address": "2Nswap1",
+    "timeout_block_height": 500,
+}
+
+
+@pytest.fixture
+def swap_server(app, submarine, monkeypatch):
+    monkeypatch.setattr(upstream, "confirmation_tracker", lambda network: None)
+    submarine.respond(200, dict(QUOTE))
+    db.add_order("u1", "message", "testnet")
+    return submarine
+
+
+def quote(client, invoice="lntb1"):
+    return client.post(
+        "/api/v1/swap/quote",
+        json={
+            "uuid": "u1",
+            "invoice": invoice,
+            "network": "testnet",
+            "refund_address": None,
+        },
+    )
+
+
+def test_quoting_again_returns_the_stored_quote(app, swap_server):
+    client = app.test_client()
+    first = quote(client)
+    # the response to the first request was lost, the client asks again
+    second = quote(client)
+    assert first.status_code == second.status_code == 200
+    assert len(swap_server.calls) == 1
+    stored = json.loads(second.json["swap"])
+    assert {k: stored[k] for k in QUOTE} == QUOTE
+
+
+def test_quoting_another_invoice_for_a_quoted_order_conflicts(app, swap_server):
+    client = app.test_client()
+    quote(client)
+    response = quote(client, invoice="lntb2")
+    assert response.status_code == 409
+    assert len(swap_server.calls) == 1
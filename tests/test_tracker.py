@@ -0,0 +1,124 @@
+from sub_ln.bitcoin.tracker import ConfirmationTracker
+from sub_ln.database import db
+
+
+def add_funded_swap(uuid, txid, address):
+    db.add_order(uuid, "message", "testnet")
+    db.add_swap(uuid, {"swap_p2sh_address": address, "timeout_block_height": 500})
+    db.add_txid(uuid, txid)
+
+
+def chain(rpc, height, blocks=None):
+    """Serve a chain `height` blocks long, blocks maps height to its transactions."""
+    blocks = blocks or {}
+    rpc.getblockcount = lambda: height
+    rpc.getblockhash = lambda h: f"hash{h}"
+    rpc.getblock = lambda block_hash, verbosity: {
+        "tx": blocks.get(int(block_hash[4:]), [])
+    }
+
+
+def test_starts_from_the_tip_without_a_saved_height(database, rpc):
+    chain(rpc, 100)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    assert tracker.height == 100
+    assert db.lookup_chain_tip("testnet") == (100, "hash100")
+
+
+def test_processes_blocks_mined_while_stopped(database, rpc):
+    add_funded_swap("u1", "fund1", "2Nswap1")
+    add_funded_swap("u2", "fund2", "2Nswap2")
+    chain(rpc, 100)
+    ConfirmationTracker(rpc, "testnet").poll()
+
+    # two blocks arrive while the server is down, then it restarts
+    chain(
+        rpc,
+        103,
+        {
+            101: [{"txid": "fund1", "vout": []}],
+            102: [
+                {
+                    "txid": "other",
+                    "vout": [{"scriptPubKey": {"address": "2Nswap2"}}],
+                }
+            ],
+        },
+    )
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    assert tracker.height == 100
+    assert tracker.pending == 2
+    tracker.poll()
+
+    assert tracker.height == 103
+    assert tracker.pending == 0
+    records = db.export_orders(["u1", "u2"])
+    assert records["u1"]["orders"]["funding_height"] == 101
+    assert records["u2"]["orders"]["funding_height"] == 102
+    assert records["u2"]["orders"]["txid"] == "other"
+    assert records["u1"]["orders"]["state"] == db.STATE_FUNDING_CONFIRMED
+    assert db.lookup_chain_tip("testnet") == (103, "hash103")
+
+
+def test_rewinds_a_saved_height_which_was_reorged_out(database, rpc):
+    add_funded_swap("u1", "fund1", "2Nswap1")
+    db.save_chain_tip("testnet", 100, "stale100")
+    chain(rpc, 101, {100: [{"txid": "fund1", "vout": []}]})
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    tracker.poll()
+    assert tracker.height == 101
+    assert db.export_orders(["u1"])["u1"]["orders"]["funding_height"] == 100
+
+
+def test_reorgs_leave_settled_swaps_settled(database, rpc):
+    add_funded_swap("u1", "fund1", "2Nswap1")
+    add_funded_swap("u2", "fund2", "2Nswap2")
+    chain(rpc, 100)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    funding = [{"txid": "fund1", "vout": []}, {"txid": "fund2", "vout": []}]
+    chain(rpc, 102, {101: funding})
+    tracker.poll()
+    db.check_swap("u1", "11" * 32, "claim1")
+
+    # block 101 is replaced, with the funding transactions back in the mempool
+    chain(rpc, 102)
+    rpc.getblockhash = lambda h: f"hash{h}" if h < 101 else f"fork{h}"
+    tracker.poll()
+
+    records = db.export_orders(["u1", "u2"])
+    assert records["u1"]["orders"]["state"] == db.STATE_SWAP_COMPLETE
+    assert records["u2"]["orders"]["state"] == db.STATE_SWAP_FUNDED
+    assert records["u1"]["orders"]["funding_height"] is None
+    assert records["u2"]["orders"]["funding_height"] is None
+    # only the unsettled swap is looked for again
+    assert tracker.pending == 1
+
+
+def test_confirming_a_settled_swap_keeps_its_state(database, rpc):
+    add_funded_swap("u1", "fund1", "2Nswap1")
+    chain(rpc, 100)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    # the swap server claimed it from the mempool
+    db.check_swap("u1", "11" * 32, "claim1")
+    chain(rpc, 101, {101: [{"txid": "fund1", "vout": []}]})
+    tracker.poll()
+    record = db.export_orders(["u1"])["u1"]["orders"]
+    assert record["state"] == db.STATE_SWAP_COMPLETE
+    assert record["funding_height"] == 101
+
+
+def test_confirmations_go_through_group_commit(database, rpc):
+    db.enable_group_commit(max_batch=8, max_delay=0.001)
+    add_funded_swap("u1", "fund1", "2Nswap1")
+    chain(rpc, 100)
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.poll()
+    chain(rpc, 101, {101: [{"txid": "fund1", "vout": []}]})
+    tracker.poll()
+    assert db.group_commit_stats()[0]["writes"] == 4
+    assert db.export_orders(["u1"])["u1"]["orders"]["funding_height"] == 101
@@ -0,0 +1,128 @@
+import pytest
+
+from conftest import script_pushes, swap_script
+
+from sub_ln.bitcoin import secp256k1
+from sub_ln.bitcoin.transaction import (
+    Transaction,
+    TxIn,
+    estimate_size,
+    push,
+    refund_script_sig,
+    sign_refund,
+    varint,
+)
+
+# f4184fc596403b9d638783cf57adfe4c75c605f6356fbc91338530e9831e9e16, the first payment
+# between two people, in block 170. Its input spends a pay-to-pubkey output, whose
+# script is the legacy script code just like a swap's redeem script.
+FIRST_PAYMENT_TXID = "f4184fc596403b9d638783cf57adfe4c75c605f6356fbc91338530e9831e9e16"
+FIRST_PAYMENT = (
+    "0100000001c997a5e56e104102fa209c6a852dd90660a20b2d9c352423edce25857fcd3704000000"
+    "004847304402204e45e16932b8af514961a1d3a1a25fdf3f4f7732e9d624c6c61548ab5fb8cd4102"
+    "20181522ec8eca07de4860a4acdd12909d831cc56cbbac4622082221a8768d1d0901ffffffff0200"
+    "ca9a3b00000000434104ae1a62fe09c5f51b13905f07f06b99a2f7159b2225f374cd378d71302fa2"
+    "8414e7aab37397f554a7df5f142c21c1b7303b8a0626f1baded5c72a704f7e6cd84cac00286bee00"
+    "00000043410411db93e1dcdb8a016b49840f8c53bc1eb68a382e97b1482ecad7b148a6909a5cb2e0"
+    "eaddfb84ccf9744464f82e160bfa9b8b64f9d4c03f999b8643f656b412a3ac00000000"
+)
+SATOSHI_PUBKEY = bytes.fromhex(
+    "0411db93e1dcdb8a016b49840f8c53bc1eb68a382e97b1482ecad7b148a6909a5cb2e0eaddfb84cc"
+    "f9744464f82e160bfa9b8b64f9d4c03f999b8643f656b412a3"
+)
+HAL_PUBKEY = bytes.fromhex(
+    "04ae1a62fe09c5f51b13905f07f06b99a2f7159b2225f374cd378d71302fa28414e7aab37397f554"
+    "a7df5f142c21c1b7303b8a0626f1baded5c72a704f7e6cd84c"
+)
+FIRST_PAYMENT_SIGNATURE = bytes.fromhex(
+    "304402204e45e16932b8af514961a1d3a1a25fdf3f4f7732e9d624c6c61548ab5fb8cd4102201815"
+    "22ec8eca07de4860a4acdd12909d831cc56cbbac4622082221a8768d1d09"
+)
+
+
+def p2pk(pubkey):
+    return push(pubkey) + b"\xac"
+
+
+def compress(pubkey):
+    return bytes([2 + (pubkey[-1] & 1)]) + pubkey[1:33]
+
+
+def first_payment():
+    txin = TxIn(
+        "0437cd7f8525ceed2324359c2d0ba26006d92d856a9c20fa0241106ee5a597c9",
+        0,
+        5_000_000_000,
+        p2pk(SATOSHI_PUBKEY),
+        sequence=0xFFFFFFFF,
+    )
+    txin.script_sig = push(FIRST_PAYMENT_SIGNATURE + b"\x01")
+    outputs = [(1_000_000_000, p2pk(HAL_PUBKEY)), (4_000_000_000, p2pk(SATOSHI_PUBKEY))]
+    return Transaction([txin], outputs, version=1)
+
+
+def test_serializes_a_known_transaction():
+    tx = first_payment()
+    assert tx.serialize().hex() == FIRST_PAYMENT
+    assert tx.txid == FIRST_PAYMENT_TXID
+
+
+def test_signature_hash_of_a_known_transaction():
+    digest = first_payment().signature_hash(0)
+    pubkey = compress(SATOSHI_PUBKEY)
+    assert secp256k1.verify(pubkey, digest, FIRST_PAYMENT_SIGNATURE)
+    assert not secp256k1.verify(
+        pubkey, first_payment().signature_hash(0, sighash=2), FIRST_PAYMENT_SIGNATURE
+    )
+
+
+@pytest.mark.parametrize(
+    "n, encoded",
+    [
+        (0xFC, "fc"),
+        (0xFD, "fdfd00"),
+        (0x10000, "fe00000100"),
+        (2**32, "ff0000000001000000"),
+    ],
+)
+def test_varint(n, encoded):
+    assert varint(n).hex() == encoded
+
+
+@pytest.mark.parametrize(
+    "length, prefix", [(0, "00"), (75, "4b"), (76, "4c4c"), (256, "4d0001")]
+)
+def test_push(length, prefix):
+    assert push(b"\x01" * length).hex().startswith(prefix)
+    assert len(push(b"\x01" * length)) == len(prefix) // 2 + length
+
+
+def test_sign_refund():
+    secret = 0xC0FFEE
+    pubkey = secp256k1.public_key(secret)
+    # the second script starts OP_SHA256, as scripts paying to a refund public key do
+    scripts = [swap_script(600_000), bytes([0xA8]) + swap_script(600_010)[2:]]
+    tx = Transaction(
+        [
+            TxIn("ab" * 32, 1, 20_000, scripts[0]),
+            TxIn("cd" * 32, 0, 30_000, scripts[1]),
+        ],
+        [(49_000, bytes.fromhex("0014") + b"\x44" * 20)],
+        locktime=600_010,
+    )
+    estimate = estimate_size(tx)
+    sign_refund(tx, [(secret, pubkey), (secret, pubkey)])
+
+    assert len(tx.serialize()) <= estimate
+    for index, txin in enumerate(tx.inputs):
+        signature, key, redeem_script = script_pushes(txin.script_sig)
+        assert redeem_script == scripts[index]
+        # the public key hash form is given the key, the public key form a dummy
+        assert key == (pubkey if index == 0 else b"")
+        assert signature[-1] == 1
+        assert secp256k1.verify(pubkey, tx.signature_hash(index), signature[:-1])
+
+
+def test_refund_script_sig_rejects_other_scripts():
+    with pytest.raises(ValueError):
+        refund_script_sig(b"sig", b"key", p2pk(SATOSHI_PUBKEY))
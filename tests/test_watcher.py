@@ -0,0 +1,160 @@
+import time
+
+import pytest
+
+from sub_ln.api import upstream, watcher
+from sub_ln.bitcoin.tracker import ConfirmationTracker
+from sub_ln.database import db, events
+
+PAID = {"payment_secret": "11" * 32, "transaction_id": "claim1"}
+
+
+@pytest.fixture
+def chain_height(monkeypatch, rpc):
+    tracker = ConfirmationTracker(rpc, "testnet")
+    tracker.height = 100
+    monkeypatch.setattr(upstream, "confirmation_tracker", lambda network: tracker)
+    return tracker
+
+
+def add_swap(uuid, txid=None, timeout=500, gateway=None):
+    db.add_order(uuid, "message", "testnet", gateway=gateway)
+    db.add_swap(
+        uuid,
+        {
+            "swap_p2sh_address": f"2N{uuid}",
+            "invoice": "lntb1",
+            "redeem_script": "00",
+            "timeout_block_height": timeout,
+        },
+    )
+    if txid:
+        db.add_txid(uuid, txid)
+    return db.lookup_swap_check(uuid)
+
+
+def state(uuid):
+    return db.lookup_swap_check(uuid)["state"]
+
+
+def test_unfunded_swaps_never_expire(database, submarine, chain_height):
+    swap = add_swap("u1")
+    chain_height.height = 600
+    watcher.update_swap("u1", swap)
+    assert state("u1") == db.STATE_SWAP_QUOTED
+
+
+def test_swaps_dont_expire_on_errors(database, submarine, chain_height):
+    swap = add_swap("u1", txid="fund1")
+    chain_height.height = 600
+    submarine.respond(502)
+    watcher.update_swap("u1", swap)
+    assert state("u1") == db.STATE_SWAP_FUNDED
+
+
+def test_swaps_dont_expire_before_the_timeout(database, submarine, chain_height):
+    swap = add_swap("u1", txid="fund1")
+    chain_height.height = 499
+    watcher.update_swap("u1", swap)
+    assert state("u1") == db.STATE_SWAP_FUNDED
+
+
+def test_expired_swaps_can_still_complete(database, submarine, chain_height):
+    swap = add_swap("u1", txid="fund1")
+    chain_height.height = 600
+    watcher.update_swap("u1", swap)
+    assert swap["state"] == state("u1") == db.STATE_SWAP_EXPIRED
+
+    submarine.respond(200, PAID)
+    watcher.update_swap("u1", db.lookup_swap_check("u1"))
+    swap = db.lookup_swap_check("u1")
+    assert swap["state"] == db.STATE_SWAP_COMPLETE
+    assert swap["claim_txid"] == "claim1"
+
+
+def test_swaps_with_an_outcome_are_unwatched(database, submarine, chain_height):
+    swap = add_swap("u1", txid="fund1")
+    chain_height.watch("u1", txid="fund1")
+    watcher.update_swap("u1", swap)
+    assert chain_height.pending == 1
+    submarine.respond(200, PAID)
+    watcher.update_swap("u1", swap)
+    assert chain_height.pending == 0
+
+
+def test_only_funded_swaps_are_refundable(database):
+    add_swap("u1")
+    add_swap("u2", txid="fund2")
+    # expired before expiry needed a funding transaction
+    db.expire_swap("u1")
+    db.expire_swap("u2")
+    assert [row["uuid"] for row in db.lookup_refundable("testnet", 600, 10)] == ["u2"]
+
+
+def test_only_gateway_orders_are_watched(database, submarine, chain_height):
+    add_swap("direct", txid="fund1")
+    add_swap("relayed", txid="fund2", gateway="gw1")
+    submarine.respond(200, PAID)
+    watcher.OrderWatcher(max_rate=0).check_swaps()
+
+    assert len(submarine.calls) == 1
+    assert state("relayed") == db.STATE_SWAP_COMPLETE
+    assert state("direct") == db.STATE_SWAP_FUNDED
+    (event,) = events.lookup_events("gw1", 0, 10)
+    assert (event["uuid"], event["type"]) == ("relayed", "invoice_paid")
+    # the payment secret isn't sent to the gateway
+    assert event["data"] == {"claim_txid": "claim1"}
+
+
+def test_calls_are_spread_out(database, submarine, chain_height):
+    for i in range(3):
+        add_swap(f"u{i}", txid=f"fund{i}", gateway="gw1")
+    t0 = time.monotonic()
+    watcher.OrderWatcher(max_rate=20).check_swaps()
+    assert len(submarine.calls) == 3
+    assert time.monotonic() - t0 >= 2 / 20
+
+
+def test_rounds_carry_on_where_the_last_stopped(database, submarine, chain_height):
+    for i in range(3):
+        add_swap(f"u{i}", txid=f"fund{i}", gateway="gw1")
+    order_watcher = watcher.OrderWatcher(batch=2, max_rate=0)
+    for _ in range(3):
+        order_watcher.check_swaps()
+    assert [call["invoice"] for call in submarine.calls] == ["lntb1"] * 5
+
+
+def test_reports_blocksat_transmission(database, submarine, blocksat, chain_height):
+    add_swap("u1", txid="fund1", gateway="gw1")
+    db.add_blocksat(
+        "u1",
+        "https://api.blockstream.space/testnet",
+        {
+            "uuid": "blocksat1",
+            "auth_token": "token",
+            "lightning_invoice": {
+                "created_at": 0,
+                "description": "",
+                "expires_at": 0,
+                "id": "invoice1",
+                "metadata": {"sha256_message_digest": "ab" * 32},
+                "msatoshi": "1000",
+                "payreq": "lntb1",
+                "rhash": "00",
+                "status": "unpaid",
+            },
+        },
+    )
+    db.check_swap("u1", "11" * 32, "claim1")
+    order_watcher = watcher.OrderWatcher(max_rate=0)
+    for status in ("transmitting", "transmitting", "sent"):
+        blocksat.respond(200, {"status": status})
+        order_watcher.check_blocksat()
+    # sent is final, so it isn't asked again
+    order_watcher.check_blocksat()
+    assert len(blocksat.calls) == 3
+
+    assert [e["type"] for e in events.lookup_events("gw1", 0, 10)] == [
+        "blocksat_transmitted"
+    ]
+    assert db.lookup_unsent_blocksat(None, 10) == []
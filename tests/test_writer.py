@@ -0,0 +1,78 @@
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from sub_ln.database import db
+from sub_ln.database.writer import GroupCommitWriter
+
+
+def concurrently(*funcs):
+    """Run each func in its own thread, returning what each returned or raised."""
+    results = [None] * len(funcs)
+
+    def run(i, func):
+        try:
+            results[i] = func()
+        except Exception as e:
+            results[i] = e
+
+    threads = [
+        threading.Thread(target=run, args=(i, func)) for i, func in enumerate(funcs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_writes_share_a_transaction(database):
+    db.enable_group_commit(max_batch=4, max_delay=0.5)
+    concurrently(*[lambda i=i: db.add_order(f"u{i}", "m", "testnet") for i in range(4)])
+    (stats,) = db.group_commit_stats()
+    assert (stats["batches"], stats["writes"], stats["retried"]) == (1, 4, 0)
+    assert len(db.list_orders()[0]) == 4
+
+
+def test_a_failing_write_only_fails_its_own_caller(database):
+    db.add_order("taken", "m", "testnet")
+    db.enable_group_commit(max_batch=3, max_delay=0.5)
+    results = concurrently(
+        lambda: db.add_order("u1", "m", "testnet"),
+        lambda: db.add_order("taken", "m", "testnet"),
+        lambda: db.add_order("u2", "m", "testnet"),
+    )
+    assert isinstance(results[1], IntegrityError)
+    assert results[0] is None and results[2] is None
+    (stats,) = db.group_commit_stats()
+    # the batch was rolled back and each write committed on its own
+    assert (stats["batches"], stats["retried"]) == (1, 3)
+    assert {row["uuid"] for row in db.list_orders()[0]} == {"taken", "u1", "u2"}
+
+
+def test_results_are_returned_to_each_caller(database):
+    db.add_order("u1", "m", "testnet")
+    db.add_swap("u1", {"swap_p2sh_address": "2Nswap1"})
+    db.add_txid("u1", "fund1")
+    db.enable_group_commit(max_batch=2, max_delay=0.5)
+    results = concurrently(
+        lambda: db.expire_swap("u1"),
+        lambda: db.set_blocksat_status("missing", "paid"),
+    )
+    assert results == [True, False]
+
+
+def test_stopping_commits_the_batch_being_gathered(database):
+    engine = db.storage.engines[0]
+    writer = GroupCommitWriter(engine, max_batch=64, max_delay=5)
+    insert = db.orders.insert().values(uuid="u1", network="testnet")
+    thread = threading.Thread(target=writer.write, args=(lambda c: c.execute(insert),))
+    thread.start()
+    time.sleep(0.1)
+    t0 = time.monotonic()
+    writer.stop()
+    thread.join()
+    # without waiting out max_delay
+    assert time.monotonic() - t0 < 1
+    assert db.lookup_network("u1") == "testnet"